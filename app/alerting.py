@@ -0,0 +1,265 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import pytz
+from sqlalchemy.exc import IntegrityError
+
+from .database import SessionLocal
+from .dedup import DedupEntry
+from .models import WebhookSendSlot, get_naive_shanghai_time
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowLimiter:
+    """滑动窗口限流
+
+    企业微信机器人每分钟最多发送20条消息。保存最近 rate_per_minute 次发送的时间，
+    最早的一次超过60秒后才允许再次发送，名额用完时阻塞等待，保证任意一分钟内的发送次数不超过配额。
+    只在当前进程内计数，多个进程发送告警时使用 SqlSlidingWindowLimiter。
+    """
+
+    window_seconds = 60
+
+    def __init__(self, rate_per_minute: Optional[int] = None):
+        self.rate_per_minute = rate_per_minute or int(os.getenv("WEBHOOK_RATE_PER_MINUTE", "20"))
+        self._sent = deque()  # 最近一个窗口内的发送时间（time.monotonic）
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """尝试占用一次发送名额，成功返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and self._sent[0] <= now - self.window_seconds:
+                self._sent.popleft()
+            if len(self._sent) < self.rate_per_minute:
+                self._sent.append(now)
+                return 0
+            return self._sent[0] + self.window_seconds - now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """占用一次发送名额，超过 timeout 秒仍未取到时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SqlSlidingWindowLimiter(SlidingWindowLimiter):
+    """多个进程共享的滑动窗口限流
+
+    webhook_send_slots 表中最多保存 rate_per_minute 个槽位，每个槽位记录一次发送时间；
+    发送前锁定全部槽位，最早的一次超过60秒时改为当前时间。API进程和各个worker共用同一个配额。
+    数据库不可用时退回进程内计数，宁可超出配额也不漏发告警。
+    """
+
+    def __init__(self, rate_per_minute: Optional[int] = None, session_factory=SessionLocal):
+        super().__init__(rate_per_minute)
+        self.session_factory = session_factory
+
+    def _reserve_once(self) -> float:
+        db = self.session_factory()
+        try:
+            now = get_naive_shanghai_time()
+            slots = db.query(WebhookSendSlot)\
+                .filter(WebhookSendSlot.slot < self.rate_per_minute)\
+                .order_by(WebhookSendSlot.sent_at)\
+                .with_for_update()\
+                .all()
+            if len(slots) < self.rate_per_minute:
+                used = {slot.slot for slot in slots}
+                free = next(i for i in range(self.rate_per_minute) if i not in used)
+                db.add(WebhookSendSlot(slot=free, sent_at=now))
+            elif slots[0].sent_at <= now - timedelta(seconds=self.window_seconds):
+                slots[0].sent_at = now
+            else:
+                db.rollback()
+                return (slots[0].sent_at + timedelta(seconds=self.window_seconds) - now).total_seconds()
+            db.commit()
+            return 0
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _reserve(self) -> float:
+        try:
+            try:
+                return self._reserve_once()
+            except IntegrityError:
+                # 其他进程同时占用了同一个新槽位，重新读取
+                return self._reserve_once()
+        except Exception as e:
+            logger.warning(f"读取发送限流记录失败: {str(e)}")
+            return super()._reserve()
+
+
+def create_rate_limiter(kind: Optional[str] = None) -> SlidingWindowLimiter:
+    """按 WEBHOOK_RATE_STORE 创建发送限流：database（默认，多个进程共享配额）或 memory（仅当前进程）"""
+    kind = (kind or os.getenv("WEBHOOK_RATE_STORE", "database")).lower()
+    if kind == "memory":
+        return SlidingWindowLimiter()
+    if kind == "database":
+        return SqlSlidingWindowLimiter()
+    raise ValueError(f"未知的WEBHOOK_RATE_STORE: {kind}")
+
+
+class _AlertGroup:
+    """同一应用、同一特征值在一个汇总周期内的告警"""
+
+    def __init__(self, error_info: dict, analysis: str):
+        self.error_info = error_info
+        self.analysis = analysis
+        self.count = 0  # 本周期内出现次数
+        self.total = 0  # 去重窗口内累计次数
+        self.first_seen: Optional[datetime] = None
+        self.is_new = False  # 本周期内首次出现，需要附带分析结果
+        self.summarize = False  # 重复错误达到汇总条件（每10次或距首次出现超过1小时）
+
+
+class AlertAggregator:
+    """告警汇总
+
+    在 window_seconds 内收集告警，按应用ID和错误特征值分组，周期结束时每个应用发送一条汇总消息。
+    新出现的错误附带分析结果，重复错误只在达到汇总条件时列出次数。
+    """
+
+    def __init__(self, send: Callable[[str], bool], truncate: Callable[[str, int], str],
+                 window_seconds: Optional[float] = None, max_content_length: int = 4000):
+        self.send = send
+        self.truncate = truncate
+        self.window_seconds = window_seconds or float(os.getenv("ALERT_WINDOW_SECONDS", "60"))
+        self.max_content_length = max_content_length
+        self._groups: Dict[str, Dict[str, _AlertGroup]] = {}  # application_id -> fingerprint -> 分组
+        self._window_start: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, error_info: dict, analysis: str, fingerprint: str, entry: DedupEntry):
+        now = datetime.now(pytz.timezone('Asia/Shanghai'))
+        application_id = error_info.get("application_id") or "未知应用"
+        with self._lock:
+            if self._window_start is None:
+                self._window_start = now
+            group = self._groups.setdefault(application_id, {}).get(fingerprint)
+            if group is None:
+                group = _AlertGroup(error_info, analysis)
+                self._groups[application_id][fingerprint] = group
+            group.count += entry.added
+            group.total = max(group.total, entry.count)
+            group.first_seen = group.first_seen or entry.first_seen
+            if entry.is_new:
+                group.is_new = True
+                group.error_info, group.analysis = error_info, analysis
+            else:
+                hours = (now.replace(tzinfo=None) - entry.first_seen).total_seconds() / 3600
+                if entry.crossed(10) or hours >= 1:
+                    group.summarize = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="alert-aggregator", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while not self._wakeup.wait(self.window_seconds):
+            self.flush()
+
+    def flush(self) -> int:
+        """发送当前周期的汇总消息，返回发送成功的条数"""
+        with self._flush_lock:
+            with self._lock:
+                groups, self._groups = self._groups, {}
+                window_start, self._window_start = self._window_start, None
+            sent = 0
+            for application_id, app_groups in groups.items():
+                content = self._build_digest(application_id, list(app_groups.values()), window_start)
+                if content is None:
+                    continue
+                logger.info(f"发送汇总告警: {application_id}, 消息总长度: {len(content)} chars")
+                if self.send(content):
+                    sent += 1
+            return sent
+
+    def close(self):
+        """停止定时汇总并发送剩余的告警"""
+        self._wakeup.set()
+        self.flush()
+
+    def _build_digest(self, application_id: str, groups: List[_AlertGroup],
+                      window_start: Optional[datetime]) -> Optional[str]:
+        new_groups = sorted((g for g in groups if g.is_new), key=lambda g: g.count, reverse=True)
+        repeated = sorted((g for g in groups if not g.is_new and g.summarize), key=lambda g: g.total, reverse=True)
+        if not new_groups and not repeated:
+            return None  # 只有未达到汇总条件的重复错误，本周期不打扰
+
+        now = datetime.now(pytz.timezone('Asia/Shanghai'))
+        start = (window_start or now).strftime('%Y-%m-%d %H:%M:%S')
+        header = f"""### 系统异常告警（汇总）
+> 统计周期：{start} ~ {now.strftime('%H:%M:%S')}
+> 应用ID：<font color=\"warning\">{application_id}</font>
+> 新错误：{len(new_groups)}类，共{sum(g.count for g in new_groups)}次"""
+        sections: List[str] = []
+        omitted = 0
+        # 为结尾的"未展示"提示预留空间
+        budget = self.max_content_length - len(header) - 40
+
+        for index, group in enumerate(new_groups, 1):
+            if budget < 200:
+                omitted += 1
+                continue
+            # 剩余类别平均分配剩余长度，单条告警不超过2000字符
+            share = min(2000, budget // (len(new_groups) - index + 1 + (1 if repeated else 0)))
+            error_limit = max(share // 2 - 80, 50)
+            analysis_limit = max(share // 2, 50)
+            section = self._render_new_group(index, group, error_limit, analysis_limit)
+            # 模板、请求路径和最小长度可能超出分到的长度，按实际渲染结果缩短分析结果，仍放不下时不展示
+            overflow = len(section) - budget
+            if overflow > 0 and analysis_limit - overflow >= 50:
+                section = self._render_new_group(index, group, error_limit, analysis_limit - overflow)
+            if len(section) > budget:
+                omitted += 1
+                continue
+            budget -= len(section)
+            sections.append(section)
+
+        if repeated:
+            title = "\n\n**持续出现的错误**："
+            budget -= len(title)
+            lines: List[str] = []
+            for group in repeated:
+                line = (f"\n- {self.truncate(group.error_info.get('Exception', '').split(chr(10))[0], 80)}："
+                        f"本周期{group.count}次，累计{group.total}次，"
+                        f"首次出现{group.first_seen.strftime('%Y-%m-%d %H:%M:%S')}")
+                if len(line) > budget:
+                    omitted += 1
+                    continue
+                budget -= len(line)
+                lines.append(line)
+            if lines:
+                sections.append(title + "".join(lines))
+
+        content = header + "".join(sections)
+        if omitted:
+            content += f"\n\n另有{omitted}类错误未展示"
+        return content
+
+    def _render_new_group(self, index: int, group: _AlertGroup, error_limit: int, analysis_limit: int) -> str:
+        request_path = self.truncate(group.error_info.get("request_path") or "未知路径", 200)
+        return f"""
+
+**{index}. 异常信息**（本周期{group.count}次，请求路径：{request_path}）：
+{self.truncate(group.error_info.get("Exception", ""), error_limit)}
+
+**DeepSeek分析结果**：
+{self.truncate(group.analysis, analysis_limit)}"""
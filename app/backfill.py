@@ -0,0 +1,162 @@
+"""从文件导入历史错误日志并分析入库
+
+读取ES导出的NDJSON或原始应用日志（支持.gz），经过与定时任务相同的分析流水线
+（归一化、分析缓存、LLM分析、入库），用于补录历史数据或事故复盘，不需要连接Elasticsearch。
+
+用法（在项目根目录执行）：
+    python -m app.backfill logs/2025-03-16.ndjson.gz logs/app/ --workers 4
+    python -m app.backfill export.ndjson --since 2025-03-16T08:00 --until 2025-03-16T12:00
+    python -m app.backfill app.log --dry-run   # 只解析，统计错误条数和读取速度
+
+默认不发送企业微信告警，需要时加 --alert。已入库的记录（按ES文档ID或文件偏移）会被跳过，可以重复执行。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import List, NamedTuple, Optional
+
+import pytz
+
+from .cache import AnalysisCache
+from .config import configure_logging
+from .database import SessionLocal
+from .file_source import FileLogSource, FileRange, split_file
+from .migrate import migrate
+from .pipeline import AnalysisPipeline
+from .services import DeepseekService, WeChatService
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillOptions(NamedTuple):
+    file_format: Optional[str]
+    since: Optional[datetime]
+    until: Optional[datetime]
+    application_id: Optional[str]
+    timezone: str
+    alert: bool
+    dry_run: bool
+
+
+class RangeResult(NamedTuple):
+    file_range: FileRange
+    read: int  # 读取的记录数
+    errors: int  # 其中的错误日志条数（dry-run）或本次新入库的条数
+    skipped: int  # 无法解析的行数
+    seconds: float
+
+
+def _expand_paths(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith("."))
+        else:
+            files.append(path)
+    return files
+
+
+def _parse_time(value: Optional[str], timezone: str) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(timezone).localize(parsed)
+    return parsed
+
+
+def process_range(file_range: FileRange, options: BackfillOptions) -> RangeResult:
+    """处理一个读取单元，在工作进程中执行，每个进程使用独立的数据库会话和HTTP连接池"""
+    started = time.perf_counter()
+    source = FileLogSource(file_range, options.file_format, options.since, options.until,
+                           options.application_id, options.timezone)
+    if options.dry_run:
+        errors = sum(1 for _ in source.iter_errors_since())
+        return RangeResult(file_range, source.read, errors, source.skipped, time.perf_counter() - started)
+
+    wechat_service = WeChatService() if options.alert else None
+    pipeline = AnalysisPipeline(source, DeepseekService(), wechat_service, AnalysisCache(), checkpoint_name=None)
+    db = SessionLocal()
+    try:
+        processed = asyncio.run(pipeline.run(db))
+    finally:
+        db.close()
+        if wechat_service is not None:
+            wechat_service.flush_alerts()
+        pipeline.executor.shutdown()
+        pipeline.db_executor.shutdown()
+    return RangeResult(file_range, source.read, processed, source.skipped, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从NDJSON或日志文件导入并分析错误日志")
+    parser.add_argument("paths", nargs="+", help="文件或目录，目录下的文件全部导入")
+    parser.add_argument("--format", choices=["auto", "ndjson", "log"], default="auto",
+                        help="文件格式，auto按扩展名和内容判断")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行的工作进程数")
+    parser.add_argument("--chunk-mb", type=int, default=256, help="未压缩的大文件按此大小切分后并行处理")
+    parser.add_argument("--since", help="只导入此时间之后的日志，不带时区时按 --timezone 解释")
+    parser.add_argument("--until", help="只导入此时间之前的日志")
+    parser.add_argument("--application-id", help="原始日志的应用ID，默认取文件所在目录名")
+    parser.add_argument("--timezone", default="Asia/Shanghai", help="原始日志中不带时区的时间戳所在时区")
+    parser.add_argument("--alert", action="store_true", help="同时发送企业微信告警")
+    parser.add_argument("--dry-run", action="store_true", help="只解析文件，不分析也不入库")
+    args = parser.parse_args()
+
+    configure_logging()
+    options = BackfillOptions(
+        None if args.format == "auto" else args.format,
+        _parse_time(args.since, args.timezone),
+        _parse_time(args.until, args.timezone),
+        args.application_id,
+        args.timezone,
+        args.alert,
+        args.dry_run,
+    )
+    ranges = [
+        file_range
+        for path in _expand_paths(args.paths)
+        for file_range in split_file(path, args.chunk_mb * 1024 * 1024)
+    ]
+    if not ranges:
+        parser.error("没有找到要导入的文件")
+    if not args.dry_run:
+        migrate()
+
+    total_bytes = sum(os.path.getsize(path) for path in {r.path for r in ranges})
+    workers = max(1, min(args.workers, len(ranges)))
+    logger.info(f"导入 {len(ranges)} 个读取单元，共 {total_bytes / 1024 / 1024:.1f}MB，{workers} 个工作进程")
+
+    started = time.perf_counter()
+    results: List[RangeResult] = []
+    if workers == 1:
+        for file_range in ranges:
+            results.append(process_range(file_range, options))
+            logger.info(f"完成 {file_range.path}: {results[-1].errors} 条")
+    else:
+        # 使用spawn启动工作进程，每个进程重新创建数据库连接池，不与父进程共享连接
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+            futures = [executor.submit(process_range, file_range, options) for file_range in ranges]
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                logger.info(f"完成 {result.file_range.path} [{result.file_range.start}:"
+                            f"{result.file_range.end or ''}]: {result.errors} 条，{result.seconds:.1f}s")
+    elapsed = time.perf_counter() - started
+
+    read = sum(r.read for r in results)
+    errors = sum(r.errors for r in results)
+    skipped = sum(r.skipped for r in results)
+    action = "错误日志" if args.dry_run else "新入库"
+    print(f"读取 {read} 条记录，{action} {errors} 条，无法解析 {skipped} 行，"
+          f"耗时 {elapsed:.1f}s（{total_bytes / 1024 / 1024 / max(elapsed, 1e-6):.1f}MB/s）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""错误日志大字段的内容寻址存储
+
+同一类错误的堆栈和分析结果在 error_logs 中大量重复，超过 BLOB_INLINE_CHARS 的文本
+按SHA-256存入 blobs 表（相同内容只存一份，按 BLOB_COMPRESSION 压缩），
+error_logs 中只保留前 BLOB_INLINE_CHARS 个字符作为预览和对应的哈希值。
+没有哈希值的记录（较短的文本或升级前的记录）预览即为全文。
+
+已有记录可以执行 python -m app.blobs 迁移到 blobs 表。
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from .config import configure_logging
+from .models import Blob, ErrorLog
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，BLOB_COMPRESSION=zstd 时才需要
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+# 超过该长度的文本存入blobs表，error_logs中保留该长度的预览
+INLINE_CHARS = int(os.getenv("BLOB_INLINE_CHARS", "500"))
+# 压缩方式：zlib（默认）、zstd（需要安装zstandard）或 none
+COMPRESSION = os.getenv("BLOB_COMPRESSION", "zlib").lower()
+if COMPRESSION not in ("zlib", "zstd", "none"):
+    raise ValueError(f"不支持的BLOB_COMPRESSION: {COMPRESSION}")
+if COMPRESSION == "zstd" and zstandard is None:
+    raise ValueError("BLOB_COMPRESSION=zstd 需要安装zstandard")
+
+# 最近写入过的哈希值，命中时不再重复压缩和写库
+_RECENT_SIZE = 10000
+_recent: "OrderedDict[str, None]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode(text: str) -> Tuple[str, bytes]:
+    """按配置压缩，压缩后没有变小时原样保存，返回 (编码方式, 数据)"""
+    raw = text.encode("utf-8")
+    if COMPRESSION == "zlib":
+        data = zlib.compress(raw, 6)
+    elif COMPRESSION == "zstd":
+        data = zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        return "raw", raw
+    return (COMPRESSION, data) if len(data) < len(raw) else ("raw", raw)
+
+
+def decode(encoding: str, data: bytes) -> str:
+    if encoding == "zlib":
+        data = zlib.decompress(data)
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("读取zstd压缩的内容需要安装zstandard")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return data.decode("utf-8")
+
+
+class BlobBatch:
+    """收集一批待写入的大文本，与日志在同一事务中写入blobs表"""
+
+    def __init__(self):
+        self._pending: Dict[str, str] = {}
+
+    def put(self, text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (error_logs中保存的预览, 哈希值)，较短的文本原样返回，哈希值为None"""
+        if text is None or len(text) <= INLINE_CHARS:
+            return text, None
+        digest = content_hash(text)
+        with _recent_lock:
+            known = digest in _recent
+        if not known:
+            self._pending[digest] = text
+        return text[:INLINE_CHARS], digest
+
+    def pack_row(self, row: dict) -> dict:
+        """把 error_logs 行中的错误内容和分析结果替换为预览和哈希值，返回新的行"""
+        packed = dict(row)
+        packed["error_message"], packed["message_hash"] = self.put(row["error_message"])
+        packed["analysis_result"], packed["analysis_hash"] = self.put(row.get("analysis_result"))
+        return packed
+
+    def write(self, db: Session):
+        """写入尚未保存的内容，已存在的哈希值忽略；不提交，提交后调用 committed"""
+        if not self._pending:
+            return
+        rows = []
+        for digest, text in sorted(self._pending.items()):
+            encoding, data = encode(text)
+            rows.append({"hash": digest, "encoding": encoding, "data": data, "size": len(text)})
+        stmt = insert(Blob).values(rows)\
+            .prefix_with("IGNORE", dialect="mysql")\
+            .prefix_with("OR IGNORE", dialect="sqlite")
+        db.execute(stmt)
+
+    def committed(self):
+        """事务提交后记录已写入的哈希值"""
+        with _recent_lock:
+            for digest in self._pending:
+                _recent[digest] = None
+                _recent.move_to_end(digest)
+            while len(_recent) > _RECENT_SIZE:
+                _recent.popitem(last=False)
+        self._pending.clear()
+
+
+def resolve(db: Session, hashes: Iterable[Optional[str]]) -> Dict[str, str]:
+    """批量读取哈希值对应的全文"""
+    wanted = sorted({digest for digest in hashes if digest})
+    texts = {}
+    for i in range(0, len(wanted), 500):
+        for digest, encoding, data in db.query(Blob.hash, Blob.encoding, Blob.data)\
+                .filter(Blob.hash.in_(wanted[i:i + 500])):
+            texts[digest] = decode(encoding, data)
+    return texts
+
+
+def full_text(preview: Optional[str], digest: Optional[str], texts: Dict[str, str]) -> Optional[str]:
+    """按 resolve 的结果还原全文，内容缺失时返回预览"""
+    if digest is None:
+        return preview
+    return texts.get(digest, preview)
+
+
+def migrate_existing(db: Session, batch_size: int = 1000) -> int:
+    """把升级前写入的较长文本移到blobs表，返回迁移的记录数"""
+    last_id, migrated = 0, 0
+    while True:
+        logs: List[ErrorLog] = db.query(ErrorLog)\
+            .filter(ErrorLog.id > last_id)\
+            .filter(((ErrorLog.message_hash.is_(None)) & (func.length(ErrorLog.error_message) > INLINE_CHARS)) |
+                    ((ErrorLog.analysis_hash.is_(None)) & (func.length(ErrorLog.analysis_result) > INLINE_CHARS)))\
+            .order_by(ErrorLog.id)\
+            .limit(batch_size)\
+            .all()
+        if not logs:
+            return migrated
+        batch = BlobBatch()
+        for log in logs:
+            if log.message_hash is None:
+                log.error_message, log.message_hash = batch.put(log.error_message)
+            if log.analysis_hash is None:
+                log.analysis_result, log.analysis_hash = batch.put(log.analysis_result)
+        batch.write(db)
+        db.commit()
+        batch.committed()
+        last_id, migrated = logs[-1].id, migrated + len(logs)
+        logger.info(f"已迁移 {migrated} 条记录")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把error_logs中已有的较长文本迁移到blobs表")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批处理的记录数")
+    args = parser.parse_args()
+
+    configure_logging()
+    from .database import SessionLocal
+    from .migrate import migrate
+    migrate()
+    db = SessionLocal()
+    try:
+        migrated = migrate_existing(db, args.batch_size)
+    finally:
+        db.close()
+    print(f"迁移完成，共 {migrated} 条记录；MySQL可执行 OPTIMIZE TABLE error_logs 回收空间")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from . import metrics
+from .database import SessionLocal
+from .models import AnalysisCacheEntry, get_shanghai_time
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCache:
+    """错误分析结果缓存
+
+    以错误特征值为键，进程内LRU在前，MySQL的analysis_cache表在后。
+    相同的异常只需调用一次大模型，其余直接命中缓存。
+    数据库中的记录除了过期清理，超过 db_max_rows 条时还会删除最早写入的记录。
+    """
+
+    def __init__(self, max_size: Optional[int] = None, ttl_minutes: Optional[int] = None, session_factory=SessionLocal):
+        self.max_size = max_size or int(os.getenv("ANALYSIS_CACHE_SIZE", "1000"))
+        self.ttl_minutes = ttl_minutes or int(os.getenv("ANALYSIS_CACHE_TTL_MINUTES", "1440"))
+        self.db_max_rows = int(os.getenv("ANALYSIS_CACHE_DB_MAX_ROWS", "100000"))
+        # 清理需要对整张表计数，按间隔执行，不随每批分析执行
+        self.purge_seconds = float(os.getenv("ANALYSIS_CACHE_PURGE_SECONDS", "600"))
+        self._last_purge = 0.0
+        self._purge_lock = threading.Lock()
+        self.session_factory = session_factory
+        self._entries = OrderedDict()  # fingerprint -> (analysis, 过期时间戳)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                return None
+            analysis, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[fingerprint]
+                return None
+            self._entries.move_to_end(fingerprint)
+            return analysis
+
+    def _put_local(self, fingerprint: str, analysis: str, ttl_seconds: float):
+        with self._lock:
+            self._entries[fingerprint] = (analysis, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """查询缓存，先查进程内LRU，未命中再查数据库"""
+        analysis = self._get_local(fingerprint)
+        if analysis is None:
+            analysis = self._get_db(fingerprint)
+        if analysis is None:
+            self.misses += 1
+            metrics.ANALYSIS_CACHE_LOOKUPS_TOTAL.inc(result="miss")
+        else:
+            self.hits += 1
+            metrics.ANALYSIS_CACHE_LOOKUPS_TOTAL.inc(result="hit")
+        return analysis
+
+    def _get_db(self, fingerprint: str) -> Optional[str]:
+        db = self.session_factory()
+        try:
+            now = get_shanghai_time()
+            entry = db.query(AnalysisCacheEntry)\
+                .filter(AnalysisCacheEntry.fingerprint == fingerprint)\
+                .filter(AnalysisCacheEntry.expires_at > now)\
+                .first()
+            if entry is None:
+                return None
+            # 本地缓存的有效期不超过数据库中的剩余有效期
+            remaining = (entry.expires_at - now.replace(tzinfo=None)).total_seconds()
+            self._put_local(fingerprint, entry.analysis_result, remaining)
+            return entry.analysis_result
+        except Exception as e:
+            logger.warning(f"查询分析缓存失败: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    def set(self, fingerprint: str, analysis: str):
+        """写入缓存，同时持久化到数据库"""
+        ttl_seconds = self.ttl_minutes * 60
+        self._put_local(fingerprint, analysis, ttl_seconds)
+
+        db = self.session_factory()
+        try:
+            now = get_shanghai_time()
+            db.merge(AnalysisCacheEntry(
+                fingerprint=fingerprint,
+                analysis_result=analysis,
+                created_at=now,
+                expires_at=now + timedelta(seconds=ttl_seconds),
+            ))
+            db.commit()
+        except Exception as e:
+            logger.warning(f"写入分析缓存失败: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def maybe_purge(self) -> int:
+        """距上次清理超过 purge_seconds 时清理数据库中的缓存记录，返回删除条数"""
+        with self._purge_lock:
+            if self._last_purge and time.monotonic() - self._last_purge < self.purge_seconds:
+                return 0
+            self._last_purge = time.monotonic()
+        return self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """删除数据库中已过期的缓存记录，并把记录数控制在 db_max_rows 以内，返回删除条数"""
+        db = self.session_factory()
+        try:
+            deleted = db.query(AnalysisCacheEntry)\
+                .filter(AnalysisCacheEntry.expires_at <= get_shanghai_time())\
+                .delete(synchronize_session=False)
+            excess = db.query(AnalysisCacheEntry).count() - self.db_max_rows if self.db_max_rows > 0 else 0
+            if excess > 0:
+                # 有效期相同，过期时间最早即最早写入；按 idx_expires_at 找到第 excess 条的过期时间后删除
+                cutoff = db.query(AnalysisCacheEntry.expires_at)\
+                    .order_by(AnalysisCacheEntry.expires_at)\
+                    .offset(excess - 1).limit(1).scalar()
+                deleted += db.query(AnalysisCacheEntry)\
+                    .filter(AnalysisCacheEntry.expires_at <= cutoff)\
+                    .delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            logger.warning(f"清理过期缓存失败: {str(e)}")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+
+class CountCache:
+    """COUNT结果缓存
+
+    大表上的COUNT(*)代价很高，这里按查询条件缓存计数。过期后仍先返回旧值，
+    同时在后台线程中重新计数，请求本身不会等待全表扫描。
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_keys: int = 256, session_factory=SessionLocal):
+        self.ttl_seconds = ttl_seconds or int(os.getenv("LOGS_COUNT_TTL_SECONDS", "60"))
+        self.max_keys = max_keys
+        self.session_factory = session_factory
+        self._values = OrderedDict()  # key -> (count, 计数时间)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _count(self, key, build_query) -> int:
+        db = self.session_factory()
+        try:
+            count = build_query(db).count()
+        finally:
+            db.close()
+        with self._lock:
+            self._values[key] = (count, time.monotonic())
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_keys:
+                self._values.popitem(last=False)
+        return count
+
+    def _refresh(self, key, build_query):
+        try:
+            self._count(key, build_query)
+        except Exception as e:
+            logger.warning(f"后台刷新计数失败: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, build_query) -> int:
+        """返回 key 对应的计数，build_query(db) 需返回用于计数的Query"""
+        with self._lock:
+            cached = self._values.get(key)
+            stale = cached is None or time.monotonic() - cached[1] > self.ttl_seconds
+            start_refresh = cached is not None and stale and key not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(key)
+        if cached is None:
+            return self._count(key, build_query)
+        if start_refresh:
+            threading.Thread(target=self._refresh, args=(key, build_query), daemon=True).start()
+        return cached[0]
@@ -0,0 +1,193 @@
+import abc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from .database import SessionLocal
+from .models import AlertDedupEntry, get_naive_shanghai_time
+
+logger = logging.getLogger(__name__)
+
+
+class DedupEntry(NamedTuple):
+    first_seen: datetime  # 去重窗口内首次出现时间
+    last_seen: datetime  # 本次之前最近一次出现的时间，新消息为本次时间
+    count: int  # 包括本次在内的累计次数
+    added: int = 1  # 本次记录的次数，ES预聚合时为该组的出现次数
+
+    @property
+    def is_new(self) -> bool:
+        """去重窗口内首次出现"""
+        return self.count == self.added
+
+    def crossed(self, every: int) -> bool:
+        """本次记录使累计次数达到或越过 every 的整数倍"""
+        return self.count // every > (self.count - self.added) // every
+
+
+class DedupStore(abc.ABC):
+    """告警去重存储
+
+    以错误特征值为键记录出现次数。某个特征值最近一次出现后 ttl_minutes 内再次出现视为重复，
+    超过后重新计数。最多保留 max_size 个特征值，超出时淘汰最久未出现的。
+    """
+
+    def __init__(self, ttl_minutes: Optional[int] = None, max_size: Optional[int] = None):
+        self.ttl = timedelta(minutes=ttl_minutes or int(os.getenv("DEDUP_TTL_MINUTES", "30")))
+        self.max_size = max_size or int(os.getenv("DEDUP_MAX_SIZE", "10000"))
+
+    @abc.abstractmethod
+    def record(self, key: str, count: int = 1) -> DedupEntry:
+        """记录 count 次出现（ES预聚合的一组错误）并返回记录后的状态，检查和计数在同一次原子操作中完成"""
+
+
+class MemoryDedupStore(DedupStore):
+    """进程内去重存储，重启后丢失，多个worker之间不共享"""
+
+    def __init__(self, ttl_minutes: Optional[int] = None, max_size: Optional[int] = None):
+        super().__init__(ttl_minutes, max_size)
+        # key -> DedupEntry，按最近出现时间排序，过期和淘汰都只需从头部弹出
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: datetime):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_seen + self.ttl > now:
+                break
+            self._entries.popitem(last=False)
+            logger.debug(f"清理过期消息缓存: {key} (发送次数: {entry.count})")
+
+    def record(self, key: str, count: int = 1) -> DedupEntry:
+        now = get_naive_shanghai_time()
+        with self._lock:
+            self._expire(now)
+            previous = self._entries.pop(key, None)
+            if previous is None:
+                result = DedupEntry(now, now, count, count)
+            else:
+                result = DedupEntry(previous.first_seen, previous.last_seen, previous.count + count, count)
+            self._entries[key] = result._replace(last_seen=now)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+
+class SqlDedupStore(DedupStore):
+    """数据库去重存储，保存在alert_dedup表中，多个worker和重启之间共享
+
+    过期记录按 expires_at 索引定期批量删除，不在每次检查时扫描。
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl_minutes: Optional[int] = None,
+                 max_size: Optional[int] = None, purge_seconds: int = 60):
+        super().__init__(ttl_minutes, max_size)
+        self.session_factory = session_factory
+        self.purge_seconds = purge_seconds
+        self._last_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    def _record_once(self, key: str, now: datetime, count: int) -> DedupEntry:
+        db = self.session_factory()
+        try:
+            entry = db.query(AlertDedupEntry)\
+                .filter(AlertDedupEntry.fingerprint == key)\
+                .with_for_update()\
+                .first()
+            if entry is None:
+                db.add(AlertDedupEntry(fingerprint=key, first_seen=now, last_seen=now, count=count,
+                                       expires_at=now + self.ttl))
+                result = DedupEntry(now, now, count, count)
+            elif entry.expires_at <= now:
+                # 已过期但尚未被清理的记录，重新开始计数
+                entry.first_seen, entry.last_seen, entry.count = now, now, count
+                entry.expires_at = now + self.ttl
+                result = DedupEntry(now, now, count, count)
+            else:
+                result = DedupEntry(entry.first_seen, entry.last_seen, entry.count + count, count)
+                entry.last_seen, entry.count = now, entry.count + count
+                entry.expires_at = now + self.ttl
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def record(self, key: str, count: int = 1) -> DedupEntry:
+        now = get_naive_shanghai_time()
+        try:
+            result = self._record_once(key, now, count)
+        except IntegrityError:
+            # 其他进程同时插入了同一特征值，重试一次即按重复消息计数
+            result = self._record_once(key, now, count)
+        self._maybe_purge(now)
+        return result
+
+    def _maybe_purge(self, now: datetime):
+        with self._purge_lock:
+            if time.monotonic() - self._last_purge < self.purge_seconds:
+                return
+            self._last_purge = time.monotonic()
+        db = self.session_factory()
+        try:
+            deleted = db.query(AlertDedupEntry)\
+                .filter(AlertDedupEntry.expires_at <= now)\
+                .delete(synchronize_session=False)
+            excess = db.query(AlertDedupEntry).count() - self.max_size
+            if excess > 0:
+                # 超出上限时淘汰最久未出现的记录
+                cutoff = db.query(AlertDedupEntry.expires_at)\
+                    .order_by(AlertDedupEntry.expires_at)\
+                    .offset(excess - 1)\
+                    .limit(1)\
+                    .scalar()
+                deleted += db.query(AlertDedupEntry)\
+                    .filter(AlertDedupEntry.expires_at <= cutoff)\
+                    .delete(synchronize_session=False)
+            db.commit()
+            if deleted:
+                logger.info(f"清理过期消息缓存 {deleted} 条")
+        except Exception as e:
+            logger.warning(f"清理去重记录失败: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+
+def _sqlite_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+
+    # SQLite 默认的延迟事务在读后写时无法阻止其他进程并发修改，
+    # 这里改为 BEGIN IMMEDIATE，事务开始即获取写锁
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transaction(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    AlertDedupEntry.__table__.create(bind=engine, checkfirst=True)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def create_dedup_store(kind: Optional[str] = None) -> DedupStore:
+    """按 DEDUP_STORE 创建去重存储：database（默认，使用MYSQL_URL的数据库）、sqlite 或 memory"""
+    kind = (kind or os.getenv("DEDUP_STORE", "database")).lower()
+    if kind == "memory":
+        return MemoryDedupStore()
+    if kind == "sqlite":
+        return SqlDedupStore(_sqlite_session_factory(os.getenv("DEDUP_SQLITE_PATH", "dedup.db")))
+    if kind == "database":
+        return SqlDedupStore()
+    raise ValueError(f"不支持的DEDUP_STORE: {kind}")
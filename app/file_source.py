@@ -0,0 +1,286 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+from datetime import datetime
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple
+
+import pytz
+
+from .services import BEIJING_TZ, build_log_entry
+
+
+# 视为错误的日志级别，与 ESService 的查询条件一致：fail 级别，或 info 级别且状态码为501-504；
+# 原始日志文件中再加上常见框架的错误级别写法
+_ERROR_LEVELS = {"fail", "error", "err", "fatal", "ftl", "crit", "critical", "severe"}
+
+# 原始日志的记录开头："2025-03-16 10:08:04.123 +08:00 [ERR] 消息" 或 "2025-03-16 10:08:04,123 ERROR [main] 消息"，
+# 不以时间戳开头的行（堆栈帧、内部异常等）属于上一条记录
+_LOG_RECORD = re.compile(
+    r'^(?P<timestamp>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?)\s?(?P<tz>Z|[+-]\d{2}:?\d{2})?\s+'
+    r'(?:\[(?P<bracket_level>[A-Za-z]+)\]|(?P<level>[A-Za-z]+):?)\s+(?P<message>.*)$'
+)
+_RECORD_START = re.compile(rb'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}')
+
+# 单条原始日志记录最多保留的续行数，避免格式异常的文件把整个文件读成一条记录
+_MAX_CONTINUATION_LINES = 2000
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl", ".json")
+
+
+class FileRange(NamedTuple):
+    """一个读取单元：文件中 [start, end) 字节范围内开始的记录，end 为 None 表示读到文件末尾"""
+    path: str
+    start: int = 0
+    end: Optional[int] = None
+
+
+def detect_format(path: str) -> str:
+    """按扩展名判断格式，无法判断时看第一个非空行是否为JSON对象"""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(NDJSON_SUFFIXES):
+        return "ndjson"
+    with _open(path) as file:
+        for line in file:
+            if line.strip():
+                return "ndjson" if line.lstrip().startswith(b"{") else "log"
+    return "log"
+
+
+def split_file(path: str, chunk_bytes: int) -> List[FileRange]:
+    """把未压缩的大文件按字节数切分为多个读取单元，供多个进程并行读取；gzip文件无法随机访问，整体作为一个单元"""
+    size = os.path.getsize(path)
+    if path.endswith(".gz") or chunk_bytes <= 0 or size <= chunk_bytes:
+        return [FileRange(path)]
+    return [FileRange(path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+
+def _open(path: str) -> IO[bytes]:
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _iter_lines(file_range: FileRange) -> Iterator[Tuple[int, bytes]]:
+    """从范围开头逐行产出 (行首偏移, 行内容)，直到文件末尾，由调用方决定在哪里停止
+
+    未压缩文件通过mmap读取，由操作系统按需换页，不把整个文件读入内存；
+    start 不为0时从 start 之后的第一个完整行开始。
+    """
+    path, start, _ = file_range
+    if path.endswith(".gz"):
+        offset = 0
+        with gzip.open(path, "rb") as file:
+            for line in file:
+                yield offset, line
+                offset += len(line)
+        return
+
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if start > 0:
+                # start 落在某一行中间时，该行属于上一个范围
+                mapped.seek(start - 1)
+                mapped.readline()
+            while True:
+                offset = mapped.tell()
+                line = mapped.readline()
+                if not line:
+                    return
+                yield offset, line
+
+
+def _previous_line(path: str, offset: int) -> bytes:
+    """读取 offset 处所在行的上一行"""
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return mapped[mapped.rfind(b"\n", 0, max(offset - 1, 0)) + 1:offset]
+
+
+def _bulk_action(document) -> Optional[dict]:
+    """bulk格式的操作行 {"index": {"_id": ...}}，返回操作参数；不是操作行时返回None"""
+    if isinstance(document, dict) and len(document) == 1:
+        name, action = next(iter(document.items()))
+        if name in ("index", "create") and isinstance(action, dict):
+            return action
+    return None
+
+
+def _record_id(offset: int, content: bytes) -> str:
+    """没有文档ID的记录用记录偏移和内容生成稳定的ID
+
+    与文件路径无关：从其他挂载点或副本重复导入同一文件时不会重复入库，
+    不同目录下的同名文件内容不同，不会互相覆盖。
+    """
+    digest = hashlib.sha1(str(offset).encode() + b":" + content).hexdigest()
+    return f"file-{digest}"
+
+
+def _field(source: dict, dotted: str):
+    """读取字段，兼容 "Request.Path" 平铺和 {"Request": {"Path": ...}} 嵌套两种写法"""
+    if dotted in source:
+        return source[dotted]
+    value = source
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def is_error_document(source: dict) -> bool:
+    level = str(source.get("LogLevel") or "").lower()
+    if level in _ERROR_LEVELS:
+        return True
+    if level == "info":
+        try:
+            return 501 <= int(_field(source, "Response.StatusCode") or 0) <= 504
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_timestamp(text: str, tz: Optional[str], default_tz) -> datetime:
+    parsed = datetime.fromisoformat(text.replace(",", ".").replace(" ", "T", 1))
+    if tz == "Z":
+        return parsed.replace(tzinfo=pytz.UTC)
+    if tz:
+        return datetime.fromisoformat(f"{parsed.isoformat()}{tz[:3]}:{tz[-2:]}")
+    return default_tz.localize(parsed)
+
+
+class FileLogSource:
+    """从文件读取错误日志，产出与 ESService.iter_errors_since 相同格式的日志对象
+
+    支持两种格式：
+    - ndjson：ES导出的每行一个JSON，可以是带 _id/_source 的命中记录、bulk格式（操作行 + 文档行）或文档本身
+    - log：以时间戳开头的原始应用日志，不以时间戳开头的行（堆栈等）归入上一条记录
+
+    .gz 文件边读边解压；未压缩文件通过mmap读取，可以按字节范围切分给多个进程。
+    since/until 限定日志时间范围，application_id 为原始日志指定应用ID（默认取文件所在目录名）。
+    """
+
+    def __init__(self, file_range: FileRange, file_format: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 application_id: Optional[str] = None, timezone: str = "Asia/Shanghai"):
+        self.file_range = file_range
+        self.file_format = file_format or detect_format(file_range.path)
+        self.since = since
+        self.until = until
+        # 常见的目录结构为 logs/<应用>/app.log，文件名本身通常不能区分应用
+        self.application_id = application_id or os.path.basename(os.path.dirname(os.path.realpath(file_range.path)))
+        self.timezone = pytz.timezone(timezone) if timezone != "Asia/Shanghai" else BEIJING_TZ
+        self.read = 0  # 读取的记录数（含非错误记录）
+        self.skipped = 0  # 无法解析的行数
+
+    def iter_errors_since(self, checkpoint: dict = None, minutes=None, progress: dict = None):
+        """与 ESService 接口一致；文件导入不使用检查点，重复导入时已入库的记录由流水线按ID跳过"""
+        for hit in self._iter_hits():
+            source = hit["_source"]
+            if not is_error_document(source):
+                continue
+            if self.since or self.until:
+                log_time = datetime.fromisoformat(source["@timestamp"].replace("Z", "+00:00"))
+                if (self.since and log_time < self.since) or (self.until and log_time >= self.until):
+                    continue
+            # build_log_entry 按平铺字段名读取
+            for dotted in ("Request.Path", "Response.StatusCode"):
+                value = _field(source, dotted)
+                if value is not None:
+                    source[dotted] = value
+            yield build_log_entry(hit)
+
+    def _iter_hits(self) -> Iterator[dict]:
+        if self.file_format == "ndjson":
+            return self._iter_ndjson()
+        return self._iter_log()
+
+    def _iter_ndjson(self) -> Iterator[dict]:
+        path, start, limit = self.file_range
+        # bulk格式的操作行和文档行属于操作行所在的范围：范围末尾的操作行继续读取下一行，
+        # 范围开头紧跟在操作行之后的文档行跳过
+        pending = False
+        pending_id = None  # 操作行指定的_id
+        first = start > 0
+        for offset, line in _iter_lines(self.file_range):
+            if limit is not None and offset >= limit and not pending:
+                return  # 范围末尾之后开始的行属于下一个范围
+            line = line.strip()
+            if not line:
+                continue
+            if first:
+                first = False
+                try:
+                    if _bulk_action(json.loads(_previous_line(path, offset))) is not None:
+                        continue
+                except ValueError:
+                    pass
+            try:
+                document = json.loads(line)
+            except ValueError:
+                self.skipped += 1
+                continue
+            if not isinstance(document, dict):
+                self.skipped += 1
+                continue
+            action = _bulk_action(document)
+            if action is not None:
+                pending, pending_id = True, action.get("_id")
+                continue
+            self.read += 1
+            if "_source" in document:
+                hit = {"_id": document.get("_id") or _record_id(offset, line),
+                       "_source": document["_source"]}
+            else:
+                hit = {"_id": pending_id or _record_id(offset, line), "_source": document}
+            pending, pending_id = False, None
+            if "@timestamp" not in hit["_source"]:
+                self.skipped += 1
+                continue
+            yield hit
+
+    def _iter_log(self) -> Iterator[dict]:
+        limit = self.file_range.end
+        record = None  # (偏移, 匹配结果, 续行)
+        for offset, raw_line in _iter_lines(self.file_range):
+            if _RECORD_START.match(raw_line):
+                if record is not None:
+                    yield from self._log_hit(*record)
+                    record = None
+                if limit is not None and offset >= limit:
+                    return  # 范围末尾之后开始的记录属于下一个范围
+                match = _LOG_RECORD.match(raw_line.decode("utf-8", "replace").rstrip("\r\n"))
+                if match is None:
+                    self.skipped += 1
+                    continue
+                record = (offset, match, [])
+            elif record is not None and len(record[2]) < _MAX_CONTINUATION_LINES:
+                record[2].append(raw_line.decode("utf-8", "replace").rstrip("\r\n"))
+            # 范围开头不属于任何记录的续行由上一个范围处理
+        if record is not None:
+            yield from self._log_hit(*record)
+
+    def _log_hit(self, offset: int, match: re.Match, continuation: List[str]) -> Iterator[dict]:
+        self.read += 1
+        level = (match.group("bracket_level") or match.group("level")).lower()
+        if level not in _ERROR_LEVELS:
+            return
+        try:
+            log_time = _parse_timestamp(match.group("timestamp"), match.group("tz"), self.timezone)
+        except ValueError:
+            self.skipped += 1
+            return
+        while continuation and not continuation[-1].strip():
+            continuation.pop()
+        content = "\n".join([match.string, *continuation]).encode("utf-8")
+        yield {
+            "_id": _record_id(offset, content),
+            "_source": {
+                "@timestamp": log_time.astimezone(pytz.UTC).isoformat().replace("+00:00", "Z"),
+                "LogLevel": "fail",
+                "ApplicationId": self.application_id,
+                "Message": match.group("message"),
+                "StackTrace": "\n".join(continuation),
+            },
+        }
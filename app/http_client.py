@@ -0,0 +1,85 @@
+import email.utils
+import logging
+import os
+import random
+import time
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码表示服务端暂时不可用或限流，稍后重试通常可以成功
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """创建带连接池的Session，同一主机的连接保持长连接复用，避免每次请求重新建立TCP和TLS连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RetryPolicy:
+    """重试策略：指数退避加随机抖动，服务端返回Retry-After时按其指定的时间等待"""
+
+    def __init__(self, max_retries: Optional[int] = None, backoff_seconds: Optional[float] = None,
+                 max_backoff_seconds: Optional[float] = None):
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("HTTP_MAX_RETRIES", "3"))
+        self.backoff_seconds = backoff_seconds or float(os.getenv("HTTP_BACKOFF_SECONDS", "1"))
+        self.max_backoff_seconds = max_backoff_seconds or float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "30"))
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        retry_after = _parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff_seconds)
+        # full jitter：在 [0, 退避上限] 内随机等待，避免多个线程同时重试
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+
+def _parse_retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def post_with_retry(session: requests.Session, url: str, policy: Optional[RetryPolicy] = None,
+                    before_attempt: Optional[Callable[[], None]] = None, **kwargs) -> requests.Response:
+    """发送POST请求，连接失败和429/5xx响应按策略重试
+
+    读取超时不重试：请求可能已被服务端处理，重试只会让调用方等待更久。
+    重试用尽后返回最后一次的响应，或抛出最后一次的异常。
+    before_attempt 在每次发送（包括重试）前调用，用于限流等。
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        if before_attempt is not None:
+            before_attempt()
+        try:
+            response = session.post(url, **kwargs)
+        except requests.ConnectionError as e:  # 包括连接超时（ConnectTimeout）
+            if attempt >= policy.max_retries:
+                raise
+            wait = policy.delay(attempt)
+            logger.warning(f"连接失败，{wait:.1f}秒后重试 ({attempt + 1}/{policy.max_retries}): {str(e)}")
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= policy.max_retries:
+                return response
+            wait = policy.delay(attempt, response)
+            logger.debug(f"HTTP {response.status_code}，{wait:.1f}秒后重试 ({attempt + 1}/{policy.max_retries})")
+            response.content  # 读完响应体，连接才会放回连接池复用
+        time.sleep(wait)
+        attempt += 1
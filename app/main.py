@@ -1,21 +1,35 @@
-from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException, Query, Form
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from typing import List, Dict, Any
+from fastapi.responses import FileResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from functools import cached_property
+from typing import List, Dict
 from sqlalchemy.orm import Session
 from datetime import datetime
-from typing import List
 from pydantic import BaseModel
-import uvicorn
+import logging
+import asyncio
+import base64
 import os
 
 
-from .database import get_db, engine
-from .models import Base, ErrorLog
+from . import blobs, metrics
+from .config import configure_logging, get_settings
+from .database import get_db
+from .migrate import migrate
+from .models import ErrorLog, Schedule, ScheduleRun
 from .services import ESService, DeepseekService, WeChatService
+from .pipeline import AnalysisPipeline
+from .cache import AnalysisCache, CountCache
+from . import rollup
+from .scheduler import Scheduler, CronExpression, DEFAULT_SCHEDULE
+from .work_queue import enqueue_from_es, queue_depth
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+settings = get_settings()
+
+# LOG_LEVEL 控制日志详细程度，DEBUG 会输出每次ES翻页、LLM请求和去重判断的细节
+configure_logging()
+logger = logging.getLogger(__name__)
 
 class ErrorLogResponse(BaseModel):
     id: int
@@ -23,18 +37,44 @@ class ErrorLogResponse(BaseModel):
     error_message: str
     analysis_result: str
     application_id: str | None = None
+    request_path: str | None = None
+    fingerprint: str | None = None
     created_at: datetime
+    truncated: bool = False  # error_message或analysis_result为预览，全文需传full_text=true或查询单条记录
+    occurrences: int = 1  # ES预聚合时该记录代表的出现次数
 
     class Config:
         orm_mode = True
 
+async def _startup():
+    """启动后在后台执行，不阻塞服务就绪；数据库不可用时每30秒重试建表，之后再启动定时调度"""
+    while settings.auto_migrate:
+        try:
+            await asyncio.to_thread(migrate)
+            break
+        except Exception as e:
+            logger.warning(f"建表失败，30秒后重试: {str(e)}")
+            await asyncio.sleep(30)
+    if settings.scheduler_enabled:
+        await scheduler.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup = asyncio.ensure_future(_startup())
+    yield
+    startup.cancel()
+    await scheduler.stop()
+    # 发送汇总周期内尚未发出的告警
+    if services.created("wechat"):
+        await asyncio.to_thread(services.wechat.flush_alerts)
+
 app = FastAPI(
     title="日志分析助手",
     description="""
     自动分析业务系统错误日志的API服务。
     
     功能特点：
-    * 从Elasticsearch获取最近5分钟的错误日志
+    * 从Elasticsearch增量获取错误日志（从上次检查点继续）
     * 使用Deepseek AI进行智能分析
     * 发送分析结果到企业微信群
     * 存储日志和分析结果到MySQL数据库
@@ -42,7 +82,8 @@ app = FastAPI(
     """,
     version="1.0.0",
     docs_url="/swagger",
-    redoc_url=None
+    redoc_url=None,
+    lifespan=lifespan,
 )
 
 
@@ -58,64 +99,119 @@ async def read_root():
 async def read_schedule():
     return FileResponse(os.path.join(static_dir, "schedule.html"))
 
-# 初始化服务
-es_service = ESService()
-deepseek_service = DeepseekService()
-wechat_service = WeChatService()
+class Services:
+    """外部服务客户端，第一次使用时才创建
+
+    导入和启动时不连接ES、数据库和Deepseek，某个后端不可用只影响用到它的接口和任务。
+    """
+
+    @cached_property
+    def es(self) -> ESService:
+        return ESService()
+
+    @cached_property
+    def deepseek(self) -> DeepseekService:
+        return DeepseekService()
+
+    @cached_property
+    def wechat(self) -> WeChatService:
+        return WeChatService()
+
+    @cached_property
+    def analysis_cache(self) -> AnalysisCache:
+        return AnalysisCache()
+
+    @cached_property
+    def logs_count_cache(self) -> CountCache:
+        return CountCache()
+
+    @cached_property
+    def pipeline(self) -> AnalysisPipeline:
+        return AnalysisPipeline(self.es, self.deepseek, self.wechat, self.analysis_cache)
 
-async def process_error_logs(db: Session):
+    def created(self, name: str) -> bool:
+        return name in self.__dict__
+
+services = Services()
+
+def get_logs_count_cache() -> CountCache:
+    return services.logs_count_cache
+
+# 导出时读取当前状态的指标，流水线尚未创建时为0
+metrics.Gauge("llm_concurrency_limit", "LLM自适应并发上限",
+              func=lambda: int(services.pipeline.llm_limiter.limit) if services.created("pipeline") else 0)
+metrics.Gauge("llm_in_flight", "正在进行的LLM请求数",
+              func=lambda: services.pipeline.llm_limiter.in_flight if services.created("pipeline") else 0)
+metrics.Gauge("llm_circuit_open", "LLM熔断器是否打开（半开也计为1）",
+              func=lambda: int(services.created("deepseek") and
+                               services.deepseek.breaker.state != services.deepseek.breaker.CLOSED))
+
+async def process_error_logs(db: Session) -> int:
     try:
-        # 获取最近的错误日志
-        recent_errors = es_service.get_recent_errors()
-        
-        if not recent_errors:
-            print("No recent errors found")
-            return
-        
-        # 分析每个错误并发送通知
-        for error in recent_errors:
-            # 获取错误分析结果
-            analysis = deepseek_service.analyze_error(error["Exception"])
-            
-            # 保存到数据库
-            db_log = ErrorLog(
-                log_time=datetime.fromisoformat(error["timestamp"].replace('Z', '+00:00')),
-                error_message=error["Exception"],
-                analysis_result=analysis,
-                application_id=error.get("application_id"),
-            )
-            db.add(db_log)
-            
-            # 发送到企业微信
-            wechat_service.send_alert(error, analysis)
-        db.commit()
-        print(f"Successfully processed {len(recent_errors)} error logs")
+        processed = await services.pipeline.run(db)
+        if processed:
+            logger.info(f"Successfully processed {processed} error logs")
+        return processed
         
     except Exception as e:
-        print(f"Error in process_error_logs: {str(e)}")
-        db.rollback()
+        logger.exception(f"Error in process_error_logs: {str(e)}")
         raise
 
+async def enqueue_error_logs(db: Session) -> int:
+    """队列模式：只读取ES并写入工作队列，由 python -m app.worker 分析"""
+    return await asyncio.to_thread(enqueue_from_es, db, services.es)
+
+# PIPELINE_MODE=queue 时API进程只负责入队，可以启动多个worker水平扩展分析能力
+scheduler = Scheduler(enqueue_error_logs if settings.pipeline_mode == "queue" else process_error_logs)
+
 @app.post("/analyze", 
     summary="触发日志分析任务",
     description="""
     触发一次日志分析任务，该任务会：
-    1. 从ES获取最近5分钟的错误日志
+    1. 从ES获取上次检查点之后的错误日志
     2. 使用Deepseek分析每条错误日志
     3. 将分析结果发送到企业微信
     4. 保存日志和分析结果到数据库
+
+    与默认定时任务共用运行状态：已有分析任务在运行时不会重复启动。
+    队列模式（PIPELINE_MODE=queue）下只执行第1步并写入工作队列，2-4步由worker完成。
     """,
     response_description="返回任务启动状态",
     tags=["任务管理"]
 )
-async def analyze_logs(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def analyze_logs():
     try:
-        background_tasks.add_task(process_error_logs, db)
+        if not scheduler.trigger(DEFAULT_SCHEDULE, "manual"):
+            return {"message": "已有分析任务正在运行", "status": "running"}
         return {"message": "日志分析任务已启动", "status": "success"}
     except Exception as e:
-        print(f"Error in analyze_logs: {str(e)}")
+        logger.exception(f"Error in analyze_logs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics",
+    summary="运行指标",
+    description="""
+    以Prometheus文本格式导出运行指标，包括：
+    * ES查询耗时、每次读取的日志条数
+    * LLM请求耗时、结果、token用量，自适应并发上限和熔断状态
+    * 分析缓存命中、告警去重结果
+    * Webhook发送耗时和结果
+    * 批量入库耗时和条数、每次分析任务的耗时
+    """,
+    response_class=PlainTextResponse,
+    tags=["监控"]
+)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/queue",
+    summary="工作队列状态",
+    description="队列模式下等待分析（available）和正在被worker处理（leased）的错误日志条数",
+    tags=["监控"]
+)
+def get_queue(db: Session = Depends(get_db)):
+    return {"mode": settings.pipeline_mode, **queue_depth(db)}
+
 # 添加分页响应模型
 class PaginatedErrorLogResponse(BaseModel):
     total: int
@@ -123,54 +219,326 @@ class PaginatedErrorLogResponse(BaseModel):
     page_size: int
     total_pages: int
     data: List[ErrorLogResponse]
+    next_cursor: str | None = None
 
     class Config:
         orm_mode = True
 
+def _encode_cursor(log: ErrorLog) -> str:
+    raw = f"{log.created_at.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+def _log_response(log: ErrorLog, texts: Dict[str, str], full_text: bool) -> ErrorLogResponse:
+    # 将 SQLAlchemy 模型对象转换为响应
+    error_message, analysis_result = log.error_message, log.analysis_result
+    if full_text:
+        error_message = blobs.full_text(error_message, log.message_hash, texts)
+        analysis_result = blobs.full_text(analysis_result, log.analysis_hash, texts)
+    return ErrorLogResponse(
+        id=log.id,
+        log_time=log.log_time,
+        error_message=error_message,
+        analysis_result=analysis_result,
+        application_id=log.application_id,
+        request_path=log.request_path,
+        fingerprint=log.fingerprint,
+        created_at=log.created_at,
+        truncated=not full_text and bool(log.message_hash or log.analysis_hash),
+        occurrences=log.occurrences or 1
+    )
+
 @app.get("/logs", 
     response_model=PaginatedErrorLogResponse,
     summary="获取历史日志记录",
-    description="获取日志分析记录，支持分页查询。page从1开始，page_size默认为20，最大为100。",
+    description="""获取日志分析记录，支持分页查询。page从1开始，page_size默认为20，最大为100。
+    传入cursor参数时使用游标分页：第一页传空字符串，之后传上一页返回的next_cursor，任意深度的翻页耗时相同。
+    支持按应用ID、日志时间范围、请求路径前缀和错误特征值筛选。
+    较长的错误内容和分析结果默认只返回前面一部分（truncated为true），传入full_text=true返回全文。
+    total为定期刷新的缓存值，可能略滞后于实际记录数。""",
     response_description="返回分页的日志记录列表",
     tags=["日志查询"]
 )
-async def get_logs(
+def get_logs(
     db: Session = Depends(get_db),
     page: int = Query(1, ge=1, description="页码，从1开始"),
-    page_size: int = Query(20, ge=1, le=100, description="每页记录数，最大100")
+    page_size: int = Query(20, ge=1, le=100, description="每页记录数，最大100"),
+    cursor: str | None = Query(None, description="游标分页：第一页传空字符串，之后传上一页返回的next_cursor"),
+    application_id: str | None = Query(None, description="应用ID"),
+    start_time: datetime | None = Query(None, description="日志时间起（含）"),
+    end_time: datetime | None = Query(None, description="日志时间止（不含）"),
+    request_path: str | None = Query(None, description="请求路径前缀"),
+    fingerprint: str | None = Query(None, description="错误特征值，查询同一错误的所有记录"),
+    full_text: bool = Query(False, description="返回错误内容和分析结果的全文"),
+    logs_count_cache: CountCache = Depends(get_logs_count_cache)
 ):
-    # 计算总记录数
-    total = db.query(ErrorLog).count()
+    def filtered(session: Session):
+        query = session.query(ErrorLog)
+        if application_id:
+            query = query.filter(ErrorLog.application_id == application_id)
+        if start_time:
+            query = query.filter(ErrorLog.log_time >= start_time)
+        if end_time:
+            query = query.filter(ErrorLog.log_time < end_time)
+        if request_path:
+            query = query.filter(ErrorLog.request_path.startswith(request_path, autoescape=True))
+        if fingerprint:
+            query = query.filter(ErrorLog.fingerprint == fingerprint)
+        return query
+
+    # 总记录数使用缓存值（按筛选条件分别缓存），过期后在后台刷新
+    count_key = (application_id, start_time, end_time, request_path, fingerprint)
+    total = logs_count_cache.get(count_key, filtered)
     
-    # 计算偏移量
-    offset = (page - 1) * page_size
+    query = filtered(db)\
+        .order_by(ErrorLog.created_at.desc(), ErrorLog.id.desc())
     
-    # 获取分页数据
-    logs = db.query(ErrorLog)\
-        .order_by(ErrorLog.created_at.desc())\
-        .offset(offset)\
-        .limit(page_size)\
-        .all()
+    if cursor is not None:
+        # 游标分页：按 (created_at, id) 定位，不需要扫描跳过前面的记录
+        if cursor:
+            created_at, log_id = _decode_cursor(cursor)
+            query = query.filter(
+                (ErrorLog.created_at < created_at) |
+                ((ErrorLog.created_at == created_at) & (ErrorLog.id < log_id))
+            )
+        logs = query.limit(page_size + 1).all()
+        next_cursor = _encode_cursor(logs[page_size - 1]) if len(logs) > page_size else None
+        logs = logs[:page_size]
+    else:
+        # 计算偏移量
+        offset = (page - 1) * page_size
+        
+        # 获取分页数据
+        logs = query.offset(offset).limit(page_size).all()
+        next_cursor = _encode_cursor(logs[-1]) if len(logs) == page_size else None
     
-    # 将 SQLAlchemy 模型对象转换为字典
-    log_responses = [
-        ErrorLogResponse(
-            id=log.id,
-            log_time=log.log_time,
-            error_message=log.error_message,
-            analysis_result=log.analysis_result,
-            application_id=log.application_id,
-            created_at=log.created_at
-        ) for log in logs
-    ]
+    # 只在需要全文时一次性读取本页引用的内容
+    texts = blobs.resolve(db, (digest for log in logs for digest in (log.message_hash, log.analysis_hash)))\
+        if full_text else {}
+    log_responses = [_log_response(log, texts, full_text) for log in logs]
     
     return PaginatedErrorLogResponse(
         total=total,
         page=page,
         page_size=page_size,
         total_pages=(total + page_size - 1) // page_size,
-        data=log_responses
+        data=log_responses,
+        next_cursor=next_cursor
     )
 
+@app.get("/logs/{log_id}",
+    response_model=ErrorLogResponse,
+    summary="获取单条日志记录",
+    description="返回日志记录的错误内容和分析结果全文",
+    tags=["日志查询"]
+)
+def get_log(log_id: int, db: Session = Depends(get_db)):
+    log = db.get(ErrorLog, log_id)
+    if log is None:
+        raise HTTPException(status_code=404, detail="日志记录不存在")
+    return _log_response(log, blobs.resolve(db, (log.message_hash, log.analysis_hash)), True)
+
+class ErrorGroupResponse(BaseModel):
+    fingerprint: str
+    summary: str | None = None
+    count: int
+    total_count: int
+    first_seen: datetime | None = None
+    last_seen: datetime | None = None
+    applications: Dict[str, int]
+
+class ErrorGroupAppResponse(BaseModel):
+    application_id: str
+    count: int
+    first_seen: datetime
+    last_seen: datetime
+
+class ErrorGroupDetailResponse(BaseModel):
+    fingerprint: str
+    summary: str
+    total_count: int
+    first_seen: datetime
+    last_seen: datetime
+    applications: List[ErrorGroupAppResponse]
+
+class TimeSeriesPoint(BaseModel):
+    bucket: datetime
+    count: int
+
+@app.get("/groups",
+    response_model=List[ErrorGroupResponse],
+    summary="错误分组Top N",
+    description="""按错误特征值分组，返回时间范围内出现次数最多的错误及各应用中的次数。
+    默认统计最近hours小时，传入start_time时以start_time为准。统计按小时汇总，时间范围按整点对齐。""",
+    tags=["错误统计"]
+)
+def get_error_groups(
+    db: Session = Depends(get_db),
+    hours: int = Query(24, ge=1, le=24 * 90, description="统计最近多少小时"),
+    start_time: datetime | None = Query(None, description="日志时间起（含）"),
+    end_time: datetime | None = Query(None, description="日志时间止（不含）"),
+    application_id: str | None = Query(None, description="应用ID"),
+    limit: int = Query(20, ge=1, le=200, description="返回的分组数")
+):
+    since = start_time or rollup.hours_ago(hours)
+    return rollup.top_groups(db, since, end_time, application_id, limit)
+
+@app.get("/groups/series",
+    response_model=List[TimeSeriesPoint],
+    summary="错误次数趋势",
+    description="""按小时或天返回错误次数，可按错误特征值和应用ID筛选，没有错误的时间段不返回。""",
+    tags=["错误统计"]
+)
+def get_error_series(
+    db: Session = Depends(get_db),
+    hours: int = Query(24, ge=1, le=24 * 90, description="统计最近多少小时"),
+    start_time: datetime | None = Query(None, description="日志时间起（含）"),
+    end_time: datetime | None = Query(None, description="日志时间止（不含）"),
+    fingerprint: str | None = Query(None, description="错误特征值"),
+    application_id: str | None = Query(None, description="应用ID"),
+    interval: str = Query("hour", pattern="^(hour|day)$", description="汇总粒度：hour或day")
+):
+    since = start_time or rollup.hours_ago(hours)
+    return rollup.time_series(db, since, end_time, fingerprint, application_id, interval)
+
+@app.get("/groups/{fingerprint}",
+    response_model=ErrorGroupDetailResponse,
+    summary="错误分组详情",
+    description="返回错误分组的累计次数、首次和最近出现时间以及各应用中的次数",
+    tags=["错误统计"]
+)
+def get_error_group(fingerprint: str, db: Session = Depends(get_db)):
+    detail = rollup.group_detail(db, fingerprint)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="错误分组不存在")
+    return detail
+
+class ScheduleRequest(BaseModel):
+    interval_seconds: int | None = None
+    cron: str | None = None
+    enabled: bool = True
+
+class ScheduleResponse(BaseModel):
+    name: str
+    interval_seconds: int | None = None
+    cron: str | None = None
+    enabled: bool
+    running: bool
+    last_run_at: datetime | None = None
+    next_run_at: datetime | None = None
+
+class ScheduleRunResponse(BaseModel):
+    id: int
+    trigger: str
+    status: str
+    processed: int | None = None
+    error: str | None = None
+    started_at: datetime
+    finished_at: datetime | None = None
+    duration_ms: int | None = None
+
+def _schedule_response(schedule: Schedule) -> ScheduleResponse:
+    return ScheduleResponse(
+        name=schedule.name,
+        interval_seconds=schedule.interval_seconds,
+        cron=schedule.cron,
+        enabled=schedule.enabled,
+        running=scheduler.is_running(schedule.name, schedule.lease_until),
+        last_run_at=schedule.last_run_at,
+        next_run_at=schedule.next_run_at
+    )
+
+@app.get("/schedules",
+    response_model=List[ScheduleResponse],
+    summary="获取定时任务列表",
+    tags=["任务管理"]
+)
+def list_schedules(db: Session = Depends(get_db)):
+    return [_schedule_response(schedule) for schedule in db.query(Schedule).order_by(Schedule.name).all()]
+
+@app.put("/schedules/{name}",
+    response_model=ScheduleResponse,
+    summary="创建或修改定时任务",
+    description="interval_seconds（执行间隔秒数，最小10）与cron（5段表达式：分 时 日 月 周）二选一。",
+    tags=["任务管理"]
+)
+def save_schedule(name: str, request: ScheduleRequest, db: Session = Depends(get_db)):
+    if bool(request.interval_seconds) == bool(request.cron):
+        raise HTTPException(status_code=400, detail="interval_seconds与cron需且只需指定一个")
+    if request.interval_seconds is not None and request.interval_seconds < 10:
+        raise HTTPException(status_code=400, detail="执行间隔不能小于10秒")
+    if request.cron:
+        try:
+            CronExpression(request.cron)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"无效的cron表达式: {str(e)}")
+
+    schedule = db.get(Schedule, name)
+    if schedule is None:
+        schedule = Schedule(name=name)
+        db.add(schedule)
+    schedule.interval_seconds = request.interval_seconds
+    schedule.cron = request.cron
+    schedule.enabled = request.enabled
+    schedule.next_run_at = None  # 下次检查时立即执行一次，之后按新配置计算
+    db.commit()
+    return _schedule_response(schedule)
+
+@app.delete("/schedules/{name}",
+    summary="删除定时任务",
+    tags=["任务管理"]
+)
+def delete_schedule(name: str, db: Session = Depends(get_db)):
+    schedule = db.get(Schedule, name)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="定时任务不存在")
+    db.delete(schedule)
+    db.commit()
+    return {"message": "定时任务已删除", "status": "success"}
+
+@app.post("/schedules/{name}/run",
+    summary="立即执行定时任务",
+    tags=["任务管理"]
+)
+async def run_schedule(name: str):
+    if not scheduler.trigger(name, "manual"):
+        return {"message": "该任务正在运行", "status": "running"}
+    return {"message": "任务已启动", "status": "success"}
+
+@app.get("/schedules/{name}/runs",
+    response_model=List[ScheduleRunResponse],
+    summary="获取定时任务执行记录",
+    tags=["任务管理"]
+)
+def list_schedule_runs(
+    name: str,
+    db: Session = Depends(get_db),
+    limit: int = Query(20, ge=1, le=200, description="返回的记录数")
+):
+    runs = db.query(ScheduleRun)\
+        .filter(ScheduleRun.schedule_name == name)\
+        .order_by(ScheduleRun.started_at.desc(), ScheduleRun.id.desc())\
+        .limit(limit)\
+        .all()
+    return [
+        ScheduleRunResponse(
+            id=run.id,
+            trigger=run.trigger,
+            status=run.status,
+            processed=run.processed,
+            error=run.error,
+            started_at=run.started_at,
+            finished_at=run.finished_at,
+            duration_ms=run.duration_ms
+        ) for run in runs
+    ]
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,209 @@
+import abc
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# 默认的耗时分桶（秒），覆盖从毫秒级的数据库写入到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    """指标基类，按标签值分别计数，标签在创建时声明、记录时以关键字参数传入"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """按Prometheus文本格式输出各标签组合的样本行"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        if not self.labelnames:
+            self._values[()] = 0  # 没有标签的指标从0开始导出
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """当前值，可以直接设置，也可以传入 func 在导出时读取"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None,
+                 func: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.func = func
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> List[str]:
+        if self.func is not None:
+            return [f"{self.name} {_format_value(self.func())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """分桶统计，导出各桶的累计次数、总和与总次数"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        if not self.labelnames:
+            self._values[()] = [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录with块的执行时间（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表，render() 按Prometheus文本格式导出全部指标"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            # 同名指标后注册的替换先注册的，便于重复创建服务实例时更新取值函数
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# ES
+ES_QUERY_SECONDS = Histogram("es_query_seconds", "ES单页查询耗时（秒）")
+ES_HITS_PER_RUN = Histogram("es_hits_per_run", "每次增量读取到的错误日志条数",
+                            buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+
+# 大模型，mode 为 single、stream 或 batch
+LLM_REQUEST_SECONDS = Histogram("llm_request_seconds", "大模型请求耗时（秒，流式请求为完整响应耗时）", ["mode"])
+LLM_REQUESTS_TOTAL = Counter("llm_requests_total", "大模型请求次数", ["mode", "status"])
+LLM_TOKENS_TOTAL = Counter("llm_tokens_total", "大模型消耗的token数", ["type"])
+
+# 分析缓存与告警去重
+ANALYSIS_CACHE_LOOKUPS_TOTAL = Counter("analysis_cache_lookups_total", "分析缓存查询次数", ["result"])
+ALERT_DEDUP_TOTAL = Counter("alert_dedup_total", "告警去重检查次数，result为new或duplicate", ["result"])
+
+# 企业微信Webhook
+WEBHOOK_REQUEST_SECONDS = Histogram("webhook_request_seconds", "Webhook请求耗时（秒，含重试，不含限流等待）")
+WEBHOOK_REQUESTS_TOTAL = Counter("webhook_requests_total", "Webhook消息发送次数", ["status"])
+
+# 入库与整体运行
+DB_FLUSH_SECONDS = Histogram("db_flush_seconds", "批量写入日志的耗时（秒）")
+DB_ROWS_WRITTEN_TOTAL = Counter("db_rows_written_total", "写入error_logs的记录数")
+PIPELINE_RUN_SECONDS = Histogram("pipeline_run_seconds", "每次分析任务的总耗时（秒）",
+                                 buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+PIPELINE_RUNS_TOTAL = Counter("pipeline_runs_total", "分析任务执行次数", ["status"])
+
+# 队列模式
+WORK_ITEMS_ENQUEUED_TOTAL = Counter("work_items_enqueued_total", "写入工作队列的错误日志条数")
+WORK_ITEMS_TOTAL = Counter("work_items_total", "worker处理的队列条目数，result为leased、acked或dead", ["result"])
@@ -0,0 +1,82 @@
+"""创建和升级数据库表
+
+先创建不存在的表，再给升级前已存在的表补齐之后新增的字段和索引（按数据库中的实际结构判断，可以重复执行）。
+API进程在 AUTO_MIGRATE=true（默认）时于启动后在后台执行；也可以在发布时单独执行：
+    python -m app.migrate
+"""
+import logging
+import time
+
+from sqlalchemy import inspect, text
+
+from .config import configure_logging
+from .database import engine
+from .models import Base
+
+logger = logging.getLogger(__name__)
+
+
+# 初始版本之后给已有表新增的字段：(表名, 字段名, 字段定义)
+_NEW_COLUMNS = [
+    ("error_logs", "es_id", "VARCHAR(64) NULL"),
+    ("error_logs", "fingerprint", "VARCHAR(64) NULL"),
+    ("error_logs", "message_hash", "VARCHAR(64) NULL"),
+    ("error_logs", "analysis_hash", "VARCHAR(64) NULL"),
+    ("error_logs", "occurrences", "INTEGER NOT NULL DEFAULT 1"),
+    ("schedules", "lease_owner", "VARCHAR(100) NULL"),
+    ("schedules", "lease_until", "DATETIME NULL"),
+]
+
+# 初始版本之后新增的唯一约束：(表名, 约束名, 字段)
+_NEW_UNIQUE_KEYS = [
+    ("error_logs", "uk_es_id", "es_id"),
+]
+
+
+def _upgrade(bind):
+    """补齐已有表缺少的字段、唯一约束和模型中显式命名（idx_）的索引
+
+    index=True 自动生成的索引在 sql/initdb.sql 中另有名称，不按名称补建，避免重复索引。
+    """
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table, column, definition in _NEW_COLUMNS:
+            if table in tables and column not in {c["name"] for c in inspector.get_columns(table)}:
+                logger.info(f"{table} 新增字段 {column}")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+    for table, name, column in _NEW_UNIQUE_KEYS:
+        if table not in tables:
+            continue
+        unique = [index["column_names"] for index in inspector.get_indexes(table) if index.get("unique")]
+        unique += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table)]
+        if [column] not in unique:
+            logger.info(f"{table} 新增唯一约束 {name}")
+            with bind.begin() as conn:
+                conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({column})"))
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name.startswith("idx_") and index.name not in existing:
+                logger.info(f"{table.name} 新增索引 {index.name}")
+                index.create(bind=bind)
+
+
+def migrate(bind=engine):
+    Base.metadata.create_all(bind=bind)
+    _upgrade(bind)
+
+
+def main():
+    configure_logging()
+    started = time.perf_counter()
+    migrate()
+    print(f"建表完成，耗时 {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Index, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, Index, Boolean, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import pytz
@@ -8,14 +8,159 @@ Base = declarative_base()
 def get_shanghai_time():
     return datetime.now(pytz.timezone('Asia/Shanghai'))
 
+def get_naive_shanghai_time():
+    """当前北京时间（不带时区，与数据库中存储的时间一致）"""
+    return get_shanghai_time().replace(tzinfo=None)
+
 class ErrorLog(Base):
     __tablename__ = 'error_logs'
     
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     log_time = Column(DateTime, nullable=False, default=datetime.utcnow)
-    error_message = Column(Text, nullable=False)
+    error_message = Column(Text, nullable=False)  # 较长的内容只保存前 BLOB_INLINE_CHARS 个字符，全文在blobs表
     analysis_result = Column(Text, nullable=True)
-    application_id = Column(String(100), index=True)
+    application_id = Column(String(100))
     request_path = Column(String(500), nullable=True)  # 新增字段
+    es_id = Column(String(64), nullable=True, unique=True)  # ES文档_id，保证同一条日志只入库一次
+    fingerprint = Column(String(64), nullable=True)  # 错误特征值，相同错误的记录值相同
+    message_hash = Column(String(64), nullable=True)  # 错误内容全文在blobs表中的哈希值，为空表示未截断
+    analysis_hash = Column(String(64), nullable=True)  # 分析结果全文在blobs表中的哈希值
+    occurrences = Column(Integer, nullable=False, default=1)  # ES预聚合时该记录代表的出现次数
+    created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
+
+    __table_args__ = (
+        Index('idx_created_at_id', 'created_at', 'id'),  # /logs 游标分页
+        # /logs 按条件筛选时使用的组合索引，筛选后仍按 (created_at, id) 有序
+        Index('idx_app_created_at', 'application_id', 'created_at', 'id'),
+        Index('idx_fingerprint_created_at', 'fingerprint', 'created_at', 'id'),
+        Index('idx_app_log_time', 'application_id', 'log_time'),
+        Index('idx_log_time', 'log_time'),
+        Index('idx_request_path', 'request_path', mysql_length=191),
+    )
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = 'analysis_cache'
+
+    fingerprint = Column(String(64), primary_key=True)  # 归一化后的错误特征值
+    analysis_result = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class ReanalysisItem(Base):
+    __tablename__ = 'reanalysis_queue'
+
+    fingerprint = Column(String(64), primary_key=True)  # 分析失败的错误特征值，成功后更新该特征值的所有失败记录
+    error_message = Column(Text, nullable=False)  # 用于重新分析的错误信息
+    attempts = Column(Integer, nullable=False, default=0)  # 已重试次数
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
+
+class AlertDedupEntry(Base):
+    __tablename__ = 'alert_dedup'
+
+    fingerprint = Column(String(64), primary_key=True)  # 错误特征值
+    first_seen = Column(DateTime, nullable=False)  # 本轮去重窗口内首次出现时间
+    last_seen = Column(DateTime, nullable=False)  # 最近一次出现时间
+    count = Column(Integer, nullable=False, default=1)  # 窗口内累计次数
+    expires_at = Column(DateTime, nullable=False, index=True)  # 最近一次出现后顺延的过期时间
+
+class WebhookSendSlot(Base):
+    __tablename__ = 'webhook_send_slots'
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)  # 槽位编号，0 到 每分钟配额-1
+    sent_at = Column(DateTime, nullable=False)  # 该槽位最近一次发送消息的时间
+
+class IngestCheckpoint(Base):
+    __tablename__ = 'ingest_checkpoints'
+
+    name = Column(String(50), primary_key=True)  # 检查点名称，默认为 es_errors
+    last_timestamp = Column(BigInteger, nullable=True)  # 已处理的最大 @timestamp（毫秒）
+    last_ids = Column(Text, nullable=True)  # 该时间戳上已处理的ES文档_id（JSON数组）
+    updated_at = Column(DateTime, nullable=False, default=get_shanghai_time, onupdate=get_shanghai_time)
+
+class Schedule(Base):
+    __tablename__ = 'schedules'
+
+    name = Column(String(50), primary_key=True)
+    interval_seconds = Column(Integer, nullable=True)  # 固定间隔，与cron二选一
+    cron = Column(String(100), nullable=True)  # 5段cron表达式（分 时 日 月 周）
+    enabled = Column(Boolean, nullable=False, default=True)
+    last_run_at = Column(DateTime, nullable=True)
+    next_run_at = Column(DateTime, nullable=True)
+    lease_owner = Column(String(100), nullable=True)  # 正在执行该任务的进程
+    lease_until = Column(DateTime, nullable=True)  # 租约到期时间，执行期间定期顺延，进程崩溃时到期后其他进程可以接手
+    created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
+    updated_at = Column(DateTime, nullable=False, default=get_shanghai_time, onupdate=get_shanghai_time)
+
+class ScheduleRun(Base):
+    __tablename__ = 'schedule_runs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    schedule_name = Column(String(50), nullable=False)
+    trigger = Column(String(20), nullable=False)  # schedule / manual
+    status = Column(String(20), nullable=False)  # running / success / failed
+    processed = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index('idx_schedule_started_at', 'schedule_name', 'started_at'),
+    )
+
+class ErrorGroup(Base):
+    __tablename__ = 'error_groups'
+
+    fingerprint = Column(String(64), primary_key=True)  # 错误特征值
+    summary = Column(String(500), nullable=False)  # 首次入库时的归一化摘要，用于展示
+    first_seen = Column(DateTime, nullable=False)  # 最早的日志时间
+    last_seen = Column(DateTime, nullable=False, index=True)  # 最近的日志时间
+    total_count = Column(BigInteger, nullable=False, default=0)  # 累计入库次数
+
+class ErrorGroupApp(Base):
+    __tablename__ = 'error_group_apps'
+
+    fingerprint = Column(String(64), primary_key=True)
+    application_id = Column(String(100), primary_key=True)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    count = Column(BigInteger, nullable=False, default=0)  # 该应用中的累计次数
+
+class ErrorGroupHourly(Base):
+    __tablename__ = 'error_group_hourly'
+
+    bucket_start = Column(DateTime, primary_key=True)  # 日志时间所在小时的开始时间（北京时间）
+    application_id = Column(String(100), primary_key=True)
+    fingerprint = Column(String(64), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('idx_fingerprint_bucket', 'fingerprint', 'bucket_start'),  # 单个分组的趋势
+        Index('idx_app_bucket', 'application_id', 'bucket_start'),  # 按应用筛选的Top N和趋势
+    )
+
+class Blob(Base):
+    __tablename__ = 'blobs'
+
+    hash = Column(String(64), primary_key=True)  # 原文的SHA-256
+    encoding = Column(String(10), nullable=False)  # zlib / zstd / raw
+    data = Column(LargeBinary(16777215), nullable=False)  # MySQL中为MEDIUMBLOB
+    size = Column(Integer, nullable=False)  # 原文字符数
+    created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
+
+class WorkItem(Base):
+    __tablename__ = 'work_items'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    es_id = Column(String(64), nullable=False, unique=True)  # ES文档_id，同一条日志只入队一次
+    payload = Column(Text(16777215), nullable=False)  # 错误日志对象（JSON），MySQL中为MEDIUMTEXT
+    attempts = Column(Integer, nullable=False, default=0)  # 已领取次数
+    available_at = Column(DateTime, nullable=False)  # 可领取时间，领取后顺延租约时长，worker崩溃时到期自动回收
+    lease_owner = Column(String(100), nullable=True)  # 最近一次领取的worker
     created_at = Column(DateTime, nullable=False, default=get_shanghai_time)
 
+    __table_args__ = (
+        Index('idx_available_at_id', 'available_at', 'id'),
+    )
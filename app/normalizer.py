@@ -0,0 +1,113 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import List, NamedTuple
+
+from .stacktrace import FINGERPRINT_FRAMES, parse_stack_trace, trace_fingerprint
+
+
+class NormalizedError(NamedTuple):
+    summary: str  # 发送给大模型的简化日志
+    fingerprint: str  # 告警去重和分析缓存使用的特征值
+
+
+# 关键信息的模式按输出顺序排列，(类别, 预编译正则, 保留条数)。
+# 每个模式都以字面量开头，正则引擎可以快速跳过不相关的位置；
+# 取够条数后立即停止，不会为了丢弃的匹配扫描整段堆栈。
+_PATTERNS = [
+    ("error", re.compile(r'Error: .*?(?=\s+at\s+|$)'), 3),  # 错误描述，保留前三条
+    ("exception", re.compile(r'Exception: .*?(?=\s+at\s+|$)'), 1),  # 异常描述
+    ("failed", re.compile(r'Failed to .*?(?=\s+at\s+|$)'), 1),  # Failed to类型的错误
+    ("status", re.compile(r'status code (\d+)'), 1),  # HTTP状态码
+    # 带行列号的关键堆栈。中间不允许出现冒号并限定长度，
+    # 避免 .*? 在几千行的堆栈上逐字符回溯
+    ("frame", re.compile(r'at [^:]{0,300}:\d+:\d+'), 1),
+    ("caused", re.compile(r'Caused by: .*?(?=\s+at\s+|$)'), 1),  # 根本原因
+    ("message", re.compile(r'message: ".*?"'), 1),  # 错误消息
+    ("reason", re.compile(r'reason: ".*?"'), 1),  # 错误原因
+]
+_TYPE_CATEGORIES = ("error", "exception", "failed")
+_QUOTED_LIMIT = 3
+
+_QUOTED = re.compile(r'"([^"]+)"')
+
+# 归一化结果缓存：按日志内容的摘要索引，不持有原始日志（单条堆栈可能有几十KB）
+_CACHE_SIZE = 256
+_cache: "OrderedDict[bytes, NormalizedError]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# 特征值中需要去掉的易变信息：时间戳、IP地址、行号
+_VOLATILE = re.compile(
+    r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}'
+    r'|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'
+    r'|line \d+'
+    r'|:\d+:\d+'
+)
+
+
+def _fingerprint(error_type: str, key_message: str, flat: str) -> str:
+    key_parts = []
+    if error_type:
+        key_parts.append(_VOLATILE.sub('', error_type))
+    if key_message:
+        key_parts.append(_VOLATILE.sub('', key_message))
+    if not key_parts:  # 如果没有提取到特征，使用清理后的错误信息前100个字符
+        key_parts.append(_VOLATILE.sub('', flat[:200])[:100])
+    return hashlib.md5('|'.join(key_parts).encode()).hexdigest()
+
+
+def _first(pattern, text: str, limit: int) -> List[str]:
+    return [match.group(match.lastindex or 0) for match in islice(pattern.finditer(text), limit)]
+
+
+def normalize_error(error_log: str) -> NormalizedError:
+    """一次归一化同时得到简化日志和特征值
+
+    结果按日志内容的摘要缓存，流水线计算特征值和Deepseek简化日志时只会真正处理一次。
+    """
+    key = hashlib.sha1(error_log.encode('utf-8', 'surrogatepass')).digest()
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+            return result
+    result = _normalize_error(error_log)
+    with _cache_lock:
+        _cache[key] = result
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def _normalize_error(error_log: str) -> NormalizedError:
+    # 将多行错误堆栈转为单行并移除多余的空格
+    flat = ' '.join(error_log.split())
+
+    key_info: List[str] = []
+    error_type = ''
+    for category, pattern, limit in _PATTERNS:
+        matches = _first(pattern, flat, limit)
+        if matches and not error_type and category in _TYPE_CATEGORIES:
+            error_type = matches[0]
+        key_info.extend(matches)
+
+    quoted = _first(_QUOTED, flat, _QUOTED_LIMIT)
+    # 优先按异常类型链和业务代码堆栈帧分组；解析不出异常类型时回退到基于文本的特征值，
+    # 易变信息只在提取出的短文本上清理，不再对整段日志做多次替换
+    fingerprint = trace_fingerprint(parse_stack_trace(error_log, FINGERPRINT_FRAMES)) \
+        or _fingerprint(error_type, quoted[0] if quoted else '', flat)
+
+    if not key_info:
+        # 如果没有匹配到任何模式，使用引号中的内容
+        if quoted:
+            return NormalizedError(' | '.join(quoted), fingerprint)
+        # 如果还是没有，返回原始日志的前200个字符
+        return NormalizedError(flat[:200] + ('...' if len(flat) > 200 else ''), fingerprint)
+
+    # 组合关键信息，确保总长度不超过500字符
+    summary = ' | '.join(key_info)
+    if len(summary) > 500:
+        summary = summary[:500] + '...'
+    return NormalizedError(summary, fingerprint)
@@ -0,0 +1,628 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .blobs import BlobBatch
+from .models import ErrorLog, IngestCheckpoint, ReanalysisItem, get_naive_shanghai_time, get_shanghai_time
+from .resilience import AdaptiveConcurrency
+from .rollup import update_rollups
+from .services import ANALYSIS_FAILURE_PREFIX, generate_error_fingerprint, is_analysis_failure
+
+logger = logging.getLogger(__name__)
+
+
+CHECKPOINT_NAME = "es_errors"
+
+# 读取线程结束的标记
+_END = object()
+
+# 流式模式提前发送的告警只包含原因分析，完整结果入库后可在页面查看
+EARLY_ALERT_SUFFIX = "\n\n（解决方案生成中，完整分析结果请在日志记录中查看）"
+
+# 单条日志处理出错时入库的占位文本，记录进入重新分析队列，检查点推进后也不会丢失
+PROCESSING_FAILED = f"{ANALYSIS_FAILURE_PREFIX}处理失败，稍后自动重新分析"
+
+
+def load_checkpoint(db: Session, name: str) -> Optional[dict]:
+    row = db.get(IngestCheckpoint, name)
+    if row is None:
+        return None
+    return {"last_timestamp": row.last_timestamp, "last_ids": json.loads(row.last_ids or "[]")}
+
+
+def save_checkpoint(db: Session, name: str, checkpoint: dict):
+    """更新检查点，不提交，由调用方在所有记录写入后提交"""
+    row = db.get(IngestCheckpoint, name)
+    if row is None:
+        row = IngestCheckpoint(name=name)
+        db.add(row)
+    row.last_timestamp = checkpoint.get("last_timestamp")
+    row.last_ids = json.dumps(checkpoint.get("last_ids") or [])
+
+
+class _LLMBatcher:
+    """把短时间内到达的待分析错误合并成一次批量请求
+
+    攒够 batch_size 条或等待超过 wait_seconds 后发送，批量请求同样受LLM并发上限控制，
+    上限根据每条错误的平均响应时间自适应调整。
+    """
+
+    def __init__(self, deepseek_service, limiter: AdaptiveConcurrency, batch_size: int, wait_seconds: float,
+                 offload: Callable, stream: bool = False):
+        self.deepseek_service = deepseek_service
+        self.stream = stream  # 流式模式下逐条请求，不合并批次
+        self.offload = offload
+        self.limiter = limiter
+        self.batch_size = max(1, batch_size)
+        self.wait_seconds = wait_seconds
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def analyze(self, error_message: str, on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """分析一条错误；流式模式下原因分析生成后会在工作线程中调用 on_partial"""
+        if self.stream:
+            return await self._analyze_stream(error_message, on_partial)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((error_message, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait_seconds, self._flush)
+        return await future
+
+    async def _analyze_stream(self, error_message: str, on_partial: Optional[Callable[[str], None]]) -> str:
+        await self.limiter.acquire()
+        started, ok = time.monotonic(), False
+        try:
+            analysis = await self.offload(self.deepseek_service.analyze_error_stream, error_message, on_partial)
+            ok = not is_analysis_failure(analysis)
+            return analysis
+        finally:
+            self.limiter.release(time.monotonic() - started, ok)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            await self.limiter.acquire()
+            started, ok = time.monotonic(), False
+            try:
+                results = await self.offload(
+                    self.deepseek_service.analyze_errors_batch, [message for message, _ in batch]
+                )
+                ok = not all(is_analysis_failure(analysis) for analysis in results)
+            finally:
+                self.limiter.release((time.monotonic() - started) / len(batch), ok)
+            for (_, future), analysis in zip(batch, results):
+                if not future.done():
+                    future.set_result(analysis)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class _LogWriter:
+    """缓冲待入库的日志记录，达到条数阈值或定时批量写入，每批单独提交
+
+    单条分析或告警失败不会影响其他批次，已提交的批次在任务中途失败时也会保留。
+    实际写库通过 run_db 在数据库线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, db: Session, batch_size: int, flush_seconds: float, run_db: Callable):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.run_db = run_db
+        self.written = 0
+        self.error: Optional[BaseException] = None
+        self._rows: List[Dict[str, Any]] = []
+        self._ticker: Optional[asyncio.Task] = None
+        self._writes = set()
+
+    def start(self):
+        self._ticker = asyncio.ensure_future(self._tick())
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.flush()
+
+    def add(self, row: Dict[str, Any]):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """把当前缓冲的记录交给数据库线程写入"""
+        if not self._rows or self.error is not None:
+            return
+        rows, self._rows = self._rows, []
+        task = asyncio.ensure_future(self._write(rows))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _write_sync(self, rows: List[Dict[str, Any]]) -> int:
+        """写入一批记录并返回本事务实际插入的条数"""
+        started = time.perf_counter()
+        try:
+            # 先锁定本批es_id（FOR UPDATE），已入库或其他进程（租约到期重新领取、多个调度器）
+            # 正在写入的记录不计入分组统计，同一条日志只会被其中一方计入
+            es_ids = [row["es_id"] for row in rows if row.get("es_id")]
+            existing = {
+                es_id for (es_id,) in self.db.query(ErrorLog.es_id)
+                .filter(ErrorLog.es_id.in_(es_ids)).with_for_update().all()
+            } if es_ids else set()
+            inserted = []
+            for row in rows:
+                es_id = row.get("es_id")
+                if es_id not in existing:
+                    inserted.append(row)
+                    if es_id:
+                        existing.add(es_id)  # 同一批内重复的记录只插入第一条
+            # 较长的错误内容和分析结果按哈希值存入blobs表，相同内容只存一份
+            blobs = BlobBatch()
+            packed = [blobs.pack_row(row) for row in rows]
+            blobs.write(self.db)
+            # es_id唯一，重复记录直接忽略，保证重复读取时不会报错
+            stmt = insert(ErrorLog).values(packed)\
+                .prefix_with("IGNORE", dialect="mysql")\
+                .prefix_with("OR IGNORE", dialect="sqlite")
+            self.db.execute(stmt)
+            # 错误分组的累计次数和小时统计与日志在同一事务中更新
+            update_rollups(self.db, inserted)
+            # 分析失败的记录与日志在同一事务中加入重新分析队列
+            failed = {
+                row["fingerprint"]: row["error_message"]
+                for row in rows
+                if row.get("fingerprint") and is_analysis_failure(row["analysis_result"])
+            }
+            for fingerprint, error_message in failed.items():
+                if self.db.get(ReanalysisItem, fingerprint) is None:
+                    self.db.add(ReanalysisItem(
+                        fingerprint=fingerprint,
+                        error_message=error_message,
+                        attempts=0,
+                        next_attempt_at=get_naive_shanghai_time(),
+                    ))
+            self.db.commit()
+            blobs.committed()
+        except Exception:
+            self.db.rollback()
+            raise
+        metrics.DB_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        metrics.DB_ROWS_WRITTEN_TOTAL.inc(len(inserted))
+        return len(inserted)
+
+    async def _write(self, rows: List[Dict[str, Any]]):
+        try:
+            inserted = await self.run_db(self._write_sync, rows)
+            self.written += inserted
+            logger.info(f"批量写入 {inserted} 条日志（本批 {len(rows)} 条）")
+        except Exception as e:
+            logger.warning(f"批量写入失败: {str(e)}")
+            self.error = e
+
+    def raise_if_failed(self):
+        if self.error is not None:
+            raise self.error
+
+    async def close(self):
+        """停止定时写入，写入剩余记录并等待所有写入完成"""
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        self.flush()
+        if self._writes:
+            await asyncio.wait(set(self._writes))
+
+
+class AnalysisPipeline:
+    """错误日志处理流水线
+
+    ES增量查询 -> LLM分析 -> 企业微信告警 -> 入库。
+    ES按页流式读取，第一页到达后即开始分析，后续页在读取线程中继续获取；
+    LLM调用和Webhook发送都是阻塞的HTTP请求，这里放到线程中执行，
+    并分别用独立的并发上限控制，整批耗时约等于最慢几次调用的耗时。
+
+    所有阻塞操作都在流水线自己的线程池中执行，数据库会话只在单独的一个数据库线程中使用，
+    事件循环本身不做任何阻塞调用，分析任务运行时API请求不受影响。
+    """
+
+    def __init__(
+        self,
+        es_service,
+        deepseek_service,
+        wechat_service,
+        analysis_cache=None,
+        llm_concurrency: Optional[int] = None,
+        webhook_concurrency: Optional[int] = None,
+        checkpoint_name: Optional[str] = CHECKPOINT_NAME,
+    ):
+        self.es_service = es_service
+        self.deepseek_service = deepseek_service
+        self.wechat_service = wechat_service
+        self.analysis_cache = analysis_cache
+        # 检查点名称，为None时不读取也不推进检查点（如从文件导入历史日志）
+        self.checkpoint_name = checkpoint_name
+        self.llm_concurrency = llm_concurrency or int(os.getenv("LLM_CONCURRENCY", "5"))
+        self.webhook_concurrency = webhook_concurrency or int(os.getenv("WEBHOOK_CONCURRENCY", "2"))
+        # 读取队列长度和同时处理中的日志条数上限，保证内存占用不随错误数量增长
+        self.queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "500"))
+        self.max_pending = int(os.getenv("PIPELINE_MAX_PENDING", "200"))
+        # 入库批次大小和定时写入间隔
+        self.write_batch_size = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))
+        self.flush_seconds = float(os.getenv("DB_FLUSH_SECONDS", "5"))
+        # 批量分析时等待凑批的最长时间
+        self.llm_batch_wait_seconds = int(os.getenv("LLM_BATCH_WAIT_MS", "200")) / 1000
+        # 流式分析：原因分析生成后即发送告警，开启后不再合并批量请求
+        self.llm_streaming = os.getenv("LLM_STREAMING", "false").lower() == "true"
+        # 重新分析队列：每次运行最多处理的条数、最大重试次数和首次重试间隔（之后每次翻倍）
+        self.reanalyze_batch_size = int(os.getenv("REANALYZE_BATCH_SIZE", "50"))
+        self.reanalyze_max_attempts = int(os.getenv("REANALYZE_MAX_ATTEMPTS", "5"))
+        self.reanalyze_backoff_minutes = float(os.getenv("REANALYZE_BACKOFF_MINUTES", "5"))
+        self.reanalyze_lease = timedelta(seconds=float(os.getenv("REANALYZE_LEASE_SECONDS", "600")))
+        # 流水线专用线程池，与FastAPI处理同步接口的线程池相互独立
+        workers = int(os.getenv("PIPELINE_WORKERS", "0")) or self.llm_concurrency + self.webhook_concurrency + 4
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-db")
+        # LLM并发上限在 1 到 LLM_CONCURRENCY 之间自适应，跨多次运行保留
+        self.llm_limiter = AdaptiveConcurrency(self.llm_concurrency)
+        self._run_lock = asyncio.Lock()
+
+    async def _offload(self, fn: Callable, *args):
+        """在流水线线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    async def _run_db(self, fn: Callable, *args):
+        """在数据库线程中执行，同一个Session始终只被一个线程使用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, functools.partial(fn, *args))
+
+    def _load_checkpoint(self, db: Session) -> Optional[dict]:
+        if self.checkpoint_name is None:
+            return None
+        return load_checkpoint(db, self.checkpoint_name)
+
+    def _commit_checkpoint(self, db: Session, checkpoint: dict):
+        if self.checkpoint_name is None:
+            return
+        save_checkpoint(db, self.checkpoint_name, checkpoint)
+        db.commit()
+
+    def _filter_processed(self, db: Session, errors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """过滤掉已经入库的ES文档，保证每条日志只分析一次"""
+        es_ids = [error["es_id"] for error in errors if error.get("es_id")]
+        processed_ids = set()
+        for i in range(0, len(es_ids), 500):
+            chunk = es_ids[i:i + 500]
+            processed_ids.update(
+                row[0] for row in db.query(ErrorLog.es_id).filter(ErrorLog.es_id.in_(chunk)).all()
+            )
+        if processed_ids:
+            logger.debug(f"跳过 {len(processed_ids)} 条已处理的日志")
+        return [error for error in errors if error.get("es_id") not in processed_ids]
+
+    def _due_reanalysis(self, db: Session) -> List[Tuple[str, str]]:
+        """领取到期的重新分析条目，与 work_items 一样跳过其他进程已锁定的行并把下次重试时间顺延租约时长，
+        多个worker不会重复分析同一类错误；进程中途退出时租约到期后重新领取"""
+        now = get_naive_shanghai_time()
+        try:
+            items = db.query(ReanalysisItem)\
+                .filter(ReanalysisItem.next_attempt_at <= now)\
+                .order_by(ReanalysisItem.next_attempt_at)\
+                .limit(self.reanalyze_batch_size)\
+                .with_for_update(skip_locked=True)\
+                .all()
+            leased = []
+            for item in items:
+                item.next_attempt_at = now + self.reanalyze_lease
+                leased.append((item.fingerprint, item.error_message))
+            db.commit()
+            return leased
+        except Exception:
+            db.rollback()
+            raise
+
+    def _apply_reanalysis(self, db: Session, results: List[Tuple[str, Optional[str]]]) -> int:
+        """写回重新分析的结果，返回更新的日志条数；仍然失败的推迟重试，超过次数后放弃
+
+        条目按特征值批量更新和删除，已被其他进程处理（删除）的条目直接跳过，不会使整批回滚。
+        """
+        updated = 0
+        now = get_naive_shanghai_time()
+        blobs = BlobBatch()
+        try:
+            for fingerprint, analysis in results:
+                item = db.query(ReanalysisItem).filter(ReanalysisItem.fingerprint == fingerprint)
+                if analysis is not None and not is_analysis_failure(analysis):
+                    preview, analysis_hash = blobs.put(analysis)
+                    updated += db.query(ErrorLog)\
+                        .filter(ErrorLog.fingerprint == fingerprint)\
+                        .filter(ErrorLog.analysis_result.startswith(ANALYSIS_FAILURE_PREFIX, autoescape=True))\
+                        .update({"analysis_result": preview, "analysis_hash": analysis_hash},
+                                synchronize_session=False)
+                    item.delete(synchronize_session=False)
+                    continue
+                attempts = db.query(ReanalysisItem.attempts)\
+                    .filter(ReanalysisItem.fingerprint == fingerprint).scalar()
+                if attempts is None:
+                    continue
+                attempts += 1
+                if attempts >= self.reanalyze_max_attempts:
+                    logger.warning(f"重新分析 {fingerprint} 失败 {attempts} 次，放弃")
+                    item.delete(synchronize_session=False)
+                else:
+                    delay = self.reanalyze_backoff_minutes * 2 ** (attempts - 1)
+                    item.update({"attempts": attempts, "next_attempt_at": now + timedelta(minutes=delay)},
+                                synchronize_session=False)
+            blobs.write(db)
+            db.commit()
+            blobs.committed()
+        except Exception:
+            db.rollback()
+            raise
+        return updated
+
+    async def _reanalyze(self, db: Session, llm: _LLMBatcher) -> int:
+        """重新分析之前失败的错误，成功后替换日志中的失败占位文本"""
+        items = await self._run_db(self._due_reanalysis, db)
+        if not items:
+            return 0
+        logger.info(f"重新分析 {len(items)} 类之前分析失败的错误")
+        analyses = await asyncio.gather(
+            *(self._analyze_with_cache(fingerprint, error_message, llm) for fingerprint, error_message in items),
+            return_exceptions=True,
+        )
+        results = [
+            (fingerprint, None if isinstance(analysis, BaseException) else analysis)
+            for (fingerprint, _), analysis in zip(items, analyses)
+        ]
+        updated = await self._run_db(self._apply_reanalysis, db, results)
+        if updated:
+            logger.info(f"重新分析后更新 {updated} 条日志")
+        return updated
+
+    async def _analyze_with_cache(self, fingerprint: str, error_message: str, llm: _LLMBatcher,
+                                  on_partial: Optional[Callable[[str], None]] = None) -> str:
+        if self.analysis_cache is not None:
+            cached = await self._offload(self.analysis_cache.get, fingerprint)
+            if cached is not None:
+                return cached
+
+        analysis = await llm.analyze(error_message, on_partial)
+        if self.analysis_cache is not None and not is_analysis_failure(analysis):
+            await self._offload(self.analysis_cache.set, fingerprint, analysis)
+        return analysis
+
+    async def _analyze(
+        self,
+        error: Dict[str, Any],
+        llm: _LLMBatcher,
+        inflight: Dict[str, "asyncio.Task[str]"],
+        on_partial: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        # 同一批次内特征值相同的错误共享一次分析，避免并发时重复调用大模型
+        fingerprint = error["fingerprint"]
+        task = inflight.get(fingerprint)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_with_cache(fingerprint, error["Exception"], llm, on_partial))
+            inflight[fingerprint] = task
+        return await asyncio.shield(task)
+
+    async def _alert(self, error: Dict[str, Any], analysis: str, webhook_semaphore: asyncio.Semaphore,
+                     immediate: bool = False) -> bool:
+        if self.wechat_service is None:
+            return False  # 不发送告警，只分析入库
+        async with webhook_semaphore:
+            return await self._offload(self.wechat_service.send_alert, error, analysis, immediate)
+
+    async def _process_one(
+        self,
+        error: Dict[str, Any],
+        llm: _LLMBatcher,
+        webhook_semaphore: asyncio.Semaphore,
+        inflight: Dict[str, "asyncio.Task[str]"],
+    ) -> Tuple[Dict[str, Any], str]:
+        error["fingerprint"] = generate_error_fingerprint(error["Exception"])
+        if not llm.stream:
+            analysis = await self._analyze(error, llm, inflight)
+            await self._alert(error, analysis, webhook_semaphore)
+            return error, analysis
+
+        # 流式模式：错误类型和原因分析生成后先发送告警，完整结果生成后再入库
+        loop = asyncio.get_running_loop()
+        partial = loop.create_future()
+
+        def on_partial(text: str):
+            loop.call_soon_threadsafe(lambda: partial.done() or partial.set_result(text))
+
+        analysis_task = asyncio.ensure_future(self._analyze(error, llm, inflight, on_partial))
+        try:
+            await asyncio.wait({analysis_task, partial}, return_when=asyncio.FIRST_COMPLETED)
+            if analysis_task.done():
+                analysis = analysis_task.result()
+                await self._alert(error, analysis, webhook_semaphore)
+            else:
+                # 提前告警不等汇总周期，否则会被 ALERT_WINDOW_SECONDS 推迟
+                await self._alert(error, partial.result() + EARLY_ALERT_SUFFIX, webhook_semaphore, immediate=True)
+                analysis = await analysis_task
+        finally:
+            analysis_task.cancel()
+            partial.cancel()
+        return error, analysis
+
+    async def run(self, db: Session) -> int:
+        """执行一次完整的分析流程，返回成功处理的日志条数
+
+        同一进程内同时只允许一次运行，重叠的触发直接跳过（下一次会从检查点继续）。
+        """
+        if self._run_lock.locked():
+            logger.debug("上一次分析任务仍在运行，跳过本次触发")
+            return 0
+        async with self._run_lock:
+            started = time.perf_counter()
+            try:
+                processed = await self._run(db)
+            except BaseException:
+                metrics.PIPELINE_RUNS_TOTAL.inc(status="error")
+                await self._run_db(db.rollback)
+                raise
+            finally:
+                metrics.PIPELINE_RUN_SECONDS.observe(time.perf_counter() - started)
+            metrics.PIPELINE_RUNS_TOTAL.inc(status="ok")
+            return processed
+
+    async def _produce(self, queue: asyncio.Queue, stop: threading.Event, checkpoint: Optional[dict], progress: dict):
+        """在线程中逐条读取ES并放入有界队列，队列满时阻塞，形成背压"""
+        loop = asyncio.get_running_loop()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def read():
+            try:
+                for entry in self.es_service.iter_errors_since(checkpoint, progress=progress):
+                    if stop.is_set():
+                        break
+                    put(entry)
+            finally:
+                put(_END)
+
+        await self._offload(read)
+
+    def _build_row(self, error: Dict[str, Any], analysis: str) -> Dict[str, Any]:
+        return {
+            "log_time": datetime.fromisoformat(error["timestamp"].replace('Z', '+00:00')),
+            "error_message": error["Exception"],
+            "analysis_result": analysis,
+            "application_id": error.get("application_id"),
+            "request_path": error.get("request_path") or None,
+            "es_id": error.get("es_id"),
+            "fingerprint": error.get("fingerprint"),
+            "occurrences": error.get("occurrences") or 1,
+            "created_at": get_shanghai_time(),
+        }
+
+    async def _run(self, db: Session) -> int:
+        checkpoint = await self._run_db(self._load_checkpoint, db)
+        progress: dict = {}
+
+        # 信号量需在事件循环内创建，每次运行独立计数
+        llm = _LLMBatcher(
+            self.deepseek_service,
+            self.llm_limiter,
+            self.deepseek_service.batch_size,
+            self.llm_batch_wait_seconds,
+            self._offload,
+            self.llm_streaming,
+        )
+        webhook_semaphore = asyncio.Semaphore(self.webhook_concurrency)
+        pending_semaphore = asyncio.Semaphore(self.max_pending)
+        inflight: Dict[str, "asyncio.Task[str]"] = {}
+        tasks: Dict[asyncio.Task, Dict[str, Any]] = {}  # 处理中的任务 -> 对应的日志
+        writer = _LogWriter(db, self.write_batch_size, self.flush_seconds, self._run_db)
+
+        def on_done(task: asyncio.Task):
+            error = tasks.pop(task)
+            pending_semaphore.release()
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                # 检查点会推进到这条日志之后，这里仍以占位文本入库并加入重新分析队列，不能丢弃
+                logger.warning(f"单条日志处理失败: {str(task.exception())}")
+                if not error.get("fingerprint"):
+                    try:
+                        error["fingerprint"] = generate_error_fingerprint(error["Exception"])
+                    except Exception:
+                        pass  # 没有特征值时只入库，不进入重新分析队列
+                writer.add(self._build_row(error, PROCESSING_FAILED))
+                return
+            writer.add(self._build_row(*task.result()))
+
+        logger.info(f"开始流式处理错误日志 "
+                    f"(LLM并发: {self.llm_concurrency}, Webhook并发: {self.webhook_concurrency})")
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = asyncio.ensure_future(self._produce(queue, stop, checkpoint, progress))
+        writer.start()
+        try:
+            ended = False
+            while not ended:
+                writer.raise_if_failed()
+                # 每次取出队列中已到达的一批日志，合并成一次数据库查询去重
+                entry = await queue.get()
+                batch = []
+                while entry is not _END:
+                    batch.append(entry)
+                    if queue.empty() or len(batch) >= 500:
+                        break
+                    entry = queue.get_nowait()
+                ended = entry is _END
+
+                for error in await self._run_db(self._filter_processed, db, batch):
+                    await pending_semaphore.acquire()
+                    task = asyncio.ensure_future(
+                        self._process_one(error, llm, webhook_semaphore, inflight)
+                    )
+                    tasks[task] = error
+                    task.add_done_callback(on_done)
+
+            if tasks:
+                await asyncio.wait(set(tasks))
+            await producer
+            await writer.close()
+            writer.raise_if_failed()
+        except BaseException:
+            # 让阻塞在队列上的读取线程尽快退出
+            stop.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.01)
+            for task in set(tasks):
+                task.cancel()
+            # 已提交的批次保留；检查点不推进，下次从原位置读取时已入库的记录会被跳过
+            await writer.close()
+            raise
+
+        if not writer.written:
+            logger.info("No recent errors found")
+
+        # 所有记录写入后再推进检查点
+        await self._run_db(self._commit_checkpoint, db, progress)
+
+        try:
+            await self._reanalyze(db, llm)
+        except Exception as e:
+            # 重新分析失败不影响本次运行结果，下次继续
+            logger.warning(f"重新分析失败: {str(e)}")
+            await self._run_db(db.rollback)
+
+        if self.analysis_cache is not None:
+            await self._offload(self.analysis_cache.maybe_purge)
+        return writer.written
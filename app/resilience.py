@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间直接拒绝请求"""
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续 failure_threshold 次失败或响应时间超过 latency_slo 秒后打开，打开期间直接拒绝请求，
+    不再等待上游超时；open_seconds 秒后进入半开状态，只放行一个探测请求，
+    探测成功则恢复，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, open_seconds: Optional[float] = None,
+                 latency_slo: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        self.open_seconds = open_seconds or float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+        self.latency_slo = latency_slo or float(os.getenv("LLM_LATENCY_SLO_SECONDS", "15"))
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允许发出请求；返回True后必须调用 record_success 或 record_failure"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+                logger.info(f"{self.name} 进入半开状态，发送探测请求")
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        if latency > self.latency_slo:
+            # 响应过慢与失败同样计数
+            self.record_failure(f"响应时间 {latency:.1f}s 超过 {self.latency_slo:.0f}s")
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"{self.name} 探测成功，恢复正常")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, reason: str = "请求失败"):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                logger.warning(f"{self.name} 熔断 {self.open_seconds:.0f}s"
+                               f" (连续失败 {self._failures} 次，最近一次: {reason})")
+
+
+class AdaptiveConcurrency:
+    """按响应时间自适应调整的并发上限（AIMD）
+
+    响应正常时每完成约 limit 个请求上限加1，失败或超过目标响应时间时上限减半，
+    同一个目标响应时间内最多减一次，避免一批慢请求把上限连续减到最小。
+    等待队列与事件循环无关，可以跨多次运行复用，上限在运行之间保留。
+    """
+
+    def __init__(self, max_limit: int, target_latency: Optional[float] = None, min_limit: int = 1,
+                 backoff: float = 0.5):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.target_latency = target_latency or float(os.getenv("LLM_LATENCY_SLO_SECONDS", "15"))
+        self.backoff = backoff
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    self._wake()  # 已被唤醒但被取消，把名额让给下一个等待者
+                raise
+        self.in_flight += 1
+
+    def release(self, latency: float, ok: bool):
+        self.in_flight -= 1
+        now = time.monotonic()
+        if not ok or latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency and self.limit > self.min_limit:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                logger.info(f"LLM并发上限降为 {int(self.limit)}")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        available = int(self.limit) - self.in_flight
+        while available > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                available -= 1
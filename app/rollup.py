@@ -0,0 +1,273 @@
+"""错误分组统计
+
+按错误特征值维护三张汇总表，随 error_logs 入库在同一事务中增量更新：
+
+- error_groups：每个特征值一行，首次/最近出现时间、累计次数和示例摘要
+- error_group_apps：特征值在各应用中的累计次数
+- error_group_hourly：按小时（日志时间）分桶的次数，用于时间范围内的Top N和趋势
+
+看板和统计接口只读这几张小表，不扫描 error_logs 的大字段。
+已有数据可以执行 python -m app.rollup 重建汇总表。
+"""
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .blobs import full_text, resolve
+from .config import configure_logging
+from .models import ErrorGroup, ErrorGroupApp, ErrorGroupHourly, ErrorLog, get_naive_shanghai_time
+from .normalizer import normalize_error
+
+logger = logging.getLogger(__name__)
+
+
+# 示例摘要的最大长度，与 error_groups.summary 字段一致
+SUMMARY_LENGTH = 500
+
+
+def bucket_hour(log_time: datetime) -> datetime:
+    return log_time.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(db: Session, table, rows: List[Dict[str, Any]], keys: Sequence[str], add: Sequence[str] = (),
+            least: Sequence[str] = (), greatest: Sequence[str] = ()):
+    """批量插入，主键冲突时累加 add 列，least/greatest 列分别取较小/较大值
+
+    行按主键排序后写入，多个进程同时更新相同的分组时按相同顺序加锁，避免死锁。
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    if db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        new = stmt.inserted
+        updates = {name: table.c[name] + new[name] for name in add}
+        updates.update({name: func.least(table.c[name], new[name]) for name in least})
+        updates.update({name: func.greatest(table.c[name], new[name]) for name in greatest})
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        new = stmt.excluded
+        updates = {name: table.c[name] + new[name] for name in add}
+        # SQLite 的多参数 min/max 是标量函数
+        updates.update({name: func.min(table.c[name], new[name]) for name in least})
+        updates.update({name: func.max(table.c[name], new[name]) for name in greatest})
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=updates)
+    db.execute(stmt)
+
+
+def update_rollups(db: Session, rows: Iterable[Dict[str, Any]]):
+    """把一批新入库的日志累加到汇总表，不提交，由调用方与日志写入在同一事务中提交
+
+    rows 为 error_logs 的行字典，没有特征值的记录不计入，每行按 occurrences 计数；
+    行中带 summary 时直接作为示例摘要。
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    apps: Dict[tuple, Dict[str, Any]] = {}
+    hourly: Dict[tuple, int] = defaultdict(int)
+    for row in rows:
+        fingerprint = row.get("fingerprint")
+        if not fingerprint:
+            continue
+        log_time = row["log_time"].replace(tzinfo=None)
+        application_id = row.get("application_id") or ""
+        occurrences = row.get("occurrences") or 1
+        group = groups.get(fingerprint)
+        if group is None:
+            groups[fingerprint] = {
+                "fingerprint": fingerprint,
+                "summary": row.get("summary") or normalize_error(row["error_message"]).summary[:SUMMARY_LENGTH],
+                "first_seen": log_time,
+                "last_seen": log_time,
+                "total_count": occurrences,
+            }
+        else:
+            group["first_seen"] = min(group["first_seen"], log_time)
+            group["last_seen"] = max(group["last_seen"], log_time)
+            group["total_count"] += occurrences
+        app = apps.get((fingerprint, application_id))
+        if app is None:
+            apps[(fingerprint, application_id)] = {
+                "fingerprint": fingerprint,
+                "application_id": application_id,
+                "first_seen": log_time,
+                "last_seen": log_time,
+                "count": occurrences,
+            }
+        else:
+            app["first_seen"] = min(app["first_seen"], log_time)
+            app["last_seen"] = max(app["last_seen"], log_time)
+            app["count"] += occurrences
+        hourly[(bucket_hour(log_time), application_id, fingerprint)] += occurrences
+
+    _upsert(db, ErrorGroup.__table__, list(groups.values()), ["fingerprint"],
+            add=["total_count"], least=["first_seen"], greatest=["last_seen"])
+    _upsert(db, ErrorGroupApp.__table__, list(apps.values()), ["fingerprint", "application_id"],
+            add=["count"], least=["first_seen"], greatest=["last_seen"])
+    _upsert(db, ErrorGroupHourly.__table__, [
+        {"bucket_start": bucket, "application_id": application_id, "fingerprint": fingerprint, "count": count}
+        for (bucket, application_id, fingerprint), count in hourly.items()
+    ], ["bucket_start", "application_id", "fingerprint"], add=["count"])
+
+
+def top_groups(db: Session, since: datetime, until: Optional[datetime] = None,
+               application_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """时间范围内出现次数最多的错误分组，附带各应用的次数"""
+    def in_range(query):
+        query = query.filter(ErrorGroupHourly.bucket_start >= bucket_hour(since))
+        if until is not None:
+            query = query.filter(ErrorGroupHourly.bucket_start < until)
+        if application_id:
+            query = query.filter(ErrorGroupHourly.application_id == application_id)
+        return query
+
+    total = func.sum(ErrorGroupHourly.count)
+    ranked = in_range(db.query(ErrorGroupHourly.fingerprint, total.label("count")))\
+        .group_by(ErrorGroupHourly.fingerprint)\
+        .order_by(total.desc(), ErrorGroupHourly.fingerprint)\
+        .limit(limit)\
+        .all()
+    fingerprints = [fingerprint for fingerprint, _ in ranked]
+    if not fingerprints:
+        return []
+
+    groups = {group.fingerprint: group for group in
+              db.query(ErrorGroup).filter(ErrorGroup.fingerprint.in_(fingerprints)).all()}
+    applications: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for fingerprint, app_id, count in in_range(
+        db.query(ErrorGroupHourly.fingerprint, ErrorGroupHourly.application_id, func.sum(ErrorGroupHourly.count))
+    ).filter(ErrorGroupHourly.fingerprint.in_(fingerprints))\
+            .group_by(ErrorGroupHourly.fingerprint, ErrorGroupHourly.application_id)\
+            .all():
+        applications[fingerprint][app_id] = int(count)
+
+    result = []
+    for fingerprint, count in ranked:
+        group = groups.get(fingerprint)
+        result.append({
+            "fingerprint": fingerprint,
+            "summary": group.summary if group else None,
+            "count": int(count),
+            "total_count": group.total_count if group else int(count),
+            "first_seen": group.first_seen if group else None,
+            "last_seen": group.last_seen if group else None,
+            "applications": applications[fingerprint],
+        })
+    return result
+
+
+def time_series(db: Session, since: datetime, until: Optional[datetime] = None,
+                fingerprint: Optional[str] = None, application_id: Optional[str] = None,
+                interval: str = "hour") -> List[Dict[str, Any]]:
+    """按小时或天汇总的错误次数，没有错误的时间段不返回"""
+    query = db.query(ErrorGroupHourly.bucket_start, func.sum(ErrorGroupHourly.count))\
+        .filter(ErrorGroupHourly.bucket_start >= bucket_hour(since))
+    if until is not None:
+        query = query.filter(ErrorGroupHourly.bucket_start < until)
+    if fingerprint:
+        query = query.filter(ErrorGroupHourly.fingerprint == fingerprint)
+    if application_id:
+        query = query.filter(ErrorGroupHourly.application_id == application_id)
+    points: Dict[datetime, int] = defaultdict(int)
+    for bucket, count in query.group_by(ErrorGroupHourly.bucket_start).all():
+        if interval == "day":
+            bucket = bucket.replace(hour=0)
+        points[bucket] += int(count)
+    return [{"bucket": bucket, "count": count} for bucket, count in sorted(points.items())]
+
+
+def group_detail(db: Session, fingerprint: str) -> Optional[Dict[str, Any]]:
+    group = db.get(ErrorGroup, fingerprint)
+    if group is None:
+        return None
+    apps = db.query(ErrorGroupApp)\
+        .filter(ErrorGroupApp.fingerprint == fingerprint)\
+        .order_by(ErrorGroupApp.count.desc())\
+        .all()
+    return {
+        "fingerprint": group.fingerprint,
+        "summary": group.summary,
+        "total_count": group.total_count,
+        "first_seen": group.first_seen,
+        "last_seen": group.last_seen,
+        "applications": [
+            {"application_id": app.application_id, "count": app.count,
+             "first_seen": app.first_seen, "last_seen": app.last_seen}
+            for app in apps
+        ],
+    }
+
+
+def rebuild_rollups(db: Session, batch_size: int = 5000) -> int:
+    """清空汇总表并按 error_logs 中的已有记录重新累加，返回计入的记录数
+
+    按主键分批读取，只读取统计需要的列；每个特征值的示例摘要取该特征值最早的一条记录。
+    """
+    for model in (ErrorGroupHourly, ErrorGroupApp, ErrorGroup):
+        db.execute(delete(model))
+    summaries: Dict[str, str] = {}
+    last_id, total = 0, 0
+    while True:
+        batch = db.query(ErrorLog.id, ErrorLog.log_time, ErrorLog.application_id, ErrorLog.fingerprint,
+                         ErrorLog.occurrences)\
+            .filter(ErrorLog.id > last_id, ErrorLog.fingerprint.isnot(None))\
+            .order_by(ErrorLog.id)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            break
+        missing = {row.fingerprint for row in batch} - summaries.keys()
+        if missing:
+            first_ids = select(func.min(ErrorLog.id))\
+                .where(ErrorLog.fingerprint.in_(missing))\
+                .group_by(ErrorLog.fingerprint)
+            firsts = db.query(ErrorLog.fingerprint, ErrorLog.error_message, ErrorLog.message_hash)\
+                .filter(ErrorLog.id.in_(first_ids))\
+                .all()
+            texts = resolve(db, (row.message_hash for row in firsts))
+            for fingerprint, error_message, message_hash in firsts:
+                message = full_text(error_message, message_hash, texts)
+                summaries[fingerprint] = normalize_error(message).summary[:SUMMARY_LENGTH]
+        update_rollups(db, [
+            {"fingerprint": row.fingerprint, "log_time": row.log_time, "application_id": row.application_id,
+             "occurrences": row.occurrences, "summary": summaries[row.fingerprint]}
+            for row in batch
+        ])
+        db.commit()
+        last_id, total = batch[-1].id, total + len(batch)
+        logger.info(f"已汇总 {total} 条记录")
+    db.commit()
+    return total
+
+
+def hours_ago(hours: int) -> datetime:
+    """当前北京时间（不带时区）往前 hours 小时"""
+    return get_naive_shanghai_time() - timedelta(hours=hours)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按 error_logs 重建错误分组统计表")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批读取的记录数")
+    args = parser.parse_args()
+
+    configure_logging()
+    from .database import SessionLocal
+    from .migrate import migrate
+    migrate()
+    db = SessionLocal()
+    try:
+        total = rebuild_rollups(db, args.batch_size)
+    finally:
+        db.close()
+    print(f"重建完成，共汇总 {total} 条记录")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import Schedule, ScheduleRun, get_naive_shanghai_time
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SCHEDULE = "default"
+
+
+class CronExpression:
+    """5段cron表达式：分 时 日 月 周，支持 * , - / 语法，周日为0或7"""
+
+    _ranges = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("cron表达式需要5段：分 时 日 月 周")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._ranges)
+        ]
+        self.weekdays = {day % 7 for day in weekdays}
+        # 与标准cron一致：日和周都指定时，满足其一即可
+        self.day_any = fields[2] == "*"
+        self.weekday_any = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"无效的步长: {step_text}")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"取值超出范围 {low}-{high}: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_any and self.weekday_any:
+            return True
+        if self.day_any:
+            return weekday_ok
+        if self.weekday_any:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """返回严格晚于 moment 的下一次触发时间"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"cron表达式没有可触发的时间: {self.expression}")
+
+
+def next_run_time(schedule: Schedule, after: datetime) -> datetime:
+    if schedule.cron:
+        return CronExpression(schedule.cron).next_after(after)
+    return after + timedelta(seconds=schedule.interval_seconds)
+
+
+class Scheduler:
+    """进程内定时任务调度
+
+    定时任务配置保存在schedules表中，每次执行记录写入schedule_runs表。
+    同一个定时任务同时最多运行一次：运行期间到期的触发会合并，结束后从当前时间重新计算下次执行时间。
+    多个进程（uvicorn --workers、多台机器）共用同一个数据库时，执行前先在schedules表上取得租约，
+    只有取得租约的进程执行，其余进程跳过；租约在执行期间定期顺延，进程崩溃时到期后由其他进程接手。
+    服务停机期间错过的执行不会逐个补跑，启动后立即执行一次，分析流水线会从检查点继续读取，
+    停机期间的日志不会遗漏。
+    """
+
+    def __init__(self, job: Callable[[Session], Awaitable[int]], session_factory=SessionLocal):
+        self.job = job
+        self.session_factory = session_factory
+        self.tick_seconds = float(os.getenv("SCHEDULER_TICK_SECONDS", "5"))
+        self.lease_seconds = float(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def _prepare(self):
+        """启动时的准备工作
+
+        租约已过期（执行的进程已退出）但仍在运行的记录标记为中断；没有任何定时任务时创建默认任务，
+        间隔取自 SCHEDULE_INTERVAL_SECONDS。
+        """
+        db = self.session_factory()
+        try:
+            now = get_naive_shanghai_time()
+            held = db.query(Schedule.name)\
+                .filter(Schedule.lease_until.isnot(None), Schedule.lease_until > now)
+            db.query(ScheduleRun)\
+                .filter(ScheduleRun.status == "running")\
+                .filter(ScheduleRun.schedule_name.notin_(held))\
+                .update({"status": "failed", "error": "服务重启，执行中断"}, synchronize_session=False)
+            if db.query(Schedule).count() == 0:
+                db.add(Schedule(
+                    name=DEFAULT_SCHEDULE,
+                    interval_seconds=int(os.getenv("SCHEDULE_INTERVAL_SECONDS", "300")),
+                    enabled=True,
+                    next_run_at=now,
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+    async def start(self):
+        """启动调度循环，不等待数据库；准备工作在循环中完成，数据库暂不可用时下一轮重试"""
+        self._loop_task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        if self._running:
+            await asyncio.wait(set(self._running.values()))
+
+    def is_running(self, name: str, lease_until: Optional[datetime] = None) -> bool:
+        """本进程正在执行，或其他进程持有未过期的租约"""
+        return name in self._running or (lease_until is not None and lease_until > get_naive_shanghai_time())
+
+    def _due_schedules(self) -> List[str]:
+        db = self.session_factory()
+        try:
+            rows = db.query(Schedule.name)\
+                .filter(Schedule.enabled.is_(True))\
+                .filter((Schedule.next_run_at.is_(None)) | (Schedule.next_run_at <= get_naive_shanghai_time()))\
+                .all()
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+    async def _loop(self):
+        prepared = False
+        while True:
+            try:
+                if not prepared:
+                    await asyncio.to_thread(self._prepare)
+                    prepared = True
+                for name in await asyncio.to_thread(self._due_schedules):
+                    self.trigger(name, "schedule")
+            except Exception as e:
+                logger.warning(f"检查定时任务失败: {str(e)}")
+            await asyncio.sleep(self.tick_seconds)
+
+    def trigger(self, name: str, trigger: str = "manual") -> bool:
+        """立即执行定时任务，任务正在运行时不重复执行并返回False"""
+        if name in self._running:
+            return False
+        task = asyncio.ensure_future(self._execute(name, trigger))
+        self._running[name] = task
+        task.add_done_callback(lambda _: self._running.pop(name, None))
+        return True
+
+    def _lease(self, name: str, renew: bool = False) -> bool:
+        """取得或顺延定时任务的执行租约，其他进程持有未过期的租约时返回False"""
+        db = self.session_factory()
+        try:
+            now = get_naive_shanghai_time()
+            query = db.query(Schedule).filter(Schedule.name == name)
+            if renew:
+                query = query.filter(Schedule.lease_owner == self.instance_id)
+            else:
+                query = query.filter((Schedule.lease_until.is_(None)) | (Schedule.lease_until <= now) |
+                                     (Schedule.lease_owner == self.instance_id))
+            updated = query.update({
+                "lease_owner": self.instance_id,
+                "lease_until": now + timedelta(seconds=self.lease_seconds),
+                "updated_at": Schedule.updated_at,  # 租约不算配置变更
+            }, synchronize_session=False)
+            db.commit()
+            if updated == 0 and not renew and db.get(Schedule, name) is None:
+                return True  # 已删除的定时任务（如手动触发default）没有租约可取，直接执行
+            return updated == 1
+        finally:
+            db.close()
+
+    def _release(self, name: str):
+        db = self.session_factory()
+        try:
+            db.query(Schedule)\
+                .filter(Schedule.name == name, Schedule.lease_owner == self.instance_id)\
+                .update({"lease_owner": None, "lease_until": None, "updated_at": Schedule.updated_at},
+                        synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _keep_lease(self, name: str):
+        """执行期间定期顺延租约"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await asyncio.to_thread(self._lease, name, True):
+                    logger.warning(f"定时任务 {name} 的租约已被其他进程接手")
+            except Exception as e:
+                logger.warning(f"顺延定时任务 {name} 的租约失败: {str(e)}")
+
+    def _start_run(self, name: str, trigger: str) -> int:
+        db = self.session_factory()
+        try:
+            run = ScheduleRun(schedule_name=name, trigger=trigger, status="running", started_at=get_naive_shanghai_time())
+            db.add(run)
+            db.commit()
+            return run.id
+        finally:
+            db.close()
+
+    def _finish_run(self, name: str, run_id: int, status: str, processed: Optional[int],
+                    error: Optional[str], duration_ms: int):
+        db = self.session_factory()
+        try:
+            now = get_naive_shanghai_time()
+            run = db.get(ScheduleRun, run_id)
+            run.status = status
+            run.processed = processed
+            run.error = error
+            run.finished_at = now
+            run.duration_ms = duration_ms
+            schedule = db.get(Schedule, name)
+            if schedule is not None:
+                schedule.last_run_at = run.started_at
+                # 从结束时间计算下次执行，运行期间错过的触发合并为这一次
+                schedule.next_run_at = next_run_time(schedule, now)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _execute(self, name: str, trigger: str):
+        try:
+            if not await asyncio.to_thread(self._lease, name):
+                logger.debug(f"定时任务 {name} 正在其他进程中执行，跳过")
+                return
+        except Exception as e:
+            logger.warning(f"获取定时任务 {name} 的租约失败，跳过本次执行: {str(e)}")
+            return
+        keeper = asyncio.ensure_future(self._keep_lease(name))
+        try:
+            await self._execute_leased(name, trigger)
+        finally:
+            keeper.cancel()
+            try:
+                await asyncio.to_thread(self._release, name)
+            except Exception as e:
+                logger.warning(f"释放定时任务 {name} 的租约失败，到期后自动释放: {str(e)}")
+
+    async def _execute_leased(self, name: str, trigger: str):
+        try:
+            run_id = await asyncio.to_thread(self._start_run, name, trigger)
+        except Exception as e:
+            logger.warning(f"记录执行开始失败，跳过本次执行: {str(e)}")
+            return
+        started = time.monotonic()
+        db = self.session_factory()
+        status, processed, error = "success", None, None
+        try:
+            processed = await self.job(db)
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.warning(f"定时任务 {name} 执行失败: {error}")
+        finally:
+            await asyncio.to_thread(db.close)
+            duration_ms = int((time.monotonic() - started) * 1000)
+            try:
+                await asyncio.to_thread(self._finish_run, name, run_id, status, processed, error, duration_ms)
+            except Exception as e:
+                logger.warning(f"记录执行结果失败: {str(e)}")
@@ -1,208 +1,460 @@
 from datetime import datetime, timedelta
 import pytz
-from elasticsearch import Elasticsearch
 import requests
 import json
-from dotenv import load_dotenv
+import logging
 import os
 import re
-import hashlib
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-load_dotenv()
+from .alerting import AlertAggregator, create_rate_limiter
+from .dedup import DedupEntry, DedupStore, create_dedup_store
+from .http_client import RetryPolicy, create_session, post_with_retry
+from .resilience import CircuitBreaker, CircuitOpenError
+from .normalizer import normalize_error
+from . import config, metrics  # noqa: F401  导入config时加载.env
+
+logger = logging.getLogger(__name__)
+
+
+# 分析失败时返回的占位文本都以此开头，这类结果不应被缓存
+ANALYSIS_FAILURE_PREFIX = "分析服务"
+
+
+# 分析结果中"解决方案"部分的开头，之前的错误类型和原因分析已足够用于告警
+_SOLUTION_SECTION = re.compile(r'(?m)^[ \t>#*]*(?:3\s*[.、．:：)]|[^\n]{0,6}(?:解决方案|解决建议|建议的解决))')
+
+# 熔断期间的占位文本，记录会进入重新分析队列，上游恢复后自动补齐
+PENDING_ANALYSIS = f"{ANALYSIS_FAILURE_PREFIX}暂不可用，稍后自动重新分析"
+
+
+def is_analysis_failure(analysis: str) -> bool:
+    """判断分析结果是否为失败占位文本"""
+    return not analysis or analysis.startswith(ANALYSIS_FAILURE_PREFIX)
+
+
+def generate_error_fingerprint(error_info: str) -> str:
+    """生成错误的归一化特征值，告警去重和分析缓存共用"""
+    return normalize_error(error_info).fingerprint
+
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+
+
+def build_log_entry(hit: dict) -> dict:
+    """将ES命中记录转换为统一的错误日志对象，文件导入等其他来源也按此格式产出"""
+    source = hit["_source"]
+    # 转换时间到北京时间
+    utc_time = datetime.fromisoformat(source["@timestamp"].replace('Z', '+00:00'))
+    beijing_time = utc_time.astimezone(BEIJING_TZ)
+    
+    # 构建错误日志对象
+    log_entry = {
+        "es_id": hit.get("_id"),
+        "timestamp": beijing_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "application_id": source.get("ApplicationId", "未知应用"),
+        "Exception": source.get("Exception", ""),
+        "Message": source.get("Message", ""),
+        "StackTrace": source.get("StackTrace", ""),
+        "request_path": source.get("Request.Path", ""),
+        "status_code": source.get("Response.StatusCode", "")
+    }
+    
+    # 组合完整的错误信息
+    error_parts = []
+    if log_entry["Exception"]:
+        error_parts.append(f"异常: {log_entry['Exception']}")
+    if log_entry["Message"]:
+        error_parts.append(f"消息: {log_entry['Message']}")
+    if log_entry["StackTrace"]:
+        error_parts.append(f"堆栈: {log_entry['StackTrace']}")
+    
+    log_entry["Exception"] = "\n".join(error_parts)
+    return log_entry
 
 
 class ESService:
+    # 查询时返回的字段
+    _source_fields = [
+        "@timestamp",
+        "LogLevel",
+        "Exception",
+        "ApplicationId",
+        "Message",
+        "StackTrace",
+        "Request.Path",
+        "Response.StatusCode"
+    ]
+
     def __init__(self):
+        # elasticsearch客户端导入较慢，在创建ESService时才导入
+        from elasticsearch import Elasticsearch
         self.es = Elasticsearch(
             os.getenv("ES_HOST"),
             basic_auth=(os.getenv("ES_USERNAME"), os.getenv("ES_PASSWORD")),
             verify_certs=False
         )
-        self.beijing_tz = pytz.timezone('Asia/Shanghai')
+        self.beijing_tz = BEIJING_TZ
+        self.page_size = int(os.getenv("ES_PAGE_SIZE", "500"))
+        self.max_hits_per_run = int(os.getenv("ES_MAX_HITS_PER_RUN", "10000"))
+        self.ingest_lag_seconds = int(os.getenv("ES_INGEST_LAG_SECONDS", "10"))
+        self.max_catchup_days = int(os.getenv("ES_MAX_CATCHUP_DAYS", "7"))
+        # 预聚合模式：在ES中按应用、请求路径和异常类型分组，每组只取最新一条和出现次数
+        self.aggregate = os.getenv("ES_AGGREGATE", "false").lower() == "true"
+        self.group_fields = [
+            field.strip()
+            for field in os.getenv("ES_GROUP_FIELDS", "ApplicationId.keyword,Request.Path.keyword").split(",")
+            if field.strip()
+        ]
+        # 异常类型取该字段第一个冒号之前的部分，为空时不按异常类型分组
+        self.exception_type_field = os.getenv("ES_EXCEPTION_TYPE_FIELD", "Exception.keyword")
 
-    def get_recent_errors(self, minutes=5):
-        try:
-            print("[ES Query Debug] 准备发送错误分析请求")
-            print(f"[ES Query Debug] ES Host: {os.getenv('ES_HOST')}")
-            
-            # 获取当前北京时间
-            now = datetime.now(self.beijing_tz)
-            # 生成多个可能的索引模式，包括今天和昨天
-            today_index = f"log-{now.strftime('%Y.%m.%d')}"
-            yesterday = now - timedelta(days=1)
-            yesterday_index = f"log-{yesterday.strftime('%Y.%m.%d')}"
-            index_pattern = f"{today_index},{yesterday_index}"
-            
-            # ES的range查询使用UTC时间，需要将北京时间转换为UTC
-            utc_now = now.astimezone(pytz.UTC)
-            utc_start = utc_now - timedelta(minutes=minutes)
-            
-            print(f"[ES Query Debug] index_pattern: {index_pattern}")
-            print(f"[ES Query Debug] utc_now: {utc_now.isoformat()}")
-            print(f"[ES Query Debug] utc_start: {utc_start.isoformat()}")
-            
-            # 执行查询
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "range": {
-                                    "@timestamp": {
-                                        "gte": utc_start.isoformat(),
-                                        "lte": utc_now.isoformat()
-                                    }
-                                }
-                            }
-                        ],
-                        "should": [
-                            {"match": {"LogLevel": "fail"}},
-                            {
-                                "bool": {
-                                    "must": [
-                                        {"match": {"LogLevel": "info"}},
-                                        {
-                                            "range": {
-                                                "Response.StatusCode": {
-                                                    "gte": 501,
-                                                    "lte": 504
-                                                }
-                                            }
+    def _build_error_query(self, time_range: dict) -> dict:
+        """构建错误日志的过滤条件：fail级别，或info级别且状态码为501-504"""
+        return {
+            "bool": {
+                "must": [
+                    {"range": {"@timestamp": time_range}}
+                ],
+                "should": [
+                    {"match": {"LogLevel": "fail"}},
+                    {
+                        "bool": {
+                            "must": [
+                                {"match": {"LogLevel": "info"}},
+                                {
+                                    "range": {
+                                        "Response.StatusCode": {
+                                            "gte": 501,
+                                            "lte": 504
                                         }
-                                    ]
+                                    }
                                 }
-                            }
-                        ],
-                        "minimum_should_match": 1
+                            ]
+                        }
                     }
-                },
-                "sort": [
-                    {"@timestamp": {"order": "desc"}}
                 ],
-                "_source": [
-                    "@timestamp",
-                    "LogLevel",
-                    "Exception",
-                    "ApplicationId",
-                    "Message",
-                    "StackTrace",
-                    "Request.Path",
-                    "Response.StatusCode"
-                ]
+                "minimum_should_match": 1
             }
+        }
 
-            print("[ES Query Debug] Executing query:", query)
-            print("[ES Query Debug] Using index pattern:", index_pattern)
-            result = self.es.search(index=index_pattern, body=query, size=100)
-            print("[ES Query Debug] Query result:", result)
-            
-            logs = []
-            for hit in result["hits"]["hits"]:
-                source = hit["_source"]
-                # 转换时间到北京时间
-                utc_time = datetime.fromisoformat(source["@timestamp"].replace('Z', '+00:00'))
-                beijing_time = utc_time.astimezone(self.beijing_tz)
-                
-                # 构建错误日志对象
-                log_entry = {
-                    "timestamp": beijing_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "application_id": source.get("ApplicationId", "未知应用"),
-                    "Exception": source.get("Exception", ""),
-                    "Message": source.get("Message", ""),
-                    "StackTrace": source.get("StackTrace", ""),
-                    "request_path": source.get("Request.Path", ""),
-                    "status_code": source.get("Response.StatusCode", "")
+    def _index_pattern(self, start: datetime, end: datetime) -> str:
+        """生成覆盖[start, end]时间段的按天索引列表（索引按北京时间日期命名）"""
+        start_day = start.astimezone(self.beijing_tz).date() - timedelta(days=1)
+        end_day = end.astimezone(self.beijing_tz).date()
+        indices = []
+        day = end_day
+        while day >= start_day:
+            indices.append(f"log-{day.strftime('%Y.%m.%d')}")
+            day -= timedelta(days=1)
+        return ",".join(indices)
+
+    def _iter_hits(self, index_pattern: str, query: dict, order: str = "asc"):
+        """按 @timestamp 排序分页遍历查询结果，逐条产出ES命中记录
+
+        优先在point-in-time中用search_after翻页，ES不支持PIT时退回到以_id作为排序兜底字段。
+        每次只在内存中保留一页数据。
+        """
+        pit_id = None
+        try:
+            try:
+                pit_id = self.es.open_point_in_time(
+                    index=index_pattern, keep_alive="1m", ignore_unavailable=True
+                )["id"]
+            except Exception as e:
+                logger.debug(f"PIT不可用，使用普通search_after: {str(e)}")
+
+            search_after = None
+            while True:
+                body = {
+                    "query": query,
+                    "sort": [{"@timestamp": {"order": order}}],
+                    "_source": self._source_fields,
+                    "size": self.page_size
                 }
-                
-                # 组合完整的错误信息
-                error_parts = []
-                if log_entry["Exception"]:
-                    error_parts.append(f"异常: {log_entry['Exception']}")
-                if log_entry["Message"]:
-                    error_parts.append(f"消息: {log_entry['Message']}")
-                if log_entry["StackTrace"]:
-                    error_parts.append(f"堆栈: {log_entry['StackTrace']}")
-                
-                log_entry["Exception"] = "\n".join(error_parts)
-                logs.append(log_entry)
-            
-            print(f"[ES Query Debug] 检索到 {len(logs)} 条错误日志")
+                if search_after is not None:
+                    body["search_after"] = search_after
+                with metrics.ES_QUERY_SECONDS.time():
+                    if pit_id:
+                        body["pit"] = {"id": pit_id, "keep_alive": "1m"}
+                        result = self.es.search(body=body)
+                        pit_id = result.get("pit_id", pit_id)
+                    else:
+                        body["sort"].append({"_id": {"order": order}})
+                        result = self.es.search(index=index_pattern, body=body, ignore_unavailable=True)
+
+                hits = result["hits"]["hits"]
+                logger.debug(f"读取一页: {len(hits)} 条，ES耗时 {result.get('took')}ms")
+                yield from hits
+                if len(hits) < self.page_size:
+                    break
+                search_after = hits[-1]["sort"]
+        finally:
+            if pit_id:
+                try:
+                    self.es.close_point_in_time(body={"id": pit_id})
+                except Exception as e:
+                    logger.warning(f"关闭PIT失败: {str(e)}")
+
+    def _group_sources(self) -> List[dict]:
+        """composite聚合的分组字段，字段缺失的文档归入null分组"""
+        sources = [
+            {f"g{index}": {"terms": {"field": field, "missing_bucket": True}}}
+            for index, field in enumerate(self.group_fields)
+        ]
+        if self.exception_type_field:
+            sources.append({"exception_type": {"terms": {
+                "script": {
+                    "lang": "painless",
+                    "source": "def f = params.field; "
+                              "if (!doc.containsKey(f) || doc[f].size() == 0) { return ''; } "
+                              "String v = doc[f].value; int i = v.indexOf(':'); "
+                              "return i > 0 ? v.substring(0, i) : v;",
+                    "params": {"field": self.exception_type_field},
+                },
+                "missing_bucket": True,
+            }}})
+        return sources
+
+    def _iter_groups(self, index_pattern: str, query: dict):
+        """按分组字段在ES中聚合，逐组产出 (最新一条命中记录, 出现次数, 最早出现的毫秒时间戳)
+
+        使用composite聚合按 after_key 翻页，每页 page_size 个分组，每组通过top_hits只返回一条文档，
+        同一错误大量重复时传输和解析的数据量只与分组数有关。
+        """
+        after = None
+        while True:
+            composite = {"size": self.page_size, "sources": self._group_sources()}
+            if after is not None:
+                composite["after"] = after
+            body = {
+                "query": query,
+                "size": 0,
+                "track_total_hits": False,
+                "aggs": {
+                    "groups": {
+                        "composite": composite,
+                        "aggs": {
+                            "latest": {"top_hits": {
+                                "size": 1,
+                                "sort": [{"@timestamp": {"order": "desc"}}],
+                                "_source": self._source_fields,
+                            }},
+                            "first_seen": {"min": {"field": "@timestamp"}},
+                        },
+                    }
+                },
+            }
+            with metrics.ES_QUERY_SECONDS.time():
+                result = self.es.search(index=index_pattern, body=body, ignore_unavailable=True)
+            groups = result.get("aggregations", {}).get("groups", {})
+            buckets = groups.get("buckets", [])
+            logger.debug(f"读取一页分组: {len(buckets)} 组，ES耗时 {result.get('took')}ms")
+            for bucket in buckets:
+                hits = bucket["latest"]["hits"]["hits"]
+                if hits:
+                    yield hits[0], bucket["doc_count"], bucket["first_seen"].get("value")
+            after = groups.get("after_key")
+            if len(buckets) < self.page_size or after is None:
+                break
+
+    def _group_entry(self, hit: dict, occurrences: int, first_seen: Optional[float]) -> dict:
+        entry = build_log_entry(hit)
+        entry["occurrences"] = occurrences
+        if first_seen is not None:
+            entry["first_seen"] = datetime.fromtimestamp(first_seen / 1000, pytz.UTC)\
+                .astimezone(self.beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
+        return entry
+
+    def iter_recent_errors(self, minutes=5):
+        """逐条产出最近 minutes 分钟内的错误日志（按时间倒序）"""
+        # 获取当前北京时间
+        now = datetime.now(self.beijing_tz)
+        # 生成多个可能的索引模式，包括今天和昨天
+        index_pattern = self._index_pattern(now, now)
+        
+        # ES的range查询使用UTC时间，需要将北京时间转换为UTC
+        utc_now = now.astimezone(pytz.UTC)
+        utc_start = utc_now - timedelta(minutes=minutes)
+        
+        logger.debug(f"查询最近错误: index={index_pattern} range={utc_start.isoformat()} ~ {utc_now.isoformat()}")
+
+        query = self._build_error_query({
+            "gte": utc_start.isoformat(),
+            "lte": utc_now.isoformat()
+        })
+        if self.aggregate:
+            for group in self._iter_groups(index_pattern, query):
+                yield self._group_entry(*group)
+            return
+        for hit in self._iter_hits(index_pattern, query, order="desc"):
+            yield build_log_entry(hit)
+
+    def get_recent_errors(self, minutes=5):
+        try:
+            logs = list(self.iter_recent_errors(minutes))
+            logger.info(f"检索到 {len(logs)} 条错误日志")
             return logs
         except Exception as e:
-            print(f"[ES Query Debug] 发生错误: {str(e)}")
-            print(f"[ES Query Debug] 错误类型: {e.__class__.__name__}")
+            logger.error(f"查询ES失败 ({os.getenv('ES_HOST')}): {e.__class__.__name__}: {str(e)}")
             return []
 
+    def iter_errors_since(self, checkpoint: dict = None, minutes=5, progress: dict = None):
+        """从检查点开始增量读取错误日志，逐条产出
+
+        checkpoint 形如 {"last_timestamp": 毫秒时间戳, "last_ids": [该时间戳上已处理的_id]}，
+        为空时从最近 minutes 分钟开始。按 @timestamp 升序翻页直到读完
+        （单次最多 max_hits_per_run 条，剩余的下次继续读）。
+        传入 progress 字典时，会随消费进度实时更新为新的检查点，
+        只有被调用方取走的记录才会计入检查点。
+        """
+        if progress is None:
+            progress = {}
+        progress.clear()
+        progress.update(checkpoint or {})
+        progress["last_ids"] = list(progress.get("last_ids") or [])
+
+        now = datetime.now(pytz.UTC)
+        # 留出一小段入库延迟，避免读到一半时间戳上的文档还没写完
+        upper = now - timedelta(seconds=self.ingest_lag_seconds)
+        if checkpoint and checkpoint.get("last_timestamp") is not None:
+            last_timestamp = int(checkpoint["last_timestamp"])
+            seen_ids = set(checkpoint.get("last_ids") or [])
+            start = datetime.fromtimestamp(last_timestamp / 1000, pytz.UTC)
+            earliest = now - timedelta(days=self.max_catchup_days)
+            if start < earliest:
+                logger.warning(f"检查点过旧，仅追赶最近 {self.max_catchup_days} 天")
+                start, last_timestamp, seen_ids = earliest, None, set()
+        else:
+            start = now - timedelta(minutes=minutes)
+            last_timestamp, seen_ids = None, set()
+
+        if upper <= start:
+            return
+
+        index_pattern = self._index_pattern(start, upper)
+        time_range = {
+            "gte": int(start.timestamp() * 1000) if last_timestamp is None else last_timestamp,
+            "lte": int(upper.timestamp() * 1000),
+            "format": "epoch_millis"
+        }
+        logger.debug(f"增量读取: index={index_pattern} range={time_range}")
+
+        if self.aggregate:
+            yield from self._iter_aggregated_since(index_pattern, time_range, seen_ids, progress)
+            return
+
+        count = 0
+        for hit in self._iter_hits(index_pattern, self._build_error_query(time_range)):
+            hit_timestamp = int(hit["sort"][0])
+            if hit_timestamp == last_timestamp and hit["_id"] in seen_ids:
+                continue  # 上次运行已处理过的边界记录
+            yield build_log_entry(hit)
+            # 调用方取走该记录后才推进检查点
+            count += 1
+            if progress.get("last_timestamp") is None or hit_timestamp > progress["last_timestamp"]:
+                progress["last_timestamp"] = hit_timestamp
+                progress["last_ids"] = []
+            progress["last_ids"].append(hit["_id"])
+            if count >= self.max_hits_per_run:
+                logger.info(f"达到单次读取上限 {self.max_hits_per_run} 条，剩余的下次继续")
+                metrics.ES_HITS_PER_RUN.observe(count)
+                return
+
+        if count == 0:
+            # 没有新日志时直接推进到本次查询上界，避免下次重复扫描空区间
+            progress["last_timestamp"] = time_range["lte"]
+            progress["last_ids"] = []
+        logger.info(f"增量检索到 {count} 条错误日志")
+        metrics.ES_HITS_PER_RUN.observe(count)
+
+    def _iter_aggregated_since(self, index_pattern: str, time_range: dict, seen_ids: set, progress: dict):
+        """预聚合模式的增量读取：查询 [gte, lte) 区间内的分组，全部取走后检查点推进到 lte
+
+        上次按条读取时已处理的边界记录通过 must_not 排除；一次读取整个区间，不受 ES_MAX_HITS_PER_RUN 限制。
+        """
+        time_range = {"gte": time_range["gte"], "lt": time_range["lte"], "format": "epoch_millis"}
+        query = self._build_error_query(time_range)
+        if seen_ids:
+            query["bool"]["must_not"] = [{"ids": {"values": sorted(seen_ids)}}]
+        groups, hits = 0, 0
+        for group in self._iter_groups(index_pattern, query):
+            yield self._group_entry(*group)
+            groups += 1
+            hits += group[1]
+        progress["last_timestamp"] = time_range["lt"]
+        progress["last_ids"] = []
+        logger.info(f"增量检索到 {hits} 条错误日志，预聚合为 {groups} 组")
+        metrics.ES_HITS_PER_RUN.observe(hits)
+
+    def get_errors_since(self, checkpoint: dict = None, minutes=5):
+        """增量读取错误日志，返回 (日志列表, 新检查点)"""
+        progress = {}
+        logs = list(self.iter_errors_since(checkpoint, minutes, progress))
+        return logs, progress
+
 
 class DeepseekService:
     def __init__(self):
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         self.api_url = os.getenv("DEEPSEEK_API_URL")
         self.model = "deepseek-chat"  # 使用基础模型名称
+        self.system_prompt = "你是一个专业的错误日志分析助手。请简洁地分析错误原因并给出具体的解决方案。分析要点：1. 错误类型和关键信息 2. 可能的原因 3. 建议的解决方案"
+        # 批量分析：一次请求最多包含的错误条数，以及单次请求的输入token预算
+        self.batch_size = int(os.getenv("LLM_BATCH_SIZE", "8"))
+        self.batch_token_budget = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "3000"))
+        # 连接池大小应不小于LLM并发数，否则多出的请求会重新建立连接
+        self.session = create_session(int(os.getenv("DEEPSEEK_POOL_SIZE", "10")))
+        self.retry_policy = RetryPolicy()
+        # 上游故障或持续变慢时熔断，请求直接返回占位文本，不再逐条等待超时
+        self.breaker = CircuitBreaker("Deepseek")
+
+    def _post(self, data: dict, timeout: float, items: int = 1, stream: bool = False) -> requests.Response:
+        """经熔断器发送请求，按单条错误的平均耗时记录响应时间
+
+        流式请求返回200时由调用方读完响应体后再记录结果。
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError()
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        started = time.monotonic()
+        try:
+            response = post_with_retry(self.session, self.api_url, self.retry_policy,
+                                       headers=headers, json=data, timeout=timeout, stream=stream)
+        except BaseException as e:
+            # 任何异常都要记录结果，否则半开状态的探测请求会一直占着名额
+            self.breaker.record_failure(e.__class__.__name__)
+            raise
+        if response.status_code >= 400:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        elif not stream:
+            self.breaker.record_success((time.monotonic() - started) / items)
+        return response
+
+    def _observe(self, mode: str, status: str, started: Optional[float] = None, usage: Optional[dict] = None):
+        """记录一次请求的结果、耗时和token用量"""
+        metrics.LLM_REQUESTS_TOTAL.inc(mode=mode, status=status)
+        if started is not None:
+            metrics.LLM_REQUEST_SECONDS.observe(time.monotonic() - started, mode=mode)
+        if usage:
+            metrics.LLM_TOKENS_TOTAL.inc(usage.get("prompt_tokens") or 0, type="prompt")
+            metrics.LLM_TOKENS_TOTAL.inc(usage.get("completion_tokens") or 0, type="completion")
 
     def _simplify_error_log(self, error_log: str) -> str:
         """简化错误日志，提取关键信息"""
-        # 将多行错误堆栈转为单行
-        error_log = error_log.replace('\n', ' ').replace('\r', ' ')
-        
-        # 移除多余的空格
-        error_log = ' '.join(error_log.split())
-        
-        # 提取关键信息的模式
-        patterns = [
-            r'Error: .*?(?=\s+at\s+|$)',  # 提取错误描述
-            r'Exception: .*?(?=\s+at\s+|$)',  # 提取异常描述
-            r'Failed to .*?(?=\s+at\s+|$)',  # 提取Failed to类型的错误
-            r'status code (\d+)',  # 提取HTTP状态码
-            r'at .*?:\d+:\d+',  # 保留最关键的堆栈信息
-            r'Caused by: .*?(?=\s+at\s+|$)',  # 提取根本原因
-            r'message: ".*?"',  # 提取错误消息
-            r'reason: ".*?"'  # 提取错误原因
-        ]
-        
-        # 提取匹配的关键信息
-        key_info = []
-        for pattern in patterns:
-            matches = re.findall(pattern, error_log)
-            if matches:
-                # 如果是列表中的第一个模式（错误描述），保留更多内容
-                if pattern == patterns[0]:
-                    key_info.extend(matches[:3])  # 错误描述保留前三条
-                else:
-                    key_info.extend(matches[:1])  # 其他类型只保留第一条
-        
-        if not key_info:
-            # 如果没有匹配到任何模式，尝试提取引号中的内容
-            quoted = re.findall(r'"([^"]+)"', error_log)
-            if quoted:
-                return ' | '.join(quoted[:3])  # 最多保留3个引号中的内容
-            # 如果还是没有，返回原始日志的前200个字符
-            return error_log[:200] + ('...' if len(error_log) > 200 else '')
-        
-        # 组合关键信息，确保总长度不超过500字符
-        simplified_log = ' | '.join(key_info)
-        if len(simplified_log) > 500:
-            return simplified_log[:500] + '...'
-        return simplified_log
+        return normalize_error(error_log).summary
 
     def analyze_error(self, error_message: str) -> str:
+        started = time.monotonic()
         try:
             # 简化错误日志
             simplified_error = self._simplify_error_log(error_message)
-            print(f"[Deepseek Debug] 原始错误日志长度: {len(error_message)} chars")
-            print(f"[Deepseek Debug] 简化后日志长度: {len(simplified_error)} chars")
-            print("[Deepseek Debug] 简化后日志内容:")
-            print(simplified_error)
-            
-            print("[Deepseek Debug] 准备发送错误分析请求")
-            print(f"[Deepseek Debug] API URL: {self.api_url}")
-            print(f"[Deepseek Debug] Model: {self.model}")
-            print(f"[Deepseek Debug] Error message length: {len(error_message)} chars")
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            logger.debug(f"发送错误分析请求: model={self.model} "
+                         f"原始日志 {len(error_message)} chars，简化后 {len(simplified_error)} chars")
 
             # 构建API请求数据
             data = {
@@ -210,7 +462,7 @@ class DeepseekService:
                 "messages": [
                     {
                         "role": "system",
-                        "content": "你是一个专业的错误日志分析助手。请简洁地分析错误原因并给出具体的解决方案。分析要点：1. 错误类型和关键信息 2. 可能的原因 3. 建议的解决方案"
+                        "content": self.system_prompt
                     },
                     {
                         "role": "user",
@@ -221,49 +473,300 @@ class DeepseekService:
                 "stream": False
             }
             
-            # 打印详细的请求信息
-            print("[Deepseek Debug] 发送API请求...")
-            print(f"[Deepseek Debug] 请求参数: {json.dumps({k:v for k,v in data.items() if k != 'messages'}, ensure_ascii=False)}")
-            print(f"[Deepseek Debug] 系统提示词长度: {len(data['messages'][0]['content'])} chars")
-            print(f"[Deepseek Debug] 用户消息长度: {len(data['messages'][1]['content'])} chars")
-            
             # 发送请求并处理响应
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=30)  # 添加超时设置
-            print(f"[Deepseek Debug] API响应状态码: {response.status_code}")
-            
+            response = self._post(data, timeout=30)  # 添加超时设置
+
             if response.status_code == 200:
                 result = response.json()
-                print("[Deepseek Debug] 成功获取响应")
-                print(f"[Deepseek Debug] 响应内容: {json.dumps(result, ensure_ascii=False)}")
                 if "choices" in result and len(result["choices"]) > 0:
                     analysis = result["choices"][0]["message"]["content"]
-                    print(f"[Deepseek Debug] 分析结果长度: {len(analysis)} chars")
+                    self._observe("single", "ok", started, result.get("usage"))
+                    logger.debug(f"分析结果长度: {len(analysis)} chars")
                     return analysis
                 else:
-                    print("[Deepseek Debug] 响应格式错误: choices不存在或为空")
+                    self._observe("single", "format_error", started, result.get("usage"))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"响应格式错误: choices不存在或为空，响应内容: {json.dumps(result, ensure_ascii=False)}")
+                    else:
+                        logger.warning("响应格式错误: choices不存在或为空")
                     return "分析服务返回格式错误"
             else:
-                print(f"[Deepseek Debug] 请求失败: HTTP {response.status_code}")
-                print(f"[Deepseek Debug] 错误响应: {response.text}")
+                self._observe("single", "http_error", started)
+                logger.warning(f"请求失败: HTTP {response.status_code} {response.text[:500]}")
                 return f"分析服务请求失败 (HTTP {response.status_code})"
+        except CircuitOpenError:
+            self._observe("single", "circuit_open")
+            logger.debug("熔断中，跳过请求")
+            return PENDING_ANALYSIS
         except requests.Timeout:
-            print("[Deepseek Debug] 请求超时")
+            self._observe("single", "timeout", started)
+            logger.warning("请求超时")
             return "分析服务请求超时"
         except requests.RequestException as e:
-            print(f"[Deepseek Debug] 网络请求错误: {str(e)}")
+            self._observe("single", "network_error", started)
+            logger.warning(f"网络请求错误: {str(e)}")
             return "分析服务网络错误"
         except Exception as e:
-            print(f"[Deepseek Debug] 未预期的错误: {str(e)}")
-            print(f"[Deepseek Debug] 错误类型: {e.__class__.__name__}")
+            self._observe("single", "error", started)
+            logger.exception(f"未预期的错误: {e.__class__.__name__}: {str(e)}")
             return "分析服务出现未知错误"
 
 
+    def _actionable_head(self, text: str) -> Optional[str]:
+        """返回已生成的"错误类型"和"可能原因"部分；解决方案部分尚未开始时返回None"""
+        match = _SOLUTION_SECTION.search(text)
+        if match is None or match.start() == 0:
+            return None
+        return text[:match.start()].strip()
+
+    def _read_stream(self, response: requests.Response,
+                     on_partial: Optional[Callable[[str], None]]) -> Tuple[str, Optional[dict]]:
+        """逐块读取SSE响应，返回 (完整分析结果, token用量)"""
+        response.encoding = "utf-8"
+        usage = None
+        chunks: List[str] = []
+        notified = on_partial is None
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue  # 空行和SSE注释（keep-alive）
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            event = json.loads(payload)
+            if not isinstance(event, dict):
+                raise ValueError(f"数据块不是对象: {payload[:100]}")
+            usage = event.get("usage") or usage  # 开启include_usage时最后一个数据块带用量
+            choices = event.get("choices") or []  # 带用量的最后一个数据块choices为空
+            if not isinstance(choices, list) or not all(isinstance(choice, dict) for choice in choices):
+                raise ValueError(f"choices格式错误: {payload[:100]}")
+            delta = choices[0].get("delta") if choices else {}
+            if not isinstance(delta, dict) or not isinstance(delta.get("content") or "", str):
+                raise ValueError(f"delta格式错误: {payload[:100]}")
+            delta = delta.get("content")
+            if not delta:
+                continue
+            chunks.append(delta)
+            if not notified:
+                head = self._actionable_head("".join(chunks))
+                if head:
+                    notified = True
+                    logger.debug(f"已生成原因分析 ({len(head)} chars)，提前通知")
+                    on_partial(head)
+        return "".join(chunks).strip(), usage
+
+    def analyze_error_stream(self, error_message: str, on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """流式分析单条错误，返回完整分析结果
+
+        逐块读取Deepseek的SSE响应，错误类型和可能原因生成完毕（开始输出解决方案）时，
+        用已生成的部分调用一次 on_partial，调用方可以据此提前发送告警。
+        响应无法解析（不是JSON或数据块结构不符合预期）时改用非流式请求重新分析。
+        """
+        started = time.monotonic()
+        try:
+            simplified_error = self._simplify_error_log(error_message)
+            data = {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": f"分析以下错误日志（回答限200字）：\n{simplified_error}"}
+                ],
+                "temperature": 0.3,
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            }
+            logger.debug(f"发送流式分析请求，简化后日志长度: {len(simplified_error)} chars")
+            response = self._post(data, timeout=30, stream=True)
+            with response:
+                if response.status_code != 200:
+                    self._observe("stream", "http_error", started)
+                    logger.warning(f"请求失败: HTTP {response.status_code}")
+                    return f"分析服务请求失败 (HTTP {response.status_code})"
+                try:
+                    analysis, usage = self._read_stream(response, on_partial)
+                except BaseException as e:
+                    self.breaker.record_failure(e.__class__.__name__)
+                    raise
+                # 读完响应体才算请求成功，耗时也按完整响应计算
+                self.breaker.record_success(time.monotonic() - started)
+            if not analysis:
+                self._observe("stream", "format_error", started, usage)
+                logger.warning("流式响应为空")
+                return "分析服务返回格式错误"
+            self._observe("stream", "ok", started, usage)
+            logger.debug(f"分析结果长度: {len(analysis)} chars")
+            return analysis
+        except CircuitOpenError:
+            self._observe("stream", "circuit_open")
+            logger.debug("熔断中，跳过请求")
+            return PENDING_ANALYSIS
+        except requests.Timeout:
+            self._observe("stream", "timeout", started)
+            logger.warning("请求超时")
+            return "分析服务请求超时"
+        except requests.RequestException as e:
+            self._observe("stream", "network_error", started)
+            logger.warning(f"网络请求错误: {str(e)}")
+            return "分析服务网络错误"
+        except ValueError as e:
+            self._observe("stream", "format_error", started)
+            logger.warning(f"流式响应解析失败，改用非流式请求: {str(e)}")
+            return self.analyze_error(error_message)
+
+    def _estimate_tokens(self, text: str) -> int:
+        """粗略估算token数：中文约1字1token，英文约4字符1token，这里按2字符1token保守估计"""
+        return len(text) // 2 + 1
+
+    def _pack_batches(self, simplified_errors: List[str]) -> List[List[int]]:
+        """按条数上限和token预算把错误分组，返回每组的下标列表"""
+        base_tokens = self._estimate_tokens(self.system_prompt) + 100
+        batches = []
+        current, current_tokens = [], base_tokens
+        for index, error in enumerate(simplified_errors):
+            tokens = self._estimate_tokens(error) + 10
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.batch_token_budget):
+                batches.append(current)
+                current, current_tokens = [], base_tokens
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _parse_batch_response(self, content: str, count: int) -> Dict[int, str]:
+        """解析批量分析结果，返回 {序号: 分析结果}，格式不正确时抛出ValueError"""
+        content = content.strip()
+        # 兼容模型用```json代码块包裹的情况
+        if content.startswith("```"):
+            content = content.strip("`")
+            if content.startswith("json"):
+                content = content[4:]
+        parsed = json.loads(content)
+        items = parsed.get("results") if isinstance(parsed, dict) else parsed
+        if not isinstance(items, list):
+            raise ValueError("results字段不是数组")
+        answers = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            analysis = item.get("analysis")
+            if 1 <= index <= count and isinstance(analysis, str) and analysis.strip():
+                answers[index] = analysis.strip()
+        return answers
+
+    def _analyze_batch_request(self, simplified_errors: List[str]) -> Optional[Dict[int, str]]:
+        """发送一次批量分析请求，返回解析后的结果；请求成功但无法解析时返回None"""
+        numbered = "\n".join(f"[{i}] {error}" for i, error in enumerate(simplified_errors, 1))
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {
+                    "role": "user",
+                    "content": (
+                        f"下面有{len(simplified_errors)}条相互独立的错误日志，请逐条分析（每条回答限200字）。"
+                        "以json格式返回：{\"results\": [{\"id\": 序号, \"analysis\": \"分析内容\"}]}\n"
+                        f"{numbered}"
+                    )
+                }
+            ],
+            "temperature": 0.3,
+            "max_tokens": min(8000, 400 * len(simplified_errors)),
+            "response_format": {"type": "json_object"},
+            "stream": False
+        }
+        logger.debug(f"发送批量分析请求: {len(simplified_errors)} 条")
+        started = time.monotonic()
+        try:
+            response = self._post(data, timeout=60, items=len(simplified_errors))
+        except CircuitOpenError:
+            self._observe("batch", "circuit_open")
+            raise
+        except requests.Timeout:
+            self._observe("batch", "timeout", started)
+            raise
+        except requests.RequestException:
+            self._observe("batch", "network_error", started)
+            raise
+        if response.status_code != 200:
+            self._observe("batch", "http_error", started)
+            logger.warning(f"批量请求失败: HTTP {response.status_code}")
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        try:
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+            answers = self._parse_batch_response(content, len(simplified_errors))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            self._observe("batch", "format_error", started)
+            logger.warning(f"批量分析结果解析失败: {str(e)}")
+            return None
+        self._observe("batch", "ok", started, result.get("usage"))
+        return answers
+
+    def analyze_errors_batch(self, error_messages: List[str]) -> List[str]:
+        """批量分析多条错误，结果顺序与输入一致
+
+        多条错误按token预算打包成一次请求；某条结果解析不到时单独调用analyze_error补齐。
+        """
+        if len(error_messages) <= 1 or self.batch_size <= 1:
+            return [self.analyze_error(message) for message in error_messages]
+
+        simplified = [self._simplify_error_log(message) for message in error_messages]
+        results: List[Optional[str]] = [None] * len(error_messages)
+        for indices in self._pack_batches(simplified):
+            if len(indices) == 1:
+                results[indices[0]] = self.analyze_error(error_messages[indices[0]])
+                continue
+            try:
+                answers = self._analyze_batch_request([simplified[i] for i in indices])
+            except CircuitOpenError:
+                logger.debug("熔断中，跳过批量请求")
+                for i in indices:
+                    results[i] = PENDING_ANALYSIS
+                continue
+            except requests.Timeout:
+                logger.warning("批量请求超时")
+                for i in indices:
+                    results[i] = "分析服务请求超时"
+                continue
+            except requests.HTTPError as e:
+                for i in indices:
+                    results[i] = f"分析服务请求失败 (HTTP {e.response.status_code})"
+                continue
+            except requests.RequestException as e:
+                logger.warning(f"批量请求网络错误: {str(e)}")
+                for i in indices:
+                    results[i] = "分析服务网络错误"
+                continue
+
+            answers = answers or {}
+            for position, i in enumerate(indices, 1):
+                if position in answers:
+                    results[i] = answers[position]
+                else:
+                    # 解析失败或缺少该条结果，退回单条分析
+                    results[i] = self.analyze_error(error_messages[i])
+        return results
+
 class WeChatService:
-    def __init__(self):
+    def __init__(self, dedup_store: Optional[DedupStore] = None):
         self.webhook_url = os.getenv("WECHAT_WEBHOOK_URL")
         self.max_content_length = 4000  # 留一些余量，避免达到4096的限制
-        self.message_cache = {}  # 用于存储最近发送的消息
-        self.cache_expire_minutes = 30  # 缓存过期时间（分钟）
+        # 最近发送的消息，按 DEDUP_STORE 保存在数据库、SQLite文件或进程内存中
+        self.dedup_store = dedup_store or create_dedup_store()
+        # 所有消息发送前都要经过限流，不超过机器人每分钟的发送配额（默认在数据库中由各进程共享）
+        self.rate_limiter = create_rate_limiter()
+        self.session = create_session(int(os.getenv("WECHAT_POOL_SIZE", "4")))
+        self.retry_policy = RetryPolicy()
+        # ALERT_WINDOW_SECONDS 为0时每条新错误立即发送，否则按应用汇总后定期发送
+        window_seconds = float(os.getenv("ALERT_WINDOW_SECONDS", "60"))
+        self.aggregator = None
+        if window_seconds > 0:
+            self.aggregator = AlertAggregator(self._send_markdown, self._truncate_text, window_seconds,
+                                              self.max_content_length)
 
     def _truncate_text(self, text: str, max_length: int) -> str:
         """截断文本，确保不超过最大长度，并添加省略号"""
@@ -273,93 +776,85 @@ class WeChatService:
 
     def _generate_message_key(self, error_info: str) -> str:
         """生成消息的唯一标识，用于判断重复"""
-        # 提取错误信息中的关键部分
-        # 1. 移除时间戳、IP地址等变化的信息
-        cleaned_error = re.sub(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}', '', error_info)
-        cleaned_error = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '', cleaned_error)
-        
-        # 2. 移除行号等变化的信息
-        cleaned_error = re.sub(r'line \d+', '', cleaned_error)
-        cleaned_error = re.sub(r':\d+:\d+', '', cleaned_error)
-        
-        # 3. 提取错误类型和关键信息
-        error_type = ''
-        key_message = ''
-        
-        # 尝试匹配常见的错误模式
-        error_match = re.search(r'(Error|Exception|Failed):[^\n]+', cleaned_error)
-        if error_match:
-            error_type = error_match.group(0)
-        
-        # 尝试提取引号中的关键信息
-        message_match = re.search(r'"([^"]+)"', cleaned_error)
-        if message_match:
-            key_message = message_match.group(1)
-        
-        # 组合特征值
-        key_parts = []
-        if error_type:
-            key_parts.append(error_type)
-        if key_message:
-            key_parts.append(key_message)
-        if not key_parts:  # 如果没有提取到特征，使用清理后的错误信息前100个字符
-            key_parts.append(cleaned_error[:100])
-        
-        # 使用MD5生成最终的特征值
-        key = '|'.join(key_parts)
-        return hashlib.md5(key.encode()).hexdigest()
+        return generate_error_fingerprint(error_info)
+
+    def _post(self, message: dict) -> requests.Response:
+        """发送Webhook请求，每次发送（包括429后的重试）前占用一次发送名额，名额用完时等待"""
+        started = time.monotonic()
+        try:
+            return post_with_retry(self.session, self.webhook_url, self.retry_policy,
+                                   before_attempt=self.rate_limiter.acquire, json=message, timeout=10)
+        finally:
+            metrics.WEBHOOK_REQUEST_SECONDS.observe(time.monotonic() - started)
+
+    def _sent(self, response: requests.Response) -> bool:
+        """检查发送结果并计数，企业微信在HTTP 200的响应体中用errcode表示失败"""
+        ok = response.status_code == 200 and response.json().get("errcode") == 0
+        metrics.WEBHOOK_REQUESTS_TOTAL.inc(status="ok" if ok else "error")
+        if not ok:
+            logger.warning(f"消息发送失败: HTTP {response.status_code} {response.text[:500]}")
+        return ok
+
+    def _send_markdown(self, content: str) -> bool:
+        try:
+            return self._sent(self._post({"msgtype": "markdown", "markdown": {"content": content}}))
+        except requests.RequestException as e:
+            metrics.WEBHOOK_REQUESTS_TOTAL.inc(status="error")
+            logger.warning(f"网络请求错误: {str(e)}")
+        return False
+
+    def flush_alerts(self):
+        """立即发送汇总中尚未发送的告警，服务停止时调用"""
+        if self.aggregator is not None:
+            self.aggregator.close()
+
+    def _record_message(self, error_info: str, message_key: Optional[str] = None, count: int = 1) -> DedupEntry:
+        """记录 count 次出现并返回去重状态，is_new 为False表示重复消息"""
+        message_key = message_key or self._generate_message_key(error_info)
+        try:
+            entry = self.dedup_store.record(message_key, count)
+        except Exception as e:
+            # 去重存储不可用时按新消息处理，宁可重复告警也不漏发
+            logger.warning(f"查询去重记录失败: {str(e)}")
+            now = datetime.now(pytz.timezone('Asia/Shanghai')).replace(tzinfo=None)
+            return DedupEntry(now, now, count, count)
+
+        if not entry.is_new:
+            metrics.ALERT_DEDUP_TOTAL.inc(result="duplicate")
+            if logger.isEnabledFor(logging.DEBUG):
+                current_time = datetime.now(pytz.timezone('Asia/Shanghai')).replace(tzinfo=None)
+                time_diff = (current_time - entry.last_seen).total_seconds() / 60  # 转换为分钟
+                logger.debug(f"重复消息 {message_key}: 首次 {entry.first_seen.strftime('%Y-%m-%d %H:%M:%S')}，"
+                             f"距上次 {time_diff:.1f}分钟，累计 {entry.count} 次")
+        else:
+            metrics.ALERT_DEDUP_TOTAL.inc(result="new")
+            logger.debug(f"新消息特征值: {message_key}")
+        return entry
 
     def _is_duplicate_message(self, error_info: str) -> bool:
         """检查是否是重复消息"""
-        current_time = datetime.now(pytz.timezone('Asia/Shanghai'))
-        message_key = self._generate_message_key(error_info)
-        
-        # 清理过期的缓存
-        expired_keys = []
-        for key, (timestamp, count) in self.message_cache.items():
-            if (current_time - timestamp).total_seconds() > self.cache_expire_minutes * 60:
-                print(f"[WeChat Debug] 清理过期消息缓存: {key} (发送次数: {count})")
-                expired_keys.append(key)
-        for key in expired_keys:
-            del self.message_cache[key]
-        
-        # 检查是否存在相同的消息
-        if message_key in self.message_cache:
-            last_time, count = self.message_cache[message_key]
-            time_diff = (current_time - last_time).total_seconds() / 60  # 转换为分钟
-            
-            # 更新计数和时间戳
-            self.message_cache[message_key] = (current_time, count + 1)
-            
-            print(f"[WeChat Debug] 检测到重复消息:")
-            print(f"[WeChat Debug] - 消息特征值: {message_key}")
-            print(f"[WeChat Debug] - 首次发送时间: {last_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"[WeChat Debug] - 距上次发送: {time_diff:.1f}分钟")
-            print(f"[WeChat Debug] - 累计次数: {count + 1}")
-            return True
-        
-        # 新消息，添加到缓存
-        print(f"[WeChat Debug] 新消息特征值: {message_key}")
-        self.message_cache[message_key] = (current_time, 1)
-        return False
+        return not self._record_message(error_info).is_new
 
-    def send_alert(self, error_info: dict, analysis: str):
+    def send_alert(self, error_info: dict, analysis: str, immediate: bool = False):
+        """发送告警；immediate 为True时新错误不进入汇总周期，直接发送（流式模式的提前告警）"""
         try:
-            print("[WeChat Debug] 准备发送企业微信通知")
-            print(f"[WeChat Debug] Webhook URL: {self.webhook_url}")
-            print(f"[WeChat Debug] Error info: {json.dumps(error_info, ensure_ascii=False)}")
-            print(f"[WeChat Debug] Analysis length: {len(analysis)} chars")
-            
-            # 检查是否是重复消息
-            if self._is_duplicate_message(error_info["Exception"]):
+            # 检查是否是重复消息（检查与计数在去重存储中原子完成）
+            message_key = error_info.get("fingerprint") or self._generate_message_key(error_info["Exception"])
+            # ES预聚合时一条记录代表一组错误，按该组的出现次数计数
+            occurrences = error_info.get("occurrences") or 1
+            entry = self._record_message(error_info["Exception"], message_key, occurrences)
+            if self.aggregator is not None and not (immediate and entry.is_new):
+                # 汇总模式：放入当前周期，由汇总线程按应用合并发送
+                self.aggregator.add(error_info, analysis, message_key, entry)
+                return True
+            if not entry.is_new:
                 # 如果是重复消息，检查是否需要发送汇总
                 current_time = datetime.now(pytz.timezone('Asia/Shanghai'))
-                message_key = self._generate_message_key(error_info["Exception"])
-                last_time, count = self.message_cache[message_key]
-                
+                count, first_time = entry.count, entry.first_seen
+
                 # 每隔10次或者每隔1小时发送一次汇总
-                time_diff = (current_time - last_time).total_seconds() / 3600  # 转换为小时
-                if count % 10 == 0 or time_diff >= 1:
+                time_diff = (current_time.replace(tzinfo=None) - first_time).total_seconds() / 3600  # 转换为小时
+                if entry.crossed(10) or time_diff >= 1:
                     # 构建汇总消息
                     content = f"""### 系统异常告警（汇总）
 > 发生时间：{current_time.strftime('%Y-%m-%d %H:%M:%S')}
@@ -373,28 +868,21 @@ class WeChatService:
 {self._truncate_text(analysis, 1000)}
 
 **统计信息**：
-- 首次出现：{last_time.strftime('%Y-%m-%d %H:%M:%S')}
+- 首次出现：{first_time.strftime('%Y-%m-%d %H:%M:%S')}
 - 累计次数：{count}次
-- 平均频率：{(count / time_diff):.1f}次/小时"""
+- 平均频率：{(count / max(time_diff, 1 / 60)):.1f}次/小时"""
 
                     message = {
                         "msgtype": "markdown",
                         "markdown": {"content": content}
                     }
                     
-                    print("[WeChat Debug] 发送汇总消息...")
-                    print(f"[WeChat Debug] 汇总周期: {f'{time_diff:.1f}小时' if time_diff >= 1 else f'{count}次'}")
-                    print(f"[WeChat Debug] 消息总长度: {len(content)} chars")
-                    
-                    response = requests.post(self.webhook_url, json=message, timeout=10)
-                    if response.status_code == 200:
-                        result = response.json()
-                        if result.get("errcode") == 0:
-                            print("[WeChat Debug] 汇总消息发送成功")
-                            return True
-                    print(f"[WeChat Debug] 汇总消息发送失败: {response.text}")
-                    
-                print("[WeChat Debug] 跳过发送重复消息")
+                    logger.info(f"发送汇总消息: {error_info.get('application_id')} 累计 {count} 次，"
+                                f"消息总长度: {len(content)} chars")
+                    if self._sent(self._post(message)):
+                        return True
+
+                logger.debug("跳过发送重复消息")
                 return True
             
             # 计算各部分内容的最大长度
@@ -408,10 +896,13 @@ class WeChatService:
             
             # 构建消息内容
             current_time = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%d %H:%M:%S')
+            occurrence_line = ""
+            if occurrences > 1:
+                occurrence_line = f"\n> 出现次数：{occurrences}次（首次 {error_info.get('first_seen', '-')}）"
             content = f"""### 系统异常告警
 > 发生时间：{current_time}
 > 应用ID：<font color=\"warning\">{error_info.get("application_id", "未知应用")}</font>
-> 请求路径：{error_info.get("request_path", "未知路径")}
+> 请求路径：{error_info.get("request_path", "未知路径")}{occurrence_line}
 
 **开发环境业务日志异常信息**：
 {truncated_error}
@@ -424,39 +915,18 @@ class WeChatService:
                 "markdown": {"content": content}
             }
             
-            # 打印消息详情
-            print("[WeChat Debug] 消息内容预览:")
-            print(f"[WeChat Debug] 发送时间: {current_time}")
-            print(f"[WeChat Debug] 截断后错误信息长度: {len(truncated_error)} chars")
-            print(f"[WeChat Debug] 截断后分析结果长度: {len(truncated_analysis)} chars")
-            print(f"[WeChat Debug] 消息总长度: {len(content)} chars")
-            
-            # 发送请求
-            print("[WeChat Debug] 发送消息...")
-            response = requests.post(self.webhook_url, json=message, timeout=10)
-            print(f"[WeChat Debug] 发送状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                print("[WeChat Debug] 响应内容:", json.dumps(result, ensure_ascii=False))
-                if result.get("errcode") == 0:
-                    print("[WeChat Debug] 消息发送成功")
-                    return True
-                else:
-                    print(f"[WeChat Debug] 发送失败: {result.get('errmsg', '未知错误')}")
-                    return False
-            else:
-                print(f"[WeChat Debug] 请求失败: HTTP {response.status_code}")
-                print(f"[WeChat Debug] 错误响应: {response.text}")
-                return False
-                
+            logger.info(f"发送告警: {error_info.get('application_id')} 消息总长度 {len(content)} chars"
+                        f"（错误信息 {len(truncated_error)}，分析结果 {len(truncated_analysis)}）")
+            return self._sent(self._post(message))
+
         except requests.Timeout:
-            print("[WeChat Debug] 请求超时")
+            metrics.WEBHOOK_REQUESTS_TOTAL.inc(status="error")
+            logger.warning("请求超时")
             return False
         except requests.RequestException as e:
-            print(f"[WeChat Debug] 网络请求错误: {str(e)}")
+            metrics.WEBHOOK_REQUESTS_TOTAL.inc(status="error")
+            logger.warning(f"网络请求错误: {str(e)}")
             return False
         except Exception as e:
-            print(f"[WeChat Debug] 未预期的错误: {str(e)}")
-            print(f"[WeChat Debug] 错误类型: {e.__class__.__name__}")
+            logger.exception(f"未预期的错误: {e.__class__.__name__}: {str(e)}")
             return False
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import re
+from typing import List, NamedTuple, Optional
+
+from . import config  # noqa: F401  导入config时加载.env
+
+
+class ExceptionInfo(NamedTuple):
+    type: str  # 异常类型，如 System.TypeLoadException
+    message: str
+
+
+class Frame(NamedTuple):
+    function: str  # 去掉参数和编译器生成后缀的方法名
+    file: str
+    line: Optional[int]
+    in_app: bool  # 是否为业务代码（非框架、非第三方库）
+
+
+class ParsedTrace(NamedTuple):
+    exceptions: List[ExceptionInfo]  # 异常链，按日志中出现的顺序
+    frames: List[Frame]  # 堆栈帧，按日志中出现的顺序
+
+
+# ESService 组合错误信息时加在各字段前的标签
+_SECTION_PREFIX = re.compile(r'^(?:异常|消息|堆栈): ?')
+
+# 异常头："类型: 消息"，类型为带命名空间的类名或以 Exception/Error 等结尾的类名
+_EXCEPTION_HEADER = re.compile(
+    r'^(?P<type>(?:[A-Za-z_$][\w$]*[.+])+[A-Za-z_$][\w$`]*'
+    r'|(?:[A-Za-z_$][\w$]*)?(?:Exception|Error|Throwable|Fault))'
+    r'(?::\s?(?P<message>.*))?$'
+)
+# .NET 内部异常 " ---> 类型: 消息"，可能与外层异常在同一行
+_INNER_MARKER = ' ---> '
+
+# Java："at pkg.Class.method(Class.java:12)"；.NET："at Ns.Type.Method(args) in /src/File.cs:line 42"；
+# Node："at fn (/path/file.js:12:5)"
+_CALL_FRAME = re.compile(
+    r'^at (?:async )?(?P<function>[^(\s]+) ?\((?P<args>[^)]*)\)'
+    r'(?: in (?P<file>.+?):line (?P<line>\d+))?'
+)
+# 括号中的位置信息
+_JAVA_LOCATION = re.compile(r'^(?P<file>[\w$.-]+\.(?:java|kt|scala|groovy))(?::(?P<line>\d+))?$')
+_NODE_LOCATION = re.compile(r'^(?P<file>.+):(?P<line>\d+):\d+$')
+# Node 匿名函数："at /path/file.js:12:5"
+_NODE_FRAME = re.compile(r'^at (?:async )?(?P<file>[^()\s]+):(?P<line>\d+):\d+$')
+
+# 编译器生成的名称：.NET async 状态机、Java 动态代理和lambda序号
+_GENERATED = [
+    (re.compile(r'[.+]<(\w+)>d__\d+\.MoveNext$'), r'.\1'),
+    (re.compile(r'\$\$\w+?\$\$[0-9a-f]+'), ''),
+    (re.compile(r'(lambda\$\w+?)\$\d+'), r'\1'),
+]
+
+# 未配置 STACK_APP_PREFIXES 时，以下前缀的堆栈帧视为框架或第三方库
+_LIBRARY_PREFIXES = (
+    "System.", "Microsoft.", "Newtonsoft.", "Quartz.", "Dapper.", "Pomelo.", "MySql.", "Npgsql.",
+    "java.", "javax.", "jdk.", "sun.", "com.sun.", "kotlin.", "scala.",
+    "org.springframework.", "org.apache.", "org.hibernate.", "com.zaxxer.", "io.netty.", "reactor.",
+)
+_LIBRARY_PATHS = ("node_modules/", "node:", "internal/")
+_SCRIPT_SUFFIXES = (".js", ".mjs", ".cjs", ".ts")
+
+# 没有堆栈帧时，异常消息中的易变内容：引号内容、GUID、十六进制串和数字
+_MESSAGE_VOLATILE = re.compile(
+    r"'[^']*'|\"[^\"]*\""
+    r"|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|\b0x[0-9a-fA-F]+\b|\d+"
+)
+
+
+def _app_prefixes() -> List[str]:
+    return [prefix.strip() for prefix in os.getenv("STACK_APP_PREFIXES", "").split(",") if prefix.strip()]
+
+
+APP_PREFIXES = _app_prefixes()
+FINGERPRINT_FRAMES = int(os.getenv("FINGERPRINT_FRAMES", "3"))
+
+
+def _is_in_app(function: str, file: str) -> bool:
+    if any(marker in file for marker in _LIBRARY_PATHS):
+        return False
+    if APP_PREFIXES:
+        return function.startswith(tuple(APP_PREFIXES)) or file.startswith(tuple(APP_PREFIXES))
+    return not function.startswith(_LIBRARY_PREFIXES)
+
+
+def _clean_function(function: str) -> str:
+    if '<' not in function and '$' not in function:
+        return function
+    for pattern, replacement in _GENERATED:
+        function = pattern.sub(replacement, function)
+    return function
+
+
+def _parse_frame(line: str) -> Optional[Frame]:
+    match = _CALL_FRAME.match(line)
+    if match is None:
+        match = _NODE_FRAME.match(line)
+        if match is None:
+            return None
+        file = match.group("file")
+        return Frame("<anonymous>", file, int(match.group("line")), _is_in_app("", file))
+
+    function = _clean_function(match.group("function"))
+    file, line_no = match.group("file") or "", match.group("line")
+    args = match.group("args")
+    if args and args[-1].isdigit():
+        location = _JAVA_LOCATION.match(args) or _NODE_LOCATION.match(args)
+        if location:
+            file, line_no = location.group("file"), location.group("line")
+    return Frame(function, file, int(line_no) if line_no else None, _is_in_app(function, file))
+
+
+def _parse_header(text: str) -> Optional[ExceptionInfo]:
+    match = _EXCEPTION_HEADER.match(text.strip())
+    if match is None:
+        return None
+    return ExceptionInfo(match.group("type"), (match.group("message") or "").strip())
+
+
+def parse_stack_trace(text: str, app_frame_limit: Optional[int] = None) -> ParsedTrace:
+    """将错误信息拆分为异常链和堆栈帧
+
+    支持 .NET（" ---> " 内部异常、"--- End of inner exception stack trace ---"）、
+    Java（"Caused by:"、"... N more"）和 Node 的堆栈格式。
+    指定 app_frame_limit 时，取到这么多业务代码堆栈帧后不再解析后续的堆栈帧，异常链仍完整解析。
+    """
+    exceptions: List[ExceptionInfo] = []
+    frames: List[Frame] = []
+    app_frames = 0
+
+    def add_exception(info: Optional[ExceptionInfo]):
+        # 同一异常可能在 Exception 和 StackTrace 字段中各出现一次
+        if info is not None and (not exceptions or exceptions[-1].type != info.type):
+            exceptions.append(info)
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if line.startswith(("异常", "消息", "堆栈")):
+            # 堆栈字段通常以缩进开头，去掉标签后还需再去一次空白
+            line = _SECTION_PREFIX.sub('', line).lstrip()
+        if not line or line.startswith(("---", "...")):
+            continue  # 内部异常结束标记、"... N more" 等
+        if line.startswith("at "):
+            if app_frame_limit is not None and app_frames >= app_frame_limit:
+                continue
+            frame = _parse_frame(line)
+            if frame is not None:
+                frames.append(frame)
+                app_frames += frame.in_app
+            continue
+        if line.startswith("Caused by: "):
+            line = line[len("Caused by: "):]
+        elif line.startswith("--->"):
+            line = line[len("--->"):]
+        for part in line.split(_INNER_MARKER):
+            add_exception(_parse_header(part))
+
+    return ParsedTrace(exceptions, frames)
+
+
+def trace_fingerprint(trace: ParsedTrace) -> Optional[str]:
+    """按异常类型链和最靠前的业务代码堆栈帧生成特征值
+
+    行号和异常消息中的ID不参与计算，同一调用点抛出的同类异常会归为一组。
+    没有解析出异常类型时返回None，由调用方回退到基于文本的特征值。
+    """
+    if not trace.exceptions:
+        return None
+    key_parts = [info.type for info in trace.exceptions]
+    in_app = []
+    for frame in trace.frames:
+        if frame.in_app:
+            # Node 的函数名不带模块，加上文件名区分
+            name = frame.function
+            if frame.file.endswith(_SCRIPT_SUFFIXES):
+                name = f"{frame.file.rsplit('/', 1)[-1]}:{name}"
+            if name not in in_app:
+                in_app.append(name)
+                if len(in_app) == FINGERPRINT_FRAMES:
+                    break
+    if in_app:
+        key_parts.extend(in_app)
+    elif trace.frames:
+        # 全部是框架堆栈时，使用最顶层的堆栈帧
+        key_parts.extend(frame.function for frame in trace.frames[:FINGERPRINT_FRAMES])
+    else:
+        # 没有堆栈帧时，使用去掉易变内容后的最内层异常消息
+        key_parts.append(_MESSAGE_VOLATILE.sub('?', trace.exceptions[-1].message)[:200])
+    return hashlib.md5('|'.join(key_parts).encode()).hexdigest()
@@ -86,12 +86,22 @@ $(document).ready(function() {
                     const actionCell = $('<td>');
                     const detailButton = $('<button>').addClass('view-details-btn').text('详情');
                     detailButton.click(function() {
-                        showErrorModal(
-                            `错误类型和关键信息：\n${log.error_message}\n\n` +
-                            `分析结果：\n${log.analysis_result}\n\n` +
-                            `时间：${formatDateTime(log.log_time)}\n` +
-                            `ID：${log.id}`
-                        );
+                        const showDetail = function(detail) {
+                            showErrorModal(
+                                `错误类型和关键信息：\n${detail.error_message}\n\n` +
+                                `分析结果：\n${detail.analysis_result}\n\n` +
+                                `时间：${formatDateTime(detail.log_time)}\n` +
+                                `ID：${detail.id}`
+                            );
+                        };
+                        // 列表中较长的内容只有预览，查看详情时再加载全文
+                        if (log.truncated) {
+                            $.getJSON(`/logs/${log.id}`, showDetail).fail(function() {
+                                showDetail(log);
+                            });
+                        } else {
+                            showDetail(log);
+                        }
                     });
                     actionCell.append(detailButton);
                     row.append(actionCell);
@@ -140,6 +150,8 @@ $(document).ready(function() {
                         loadLogs(1);
                         updateTaskStatus('', '当前无任务运行');
                     }, 3000);
+                } else if (response.status === 'running') {
+                    updateTaskStatus('running', '已有分析任务正在运行');
                 } else {
                     updateTaskStatus('error', '分析任务启动失败');
                 }
@@ -0,0 +1,166 @@
+"""持久化工作队列
+
+队列模式（PIPELINE_MODE=queue）下，API进程的定时任务只从ES增量读取错误日志并写入 work_items 表，
+分析、告警和入库由一个或多个 worker 进程（python -m app.worker）完成，吞吐随 worker 数量线性扩展。
+
+worker 用 SELECT ... FOR UPDATE SKIP LOCKED 领取一批条目，领取时把 available_at 顺延租约时长，
+多个 worker 之间不会领取到同一条目；worker 崩溃时租约到期后条目自动被其他 worker 重新领取。
+条目对应的日志入库后删除（确认），超过最大领取次数的条目丢弃并记录日志。
+"""
+import json
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .database import SessionLocal
+from .models import ErrorLog, WorkItem, get_naive_shanghai_time
+from .pipeline import CHECKPOINT_NAME, load_checkpoint, save_checkpoint
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(db: Session, entries: List[Dict[str, Any]]) -> int:
+    """把错误日志写入队列，已在队列中的（按es_id）忽略；不提交"""
+    now = get_naive_shanghai_time()
+    rows = [
+        {"es_id": entry["es_id"], "payload": json.dumps(entry, ensure_ascii=False), "attempts": 0,
+         "available_at": now, "created_at": now}
+        for entry in entries if entry.get("es_id")
+    ]
+    if not rows:
+        return 0
+    stmt = insert(WorkItem).values(rows)\
+        .prefix_with("IGNORE", dialect="mysql")\
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    db.execute(stmt)
+    metrics.WORK_ITEMS_ENQUEUED_TOTAL.inc(len(rows))
+    return len(rows)
+
+
+def enqueue_from_es(db: Session, es_service, checkpoint_name: str = CHECKPOINT_NAME,
+                    batch_size: int = 500) -> int:
+    """从检查点开始增量读取ES并写入队列，返回读取的条数
+
+    每批提交一次，全部写入后再推进检查点；中途失败时下次从原检查点重新读取，重复的条目按es_id忽略。
+    """
+    checkpoint = load_checkpoint(db, checkpoint_name)
+    progress: dict = {}
+    batch: List[Dict[str, Any]] = []
+    total = 0
+    try:
+        for entry in es_service.iter_errors_since(checkpoint, progress=progress):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                enqueue(db, batch)
+                db.commit()
+                total += len(batch)
+                batch = []
+        if batch:
+            enqueue(db, batch)
+            total += len(batch)
+        save_checkpoint(db, checkpoint_name, progress)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if total:
+        logger.info(f"写入工作队列 {total} 条错误日志")
+    return total
+
+
+class WorkQueueSource:
+    """从工作队列领取错误日志，接口与 ESService.iter_errors_since 一致，供 AnalysisPipeline 读取
+
+    worker 先调用 lease_batch 领取最多 batch_size 条，流水线运行时逐条读出；运行结束后调用 ack
+    删除已入库的条目，未入库的条目（处理失败）保留，租约到期后重新领取。
+    """
+
+    def __init__(self, worker_id: str, batch_size: Optional[int] = None, lease_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None, session_factory=SessionLocal):
+        self.worker_id = worker_id
+        self.batch_size = batch_size or int(os.getenv("WORKER_BATCH_SIZE", "100"))
+        self.lease = timedelta(seconds=lease_seconds or float(os.getenv("WORK_LEASE_SECONDS", "600")))
+        self.max_attempts = max_attempts or int(os.getenv("WORK_MAX_ATTEMPTS", "5"))
+        self.session_factory = session_factory
+        self.leased: Dict[str, int] = {}  # 本批领取的 es_id -> 条目id
+        self._entries: List[Dict[str, Any]] = []
+
+    def lease_batch(self) -> List[Dict[str, Any]]:
+        """领取一批可用的条目并顺延租约，其他worker已锁定的行直接跳过"""
+        self.leased = {}
+        db = self.session_factory()
+        try:
+            now = get_naive_shanghai_time()
+            items = db.query(WorkItem)\
+                .filter(WorkItem.available_at <= now)\
+                .order_by(WorkItem.available_at, WorkItem.id)\
+                .limit(self.batch_size)\
+                .with_for_update(skip_locked=True)\
+                .all()
+            entries = []
+            for item in items:
+                if item.attempts >= self.max_attempts:
+                    logger.warning(f"队列条目 {item.es_id} 已领取 {item.attempts} 次仍未完成，丢弃")
+                    metrics.WORK_ITEMS_TOTAL.inc(result="dead")
+                    db.delete(item)
+                    continue
+                item.attempts += 1
+                item.available_at = now + self.lease
+                item.lease_owner = self.worker_id
+                entries.append(json.loads(item.payload))
+                self.leased[item.es_id] = item.id
+            db.commit()
+            metrics.WORK_ITEMS_TOTAL.inc(len(entries), result="leased")
+            self._entries = entries
+            return entries
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def iter_errors_since(self, checkpoint: dict = None, minutes=None, progress: dict = None):
+        """逐条产出已领取的条目；队列不使用检查点"""
+        entries, self._entries = self._entries, []
+        yield from entries
+
+    def ack(self) -> int:
+        """删除本批中已入库的条目（包括其他worker或之前的运行已入库的），返回删除的条数"""
+        if not self.leased:
+            return 0
+        db = self.session_factory()
+        try:
+            es_ids = list(self.leased)
+            done = set()
+            for i in range(0, len(es_ids), 500):
+                done.update(
+                    row[0] for row in db.query(ErrorLog.es_id).filter(ErrorLog.es_id.in_(es_ids[i:i + 500])).all()
+                )
+            if done:
+                db.query(WorkItem)\
+                    .filter(WorkItem.id.in_([self.leased[es_id] for es_id in done]))\
+                    .delete(synchronize_session=False)
+            db.commit()
+            metrics.WORK_ITEMS_TOTAL.inc(len(done), result="acked")
+            if len(done) < len(es_ids):
+                logger.warning(f"{len(es_ids) - len(done)} 条队列条目未完成，租约到期后重新处理")
+            return len(done)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            self.leased = {}
+
+
+def queue_depth(db: Session) -> Dict[str, int]:
+    """队列中可领取的条目数和已被领取（租约未到期）的条目数"""
+    now = get_naive_shanghai_time()
+    total = db.query(WorkItem).count()
+    available = db.query(WorkItem).filter(WorkItem.available_at <= now).count()
+    return {"available": available, "leased": total - available}
@@ -0,0 +1,122 @@
+"""队列模式的分析worker
+
+从 work_items 表领取错误日志，经过与定时任务相同的分析流水线（分析缓存、LLM分析、告警、入库）处理。
+可以在多台机器上启动任意个worker，告警去重（DEDUP_STORE=database）和分析缓存通过数据库共享。
+
+用法（在项目根目录执行，API进程需设置 PIPELINE_MODE=queue）：
+    python -m app.worker
+    python -m app.worker --metrics-port 9101   # 同时在该端口导出Prometheus指标
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import metrics
+from .cache import AnalysisCache
+from .config import configure_logging
+from .database import SessionLocal
+from .migrate import migrate
+from .pipeline import AnalysisPipeline
+from .services import DeepseekService, WeChatService
+from .work_queue import WorkQueueSource
+
+logger = logging.getLogger(__name__)
+
+
+def _serve_metrics(port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = metrics.REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+async def run_worker(worker_id: str, poll_seconds: float, idle_run_seconds: float, stop: asyncio.Event):
+    source = WorkQueueSource(worker_id)
+    wechat_service = WeChatService()
+    pipeline = AnalysisPipeline(source, DeepseekService(), wechat_service, AnalysisCache(), checkpoint_name=None)
+    db = SessionLocal()
+    logger.info(f"worker {worker_id} 已启动，每批最多 {source.batch_size} 条")
+    last_run = time.monotonic()
+    try:
+        while not stop.is_set():
+            try:
+                entries = await asyncio.to_thread(source.lease_batch)
+            except Exception as e:
+                logger.warning(f"领取队列条目失败: {str(e)}")
+                entries = []
+            # 队列为空时也定期运行一次，处理重新分析队列和过期缓存
+            if entries or time.monotonic() - last_run >= idle_run_seconds:
+                last_run = time.monotonic()
+                try:
+                    processed = await pipeline.run(db)
+                    if processed:
+                        logger.info(f"处理 {processed} 条错误日志")
+                except Exception as e:
+                    logger.exception(f"处理队列条目失败: {str(e)}")
+                try:
+                    await asyncio.to_thread(source.ack)
+                except Exception as e:
+                    # 未确认的条目租约到期后重新处理，已入库的记录会被跳过
+                    logger.warning(f"确认队列条目失败: {str(e)}")
+            if len(entries) < source.batch_size:
+                # 队列已取空，等待新的条目
+                try:
+                    await asyncio.wait_for(stop.wait(), poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        db.close()
+        await asyncio.to_thread(wechat_service.flush_alerts)
+        pipeline.executor.shutdown()
+        pipeline.db_executor.shutdown()
+        logger.info(f"worker {worker_id} 已停止")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从工作队列领取并分析错误日志")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}",
+                        help="worker标识，记录在领取的队列条目上")
+    parser.add_argument("--poll-seconds", type=float, default=float(os.getenv("WORKER_POLL_SECONDS", "2")),
+                        help="队列为空时的轮询间隔")
+    parser.add_argument("--idle-run-seconds", type=float, default=60,
+                        help="队列为空时每隔多久运行一次流水线，处理重新分析队列和过期缓存")
+    parser.add_argument("--metrics-port", type=int, help="在该端口导出Prometheus指标")
+    args = parser.parse_args()
+
+    configure_logging()
+    migrate()
+    if args.metrics_port:
+        _serve_metrics(args.metrics_port)
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # 收到停止信号后处理完当前一批再退出
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await run_worker(args.worker_id, args.poll_seconds, args.idle_run_seconds, stop)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
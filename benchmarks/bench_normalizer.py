@@ -0,0 +1,148 @@
+"""错误日志归一化的性能基准
+
+对比旧实现（多次re.findall简化日志 + 多次re.sub生成特征值）与 app.normalizer 的预编译、提前结束实现，
+语料为接近真实环境的 .NET / Java / Node 堆栈，长度从几百字节到几十KB。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_normalizer [--repeat 200]
+"""
+import argparse
+import hashlib
+import random
+import re
+import time
+
+from app.normalizer import _normalize_error
+
+
+def legacy_simplify(error_log: str) -> str:
+    error_log = error_log.replace('\n', ' ').replace('\r', ' ')
+    error_log = ' '.join(error_log.split())
+    patterns = [
+        r'Error: .*?(?=\s+at\s+|$)',
+        r'Exception: .*?(?=\s+at\s+|$)',
+        r'Failed to .*?(?=\s+at\s+|$)',
+        r'status code (\d+)',
+        r'at .*?:\d+:\d+',
+        r'Caused by: .*?(?=\s+at\s+|$)',
+        r'message: ".*?"',
+        r'reason: ".*?"'
+    ]
+    key_info = []
+    for pattern in patterns:
+        matches = re.findall(pattern, error_log)
+        if matches:
+            if pattern == patterns[0]:
+                key_info.extend(matches[:3])
+            else:
+                key_info.extend(matches[:1])
+    if not key_info:
+        quoted = re.findall(r'"([^"]+)"', error_log)
+        if quoted:
+            return ' | '.join(quoted[:3])
+        return error_log[:200] + ('...' if len(error_log) > 200 else '')
+    simplified_log = ' | '.join(key_info)
+    if len(simplified_log) > 500:
+        return simplified_log[:500] + '...'
+    return simplified_log
+
+
+def legacy_fingerprint(error_info: str) -> str:
+    cleaned_error = re.sub(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}', '', error_info)
+    cleaned_error = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '', cleaned_error)
+    cleaned_error = re.sub(r'line \d+', '', cleaned_error)
+    cleaned_error = re.sub(r':\d+:\d+', '', cleaned_error)
+    error_type = ''
+    key_message = ''
+    error_match = re.search(r'(Error|Exception|Failed):[^\n]+', cleaned_error)
+    if error_match:
+        error_type = error_match.group(0)
+    message_match = re.search(r'"([^"]+)"', cleaned_error)
+    if message_match:
+        key_message = message_match.group(1)
+    key_parts = []
+    if error_type:
+        key_parts.append(error_type)
+    if key_message:
+        key_parts.append(key_message)
+    if not key_parts:
+        key_parts.append(cleaned_error[:100])
+    return hashlib.md5('|'.join(key_parts).encode()).hexdigest()
+
+
+def dotnet_trace(depth: int, rng: random.Random) -> str:
+    frames = "\n".join(
+        f"   at Quartz.Impl.AdoJobStore.JobStoreSupport.Method{rng.randint(0, 99)}"
+        f"(ConnectionAndTransactionHolder conn, JobKey jobKey, CancellationToken cancellationToken)"
+        for _ in range(depth)
+    )
+    return (
+        "异常: Quartz.JobPersistenceException: Couldn't store trigger 'DEFAULT.716_0000000000001' for "
+        "'default.716_12' job: Couldn't retrieve job because a required type was not found\n"
+        " ---> System.TypeLoadException: Could not load type 'jobscheduler.JobModels.HttpServiceJob, jobscheduler'\n"
+        f"{frames}\n   --- End of inner exception stack trace ---\n{frames}\n"
+        "消息: Error handling misfires: Couldn't store trigger 'DEFAULT.716_0000000000001' at 2025-03-16 10:08:04"
+    )
+
+
+def java_trace(depth: int, rng: random.Random) -> str:
+    frames = "\n".join(
+        f"\tat com.example.order.service.OrderService.method{rng.randint(0, 99)}(OrderService.java:{rng.randint(1, 900)})"
+        for _ in range(depth)
+    )
+    return (
+        "异常: org.springframework.dao.DataAccessResourceFailureException: Unable to acquire JDBC Connection\n"
+        f"{frames}\n"
+        "Caused by: java.sql.SQLTransientConnectionException: HikariPool-1 - Connection is not available, "
+        "request timed out after 30000ms. host 10.0.3.17\n"
+        f"{frames}"
+    )
+
+
+def node_trace(depth: int, rng: random.Random) -> str:
+    frames = "\n".join(
+        f"    at handler (/srv/app/routes/order.js:{rng.randint(1, 500)}:{rng.randint(1, 80)})"
+        for _ in range(depth)
+    )
+    return (
+        'Error: Request failed with status code 502 message: "upstream unavailable"\n'
+        f"{frames}"
+    )
+
+
+def build_corpus(rng: random.Random):
+    corpus = []
+    for depth in (5, 40, 150, 400):
+        corpus.append((f".NET x{depth}", dotnet_trace(depth, rng)))
+        corpus.append((f"Java x{depth}", java_trace(depth, rng)))
+        corpus.append((f"Node x{depth}", node_trace(depth, rng)))
+    return corpus
+
+
+def measure(fn, text: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="错误日志归一化性能基准")
+    parser.add_argument("--repeat", type=int, default=200, help="每条语料的重复次数")
+    args = parser.parse_args()
+
+    corpus = build_corpus(random.Random(42))
+    print(f"{'语料':<12}{'长度':>8}{'旧实现(us)':>14}{'新实现(us)':>14}{'加速比':>8}")
+    total_legacy = total_new = 0.0
+    for name, text in corpus:
+        legacy = measure(lambda t: (legacy_simplify(t), legacy_fingerprint(t)), text, args.repeat)
+        # 绕过缓存，测量真实的单次处理成本
+        new = measure(_normalize_error, text, args.repeat)
+        total_legacy += legacy
+        total_new += new
+        print(f"{name:<12}{len(text):>8}{legacy:>14.1f}{new:>14.1f}{legacy / new:>8.1f}")
+    print(f"{'合计':<12}{'':>8}{total_legacy:>14.1f}{total_new:>14.1f}{total_legacy / total_new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""分析流水线端到端性能基准
+
+在本地启动 Elasticsearch、Deepseek 和企业微信机器人的替身服务（benchmarks/stubs.py），
+把合成的错误日志写入替身ES，然后用真实的 ESService / DeepseekService / WeChatService 和
+AnalysisPipeline 执行一次完整的分析任务，统计：
+
+- 吞吐：每秒处理的错误条数
+- 端到端延迟：从ES读出到分析和告警完成（进入入库缓冲）的 p50 / p99
+- 每条错误的LLM调用次数（重复错误命中缓存或合并为同一次请求）
+
+数据库默认使用临时SQLite文件，可用 --db-url 指向测试用的MySQL。
+其余配置（LLM_CONCURRENCY、LLM_BATCH_SIZE、ALERT_WINDOW_SECONDS 等）沿用环境变量，
+便于对比不同配置下的性能。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_pipeline [--errors 2000] [--dup-ratio 0.9] [--llm-latency-ms 800]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from .stubs import FakeDeepseek, FakeElasticsearch, FakeWeCom
+
+_APPS = ["order-service", "payment-service", "jobscheduler"]
+
+
+def _dotnet_error(kind: int, rng: random.Random) -> dict:
+    return {
+        "Exception": f"System.InvalidOperationException: Order {rng.randint(1, 10 ** 6)} is in invalid state {kind}",
+        "Message": "处理订单失败",
+        "StackTrace": (
+            f"   at Shop.Orders.OrderService.Handle{kind}(Order order) in /src/Orders/OrderService.cs:line {rng.randint(10, 900)}\n"
+            "   at Shop.Orders.OrderController.Post(OrderRequest request) in /src/Orders/OrderController.cs:line 42\n"
+            "   at Microsoft.AspNetCore.Mvc.Infrastructure.ActionMethodExecutor.Execute(Object controller)"
+        ),
+    }
+
+
+def _java_error(kind: int, rng: random.Random) -> dict:
+    return {
+        "Exception": "org.springframework.dao.DataAccessResourceFailureException: Unable to acquire JDBC Connection",
+        "Message": f"request timed out after {rng.randint(1000, 30000)}ms",
+        "StackTrace": (
+            f"\tat com.example.payment.PaymentRepository.find{kind}(PaymentRepository.java:{rng.randint(10, 900)})\n"
+            "\tat com.example.payment.PaymentService.pay(PaymentService.java:88)\n"
+            "Caused by: java.sql.SQLTransientConnectionException: HikariPool-1 - Connection is not available\n"
+            "\tat com.zaxxer.hikari.pool.HikariPool.getConnection(HikariPool.java:696)"
+        ),
+    }
+
+
+def _node_error(kind: int, rng: random.Random) -> dict:
+    return {
+        "Exception": "Error: Request failed with status code 502",
+        "Message": f"upstream {rng.randint(1, 255)}.{rng.randint(1, 255)}.0.1 unavailable",
+        "StackTrace": (
+            f"    at handler{kind} (/srv/app/routes/job.js:{rng.randint(1, 500)}:{rng.randint(1, 80)})\n"
+            "    at Layer.handle (/srv/app/node_modules/express/lib/router/layer.js:95:5)"
+        ),
+    }
+
+
+def build_docs(count: int, dup_ratio: float, window_seconds: float, seed: int = 42) -> Tuple[List, int]:
+    """生成 count 条错误日志，其中约 (1 - dup_ratio) 比例为不同的错误，返回 (文档列表, 不同错误数)
+
+    同一类错误的行号、ID等易变内容每次不同，与真实日志一样需要归一化后才能识别为重复。
+    """
+    rng = random.Random(seed)
+    kinds = max(1, round(count * (1 - dup_ratio)))
+    generators = [_dotnet_error, _java_error, _node_error]
+    end = int(time.time() * 1000)
+    docs = []
+    for index in range(count):
+        # 前 kinds 条各不相同，之后随机重复
+        kind = index if index < kinds else rng.randrange(kinds)
+        source = generators[kind % len(generators)](kind, rng)
+        timestamp = end - int(rng.uniform(0, window_seconds) * 1000)
+        source.update({
+            "@timestamp": datetime.fromtimestamp(timestamp / 1000, timezone.utc).isoformat().replace("+00:00", "Z"),
+            "LogLevel": "fail",
+            "ApplicationId": _APPS[kind % len(_APPS)],
+            "Request.Path": f"/api/{_APPS[kind % len(_APPS)]}/{kind}",
+        })
+        docs.append((f"bench-{index}", timestamp, source))
+    return docs, kinds
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析流水线端到端性能基准")
+    parser.add_argument("--errors", type=int, default=2000, help="错误日志条数")
+    parser.add_argument("--dup-ratio", type=float, default=0.9, help="重复错误的比例，0表示每条都不同")
+    parser.add_argument("--es-latency-ms", type=float, default=20, help="ES每次请求的延迟")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="LLM每次请求的延迟")
+    parser.add_argument("--llm-item-latency-ms", type=float, default=150, help="批量请求中每多一条增加的延迟")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="LLM返回500的比例")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="LLM返回429的比例")
+    parser.add_argument("--webhook-latency-ms", type=float, default=50, help="企业微信每次请求的延迟")
+    parser.add_argument("--webhook-429-rate", type=float, default=0.0, help="企业微信返回429的比例")
+    parser.add_argument("--streaming", action="store_true", help="使用流式分析（LLM_STREAMING=true）")
+    parser.add_argument("--es-aggregate", action="store_true", help="在ES中预聚合，每组只读取一条（ES_AGGREGATE=true）")
+    parser.add_argument("--db-url", help="数据库连接，默认使用临时SQLite文件")
+    args = parser.parse_args()
+
+    docs, kinds = build_docs(args.errors, args.dup_ratio, window_seconds=240)
+    es = FakeElasticsearch(docs, latency=args.es_latency_ms / 1000).start()
+    llm = FakeDeepseek(latency=args.llm_latency_ms / 1000, item_latency=args.llm_item_latency_ms / 1000,
+                       error_rate=args.llm_error_rate, throttle_rate=args.llm_429_rate, seed=1).start()
+    wecom = FakeWeCom(latency=args.webhook_latency_ms / 1000, throttle_rate=args.webhook_429_rate, seed=2).start()
+
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.environ.update({
+        "ES_HOST": es.url,
+        "DEEPSEEK_API_URL": f"{llm.url}/chat/completions",
+        "DEEPSEEK_API_KEY": "bench",
+        "WECHAT_WEBHOOK_URL": f"{wecom.url}/cgi-bin/webhook/send?key=bench",
+        "MYSQL_URL": args.db_url or f"sqlite:///{workdir}/bench.db?check_same_thread=false",
+        "ES_MAX_HITS_PER_RUN": str(max(args.errors, 1)),
+        "ES_INGEST_LAG_SECONDS": "0",
+        # 替身服务的重试等待按毫秒计，避免退避时间掩盖流水线本身的耗时
+        "HTTP_BACKOFF_SECONDS": os.getenv("HTTP_BACKOFF_SECONDS", "0.05"),
+        "LLM_STREAMING": "true" if args.streaming else os.getenv("LLM_STREAMING", "false"),
+        "ES_AGGREGATE": "true" if args.es_aggregate else os.getenv("ES_AGGREGATE", "false"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    # 企业微信每分钟20条的限流会让告警成为瓶颈，基准默认不限流，需要时通过环境变量指定
+    os.environ.setdefault("WEBHOOK_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("WEBHOOK_RATE_STORE", "memory")
+
+    import logging
+    logging.basicConfig(level=os.environ["LOG_LEVEL"].upper())
+
+    # 环境变量设置完成后再导入，模块级配置才会生效
+    from app import metrics
+    from app.cache import AnalysisCache
+    from app.database import SessionLocal, engine
+    from app.models import Base
+    from app.pipeline import AnalysisPipeline
+    from app.services import DeepseekService, ESService, WeChatService
+
+    Base.metadata.create_all(bind=engine)
+    wechat_service = WeChatService()
+    pipeline = AnalysisPipeline(ESService(), DeepseekService(), wechat_service, AnalysisCache())
+
+    # 记录每条日志从ES读出到处理完成的时间
+    read_at: Dict[str, float] = {}
+    latencies: List[float] = []
+    represented = [0]  # 处理的记录代表的错误条数，预聚合时一条记录代表一组
+    iter_errors_since = pipeline.es_service.iter_errors_since
+    build_row = pipeline._build_row
+
+    def timed_iter(*a, **kw):
+        for entry in iter_errors_since(*a, **kw):
+            read_at[entry["es_id"]] = time.perf_counter()
+            yield entry
+
+    def timed_build_row(error, analysis):
+        latencies.append(time.perf_counter() - read_at[error["es_id"]])
+        represented[0] += error.get("occurrences") or 1
+        return build_row(error, analysis)
+
+    pipeline.es_service.iter_errors_since = timed_iter
+    pipeline._build_row = timed_build_row
+
+    db = SessionLocal()
+    started = time.perf_counter()
+    try:
+        processed = asyncio.run(pipeline.run(db))
+        wechat_service.flush_alerts()
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    for stub in (es, llm, wecom):
+        stub.stop()
+
+    llm_errors = sum(metrics.LLM_REQUESTS_TOTAL.value(mode=mode, status=status)
+                     for mode in ("single", "batch", "stream")
+                     for status in ("http_error", "timeout", "network_error", "format_error"))
+    errors = represented[0]
+    print(f"错误日志: {args.errors} 条，{kinds} 类（重复比例 {args.dup_ratio:.0%}），"
+          f"已处理 {processed} 条记录，代表 {errors} 条错误")
+    print(f"总耗时: {elapsed:.2f}s，吞吐: {errors / elapsed:.1f} 条/秒")
+    print(f"端到端延迟: p50 {_percentile(latencies, 50) * 1000:.0f}ms，p99 {_percentile(latencies, 99) * 1000:.0f}ms")
+    print(f"LLM: {llm.requests} 次请求（含重试），分析 {llm.items} 条，"
+          f"每条错误 {llm.requests / max(errors, 1):.3f} 次调用，失败 {int(llm_errors)} 次")
+    print(f"ES: {es.requests} 次请求；企业微信: {wecom.requests} 次请求，{len(wecom.messages)} 条消息")
+
+
+if __name__ == "__main__":
+    main()
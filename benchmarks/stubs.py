@@ -0,0 +1,294 @@
+"""本地替身服务：Elasticsearch、Deepseek 和企业微信机器人
+
+只实现流水线用到的接口，每个服务都可以配置响应延迟、错误率和429限流比例，
+用于在没有真实外部服务的环境中压测 ESService / DeepseekService / WeChatService。
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+class StubServer:
+    """替身服务基类
+
+    latency 为每次请求的基础延迟（秒），实际延迟在 ±jitter 比例内随机浮动；
+    error_rate 的请求返回500，throttle_rate 的请求返回429并带 Retry-After。
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 0.1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StubServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 保持长连接，与真实服务一致
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub._dispatch(self, body)
+
+            do_GET = do_POST = do_DELETE = do_HEAD = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _roll(self) -> Tuple[float, Optional[int]]:
+        """决定本次请求的延迟和需要注入的错误状态码"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter))
+            value = self._rng.random()
+            if value < self.throttle_rate:
+                self.throttled += 1
+                return delay, 429
+            if value < self.throttle_rate + self.error_rate:
+                self.errors += 1
+                return delay, 500
+            return delay, None
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, body: bytes):
+        delay, status = self._roll()
+        if delay > 0:
+            time.sleep(delay)
+        if status == 429:
+            self.send(handler, 429, {"error": "rate limited"}, {"Retry-After": f"{self.retry_after:g}"})
+        elif status is not None:
+            self.send(handler, status, {"error": "injected failure"})
+        else:
+            self.handle(handler, body)
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        raise NotImplementedError
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def send(self, handler: BaseHTTPRequestHandler, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in {**self.headers(), **(headers or {})}.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeElasticsearch(StubServer):
+    """Elasticsearch 7.x 替身：支持 point-in-time、按 @timestamp 排序的 search_after 翻页、时间范围过滤，
+    以及预聚合模式使用的 composite 聚合（terms分组 + top_hits + min）
+
+    docs 为 (_id, epoch毫秒, _source) 列表，查询中除 @timestamp 范围和 ids 排除外的条件都视为命中；
+    composite 的脚本分组按 ESService 的异常类型脚本处理（取字段第一个冒号之前的部分）。
+    """
+
+    def __init__(self, docs: List[Tuple[str, int, dict]], **kwargs):
+        super().__init__(**kwargs)
+        # 按时间戳排序，同一时间戳按写入顺序，对应真实ES中PIT的 _shard_doc 兜底排序
+        self.docs = sorted(((ts, seq, doc_id, source) for seq, (doc_id, ts, source) in enumerate(docs)))
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Elastic-Product": "Elasticsearch"}
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        path = handler.path.split("?", 1)[0]
+        if handler.command in ("GET", "HEAD") and path == "/":
+            self.send(handler, 200, {"version": {"number": "7.17.9", "build_flavor": "default"},
+                                     "tagline": "You Know, for Search"})
+        elif path.endswith("/_pit") and handler.command == "POST":
+            self.send(handler, 200, {"id": "stub-pit"})
+        elif path == "/_pit" and handler.command == "DELETE":
+            self.send(handler, 200, {"succeeded": True, "num_freed": 1})
+        elif path.endswith("/_search"):
+            self.send(handler, 200, self._search(json.loads(body or b"{}")))
+        else:
+            self.send(handler, 404, {"error": f"unsupported {handler.command} {path}"})
+
+    @staticmethod
+    def _time_range(query: dict) -> Tuple[int, int]:
+        for clause in query.get("bool", {}).get("must", []):
+            bounds = clause.get("range", {}).get("@timestamp")
+            if bounds is not None:
+                if bounds.get("format") != "epoch_millis":
+                    raise ValueError("替身ES只支持epoch_millis格式的时间范围")
+                lte = int(bounds["lt"]) - 1 if "lt" in bounds else int(bounds.get("lte", 2 ** 62))
+                return int(bounds.get("gte", 0)), lte
+        return 0, 2 ** 62
+
+    @staticmethod
+    def _excluded_ids(query: dict) -> set:
+        excluded = set()
+        for clause in query.get("bool", {}).get("must_not", []):
+            excluded.update(clause.get("ids", {}).get("values", []))
+        return excluded
+
+    @staticmethod
+    def _group_value(source: dict, spec: dict):
+        terms = spec["terms"]
+        if "field" in terms:
+            return source.get(terms["field"].removesuffix(".keyword"))
+        field = terms["script"]["params"]["field"].removesuffix(".keyword")
+        value = str(source.get(field) or "")
+        return value.split(":", 1)[0] if ":" in value[1:] else value
+
+    def _aggregate(self, matched: list, composite: dict) -> dict:
+        names = [next(iter(source)) for source in composite["sources"]]
+        specs = [next(iter(source.values())) for source in composite["sources"]]
+        groups: Dict[tuple, list] = {}
+        for doc in matched:
+            key = tuple(self._group_value(doc[3], spec) for spec in specs)
+            groups.setdefault(key, []).append(doc)
+        # 与ES一样按分组键排序，null排在最前
+        ordered = sorted(groups, key=lambda key: [(value is not None, str(value or "")) for value in key])
+        after = composite.get("after")
+        if after is not None:
+            after_key = [(after[name] is not None, str(after[name] or "")) for name in names]
+            ordered = [key for key in ordered
+                       if [(value is not None, str(value or "")) for value in key] > after_key]
+        buckets = []
+        for key in ordered[:composite["size"]]:
+            docs = groups[key]
+            ts, seq, doc_id, source = max(docs)
+            buckets.append({
+                "key": dict(zip(names, key)),
+                "doc_count": len(docs),
+                "latest": {"hits": {"hits": [{"_index": "log-stub", "_id": doc_id, "_source": source,
+                                              "sort": [ts]}]}},
+                "first_seen": {"value": float(min(docs)[0])},
+            })
+        result = {"buckets": buckets}
+        if buckets:
+            result["after_key"] = buckets[-1]["key"]
+        return result
+
+    def _search(self, body: dict) -> dict:
+        query = body.get("query", {})
+        gte, lte = self._time_range(query)
+        excluded = self._excluded_ids(query)
+        matched = [doc for doc in self.docs if gte <= doc[0] <= lte and doc[2] not in excluded]
+        if "aggs" in body:
+            groups = self._aggregate(matched, body["aggs"]["groups"]["composite"])
+            return {"took": 1, "timed_out": False, "hits": {"hits": []}, "aggregations": {"groups": groups}}
+        order = body["sort"][0]["@timestamp"]["order"]
+        size = body.get("size", 10)
+        if order == "desc":
+            matched.reverse()
+        search_after = body.get("search_after")
+        if search_after is not None:
+            key = (int(search_after[0]), int(search_after[1]) if len(search_after) > 1 else -1)
+            if order == "asc":
+                matched = [doc for doc in matched if (doc[0], doc[1]) > key]
+            else:
+                matched = [doc for doc in matched if (doc[0], doc[1]) < key]
+        hits = [
+            {"_index": "log-stub", "_id": doc_id, "_source": source, "sort": [ts, seq]}
+            for ts, seq, doc_id, source in matched[:size]
+        ]
+        result = {"took": 1, "timed_out": False, "hits": {"total": {"value": len(matched)}, "hits": hits}}
+        if "pit" in body:
+            result["pit_id"] = body["pit"]["id"]
+        return result
+
+
+class FakeDeepseek(StubServer):
+    """Deepseek chat/completions 替身，支持单条、批量（json结果）和流式（SSE）请求
+
+    item_latency 为批量请求中每多一条错误增加的延迟，用于模拟输出token随条数增长。
+    """
+
+    _NUMBERED = re.compile(r'^\[(\d+)\] ', re.M)
+
+    def __init__(self, item_latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.item_latency = item_latency
+        self.items = 0  # 分析过的错误条数（批量请求按条数累计）
+
+    @staticmethod
+    def _analysis(text: str) -> str:
+        return ("1. 错误类型：" + text[:40].replace("\n", " ") + "\n2. 可能原因：依赖服务不可用"
+                "\n3. 解决方案：检查下游服务状态和连接配置")
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        request = json.loads(body or b"{}")
+        prompt = request["messages"][-1]["content"]
+        numbered = self._NUMBERED.findall(prompt)
+        count = len(numbered) if request.get("response_format") else 1
+        with self._lock:
+            self.items += count
+        if count > 1 and self.item_latency:
+            time.sleep(self.item_latency * (count - 1))
+        usage = {"prompt_tokens": len(prompt) // 2, "completion_tokens": 60 * count}
+
+        if count > 1:
+            results = [{"id": int(index), "analysis": self._analysis(f"批量第{index}条")} for index in numbered]
+            content = json.dumps({"results": results}, ensure_ascii=False)
+        else:
+            content = self._analysis(prompt.split("\n", 1)[-1])
+
+        if not request.get("stream"):
+            self.send(handler, 200, {"choices": [{"message": {"role": "assistant", "content": content}}],
+                                     "usage": usage})
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def write(data: str):
+            chunk = data.encode()
+            handler.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            handler.wfile.flush()
+
+        for line in content.split("\n"):
+            event = {"choices": [{"index": 0, "delta": {"content": line + "\n"}}]}
+            write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n")
+        write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+        write("data: [DONE]\n\n")
+        handler.wfile.write(b"0\r\n\r\n")
+
+
+class FakeWeCom(StubServer):
+    """企业微信群机器人替身，记录收到的消息"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages: List[str] = []
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        message = json.loads(body or b"{}")
+        with self._lock:
+            self.messages.append(message.get("markdown", {}).get("content", ""))
+        self.send(handler, 200, {"errcode": 0, "errmsg": "ok"})
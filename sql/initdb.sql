@@ -1,18 +1,150 @@
 CREATE DATABASE log_analysis CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
 -- 切换数据库
 USE log_analysis;
+-- 已有数据库升级时不需要执行本文件：python -m app.migrate 会创建新增的表，并给已有的 error_logs 补齐新增字段和索引
 CREATE TABLE `error_logs` (
   `id` int(11) NOT NULL AUTO_INCREMENT COMMENT 'id',
   `log_time` datetime NOT NULL COMMENT '日志记录时间',
-  `error_message` text NOT NULL COMMENT '错误日志内容',
-  `analysis_result` text COMMENT 'AI分析结果',
+  `error_message` text NOT NULL COMMENT '错误日志内容（较长时为预览）',
+  `analysis_result` text COMMENT 'AI分析结果（较长时为预览）',
   `application_id` varchar(100) NOT NULL COMMENT '应用ID',
   `created_at` datetime NOT NULL COMMENT '创建时间',
   `request_path` varchar(500) DEFAULT NULL COMMENT '请求路径',
+  `es_id` varchar(64) DEFAULT NULL COMMENT 'ES文档_id',
+  `fingerprint` varchar(64) DEFAULT NULL COMMENT '错误特征值',
+  `message_hash` varchar(64) DEFAULT NULL COMMENT '错误内容全文在blobs表中的哈希值',
+  `analysis_hash` varchar(64) DEFAULT NULL COMMENT '分析结果全文在blobs表中的哈希值',
+  `occurrences` int(11) NOT NULL DEFAULT '1' COMMENT 'ES预聚合时该记录代表的出现次数',
   PRIMARY KEY (`id`),
-  KEY `idx_application_id` (`application_id`),
+  UNIQUE KEY `uk_es_id` (`es_id`),
+  KEY `idx_app_created_at` (`application_id`, `created_at`, `id`),
+  KEY `idx_fingerprint_created_at` (`fingerprint`, `created_at`, `id`),
+  KEY `idx_app_log_time` (`application_id`, `log_time`),
   KEY `idx_log_time` (`log_time`),
-  KEY `idx_created_at` (`created_at`)
+  KEY `idx_request_path` (`request_path`(191)),
+  KEY `idx_created_at_id` (`created_at`, `id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `analysis_cache` (
+  `fingerprint` varchar(64) NOT NULL COMMENT '错误特征值',
+  `analysis_result` text NOT NULL COMMENT 'AI分析结果',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  `expires_at` datetime NOT NULL COMMENT '过期时间',
+  PRIMARY KEY (`fingerprint`),
+  KEY `idx_expires_at` (`expires_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `reanalysis_queue` (
+  `fingerprint` varchar(64) NOT NULL COMMENT '分析失败的错误特征值',
+  `error_message` text NOT NULL COMMENT '用于重新分析的错误信息',
+  `attempts` int(11) NOT NULL DEFAULT '0' COMMENT '已重试次数',
+  `next_attempt_at` datetime NOT NULL COMMENT '下次重试时间',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  PRIMARY KEY (`fingerprint`),
+  KEY `idx_next_attempt_at` (`next_attempt_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `alert_dedup` (
+  `fingerprint` varchar(64) NOT NULL COMMENT '错误特征值',
+  `first_seen` datetime NOT NULL COMMENT '去重窗口内首次出现时间',
+  `last_seen` datetime NOT NULL COMMENT '最近一次出现时间',
+  `count` int(11) NOT NULL DEFAULT '1' COMMENT '窗口内累计次数',
+  `expires_at` datetime NOT NULL COMMENT '过期时间',
+  PRIMARY KEY (`fingerprint`),
+  KEY `idx_expires_at` (`expires_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `webhook_send_slots` (
+  `slot` int(11) NOT NULL COMMENT '槽位编号',
+  `sent_at` datetime NOT NULL COMMENT '最近一次发送时间',
+  PRIMARY KEY (`slot`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `ingest_checkpoints` (
+  `name` varchar(50) NOT NULL COMMENT '检查点名称',
+  `last_timestamp` bigint(20) DEFAULT NULL COMMENT '已处理的最大@timestamp（毫秒）',
+  `last_ids` text COMMENT '该时间戳上已处理的ES文档_id（JSON数组）',
+  `updated_at` datetime NOT NULL COMMENT '更新时间',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `schedules` (
+  `name` varchar(50) NOT NULL COMMENT '定时任务名称',
+  `interval_seconds` int(11) DEFAULT NULL COMMENT '执行间隔（秒），与cron二选一',
+  `cron` varchar(100) DEFAULT NULL COMMENT 'cron表达式（分 时 日 月 周）',
+  `enabled` tinyint(1) NOT NULL DEFAULT '1' COMMENT '是否启用',
+  `last_run_at` datetime DEFAULT NULL COMMENT '上次执行时间',
+  `next_run_at` datetime DEFAULT NULL COMMENT '下次执行时间',
+  `lease_owner` varchar(100) DEFAULT NULL COMMENT '正在执行该任务的进程',
+  `lease_until` datetime DEFAULT NULL COMMENT '执行租约到期时间',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  `updated_at` datetime NOT NULL COMMENT '更新时间',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `schedule_runs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT 'id',
+  `schedule_name` varchar(50) NOT NULL COMMENT '定时任务名称',
+  `trigger` varchar(20) NOT NULL COMMENT '触发方式：schedule/manual',
+  `status` varchar(20) NOT NULL COMMENT '状态：running/success/failed',
+  `processed` int(11) DEFAULT NULL COMMENT '处理的日志条数',
+  `error` text COMMENT '错误信息',
+  `started_at` datetime NOT NULL COMMENT '开始时间',
+  `finished_at` datetime DEFAULT NULL COMMENT '结束时间',
+  `duration_ms` int(11) DEFAULT NULL COMMENT '耗时（毫秒）',
+  PRIMARY KEY (`id`),
+  KEY `idx_schedule_started_at` (`schedule_name`, `started_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `error_groups` (
+  `fingerprint` varchar(64) NOT NULL COMMENT '错误特征值',
+  `summary` varchar(500) NOT NULL COMMENT '归一化后的错误摘要',
+  `first_seen` datetime NOT NULL COMMENT '最早的日志时间',
+  `last_seen` datetime NOT NULL COMMENT '最近的日志时间',
+  `total_count` bigint(20) NOT NULL DEFAULT '0' COMMENT '累计次数',
+  PRIMARY KEY (`fingerprint`),
+  KEY `idx_last_seen` (`last_seen`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `error_group_apps` (
+  `fingerprint` varchar(64) NOT NULL COMMENT '错误特征值',
+  `application_id` varchar(100) NOT NULL COMMENT '应用ID',
+  `first_seen` datetime NOT NULL COMMENT '该应用中最早的日志时间',
+  `last_seen` datetime NOT NULL COMMENT '该应用中最近的日志时间',
+  `count` bigint(20) NOT NULL DEFAULT '0' COMMENT '该应用中的累计次数',
+  PRIMARY KEY (`fingerprint`, `application_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `error_group_hourly` (
+  `bucket_start` datetime NOT NULL COMMENT '日志时间所在小时',
+  `application_id` varchar(100) NOT NULL COMMENT '应用ID',
+  `fingerprint` varchar(64) NOT NULL COMMENT '错误特征值',
+  `count` int(11) NOT NULL DEFAULT '0' COMMENT '该小时内的次数',
+  PRIMARY KEY (`bucket_start`, `application_id`, `fingerprint`),
+  KEY `idx_fingerprint_bucket` (`fingerprint`, `bucket_start`),
+  KEY `idx_app_bucket` (`application_id`, `bucket_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `blobs` (
+  `hash` varchar(64) NOT NULL COMMENT '原文的SHA-256',
+  `encoding` varchar(10) NOT NULL COMMENT '压缩方式：zlib/zstd/raw',
+  `data` mediumblob NOT NULL COMMENT '（压缩后的）内容',
+  `size` int(11) NOT NULL COMMENT '原文字符数',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  PRIMARY KEY (`hash`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `work_items` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT 'id',
+  `es_id` varchar(64) NOT NULL COMMENT 'ES文档_id',
+  `payload` mediumtext NOT NULL COMMENT '错误日志对象（JSON）',
+  `attempts` int(11) NOT NULL DEFAULT '0' COMMENT '已领取次数',
+  `available_at` datetime NOT NULL COMMENT '可领取时间，领取后顺延租约时长',
+  `lease_owner` varchar(100) DEFAULT NULL COMMENT '最近一次领取的worker',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_es_id` (`es_id`),
+  KEY `idx_available_at_id` (`available_at`, `id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 初始化模拟数据